@@ -1,9 +1,13 @@
 import functions_framework
-from google.cloud import pubsub_v1
-from google.cloud import storage
-import json
 import os
 
+# 発行処理は backend の共通モジュールを使う（デプロイ時に src を同梱する）
+from src.drive_change_publisher import DriveChangePublisher
+
+# ウォームインスタンス内で共有するパブリッシャー（同時に処理中のリクエストの通知をまとめて送信）
+publisher = DriveChangePublisher(os.getenv('PROJECT_ID'), 'drive-changes')
+PUBLISH_TIMEOUT_SECONDS = float(os.getenv('PUBLISH_TIMEOUT_SECONDS', '30'))
+
 @functions_framework.http
 def handle_drive_change(request):
     """Google Driveの変更を検知してPub/Subに通知するCloud Function
@@ -29,13 +33,6 @@ def handle_drive_change(request):
     if not all(field in data for field in required_fields):
         return 'Missing required fields', 400
 
-    # Pub/Subクライアントの初期化
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(
-        os.getenv('PROJECT_ID'),
-        'drive-changes'
-    )
-
     # メッセージデータの作成
     message = {
         'file_id': data['fileId'],
@@ -44,13 +41,11 @@ def handle_drive_change(request):
         'timestamp': data.get('time', None)
     }
 
-    # Pub/Subにメッセージを発行
+    # Pub/Subにメッセージを発行（同じファイル・同じ種類の通知が発行中であればその発行を待つ）
     try:
-        future = publisher.publish(
-            topic_path,
-            json.dumps(message).encode('utf-8')
-        )
-        future.result()  # 送信完了を待機
+        future = publisher.publish(message)
+        # 他のリクエストの通知と同じバッチで送信され、受理されてから応答する
+        future.result(timeout=PUBLISH_TIMEOUT_SECONDS)
         return 'Message published successfully', 200
     except Exception as e:
         return f'Error publishing message: {str(e)}', 500
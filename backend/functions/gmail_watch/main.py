@@ -1,15 +1,27 @@
 import functions_framework
 from google.cloud import pubsub_v1
+from google.cloud import firestore
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 import json
 import os
 import base64
 
+# 添付ファイルの取り込みは backend の共通モジュールを使う（デプロイ時に src を同梱する）
+from src.services.gmail_drive_service import GmailDriveService
+from src.services.gmail_ingestion import GmailIngestor, FirestoreIngestionStore
+
 # 環境変数から設定を読み込み
 PROJECT_ID = os.getenv('PROJECT_ID')
 TOPIC_NAME = os.getenv('PUBSUB_TOPIC')
 CREDENTIALS_PATH = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+TARGET_FOLDER_ID = os.getenv('GMAIL_TARGET_FOLDER_ID')
+GMAIL_MAILBOX = os.getenv('GMAIL_MAILBOX', 'me')
+# 続けて失敗したメッセージをデッドレターとして記録するまでの通知の回数
+GMAIL_MAX_MESSAGE_ATTEMPTS = int(os.getenv('GMAIL_MAX_MESSAGE_ATTEMPTS', '5'))
+
+# ウォームインスタンス間で再利用する取り込みエンジン
+_ingestor = None
 
 def get_gmail_service():
     """Gmail APIサービスの初期化"""
@@ -45,62 +57,40 @@ def setup_gmail_watch(request):
             'error': str(e)
         }, 500
 
+def get_ingestor() -> GmailIngestor:
+    """取り込みエンジンをインスタンス内で1度だけ生成して再利用"""
+    global _ingestor
+    if _ingestor is None:
+        drive = GmailDriveService()
+        _ingestor = GmailIngestor(
+            gmail=get_gmail_service(),
+            store=FirestoreIngestionStore(firestore.Client(), GMAIL_MAILBOX),
+            save_attachments=drive.save_attachments_to_drive,
+            folder_id=TARGET_FOLDER_ID,
+            user_id=GMAIL_MAILBOX,
+            max_message_attempts=GMAIL_MAX_MESSAGE_ATTEMPTS
+        )
+    return _ingestor
+
 @functions_framework.cloud_event
 def process_gmail_notification(cloud_event):
-    """Pub/Subからのメール通知を処理する関数"""
+    """Pub/Subからのメール通知を処理する関数
+
+    前回処理した historyId 以降に追加されたメールの添付ファイルをまとめて取得し、
+    Googleドライブに保存する。処理後の historyId は Firestore に保存する。
+    """
     try:
         # イベントデータの取得
         pubsub_message = base64.b64decode(cloud_event.data["message"]["data"]).decode()
         message_data = json.loads(pubsub_message)
         
-        # Gmail APIサービスの初期化
-        service = get_gmail_service()
-        
-        # 履歴の取得
         history_id = message_data.get('historyId')
         if not history_id:
             return
         
-        # メール履歴の取得
-        history = service.users().history().list(
-            userId='me',
-            startHistoryId=history_id
-        ).execute()
-        
-        # 添付ファイルの処理
-        for history_item in history.get('history', []):
-            process_history_item(service, history_item)
-            
-        return {'status': 'success'}
+        result = get_ingestor().process_notification(history_id)
+        print(f'Gmail ingestion: {result}')
+        return result
     except Exception as e:
         print(f'Error processing Gmail notification: {str(e)}')
         return {'status': 'error', 'error': str(e)}, 500
-
-def process_history_item(service, history_item):
-    """履歴アイテムから添付ファイルを処理"""
-    for message_added in history_item.get('messagesAdded', []):
-        message = service.users().messages().get(
-            userId='me',
-            id=message_added['message']['id']
-        ).execute()
-        
-        # 添付ファイルの処理
-        if 'parts' in message.get('payload', {}):
-            for part in message['payload']['parts']:
-                if part.get('filename'):
-                    process_attachment(service, message['id'], part)
-
-def process_attachment(service, message_id, part):
-    """添付ファイルの処理とGoogleドライブへの保存"""
-    if not part.get('body', {}).get('attachmentId'):
-        return
-        
-    attachment = service.users().messages().attachments().get(
-        userId='me',
-        messageId=message_id,
-        id=part['body']['attachmentId']
-    ).execute()
-    
-    # ここでGoogleドライブへの保存処理を実装
-    # この部分は別のモジュールで実装予定
-    # save_to_drive(attachment, part['filename'])
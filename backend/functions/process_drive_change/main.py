@@ -6,8 +6,98 @@ from google.cloud import vision
 from google.cloud import firestore
 from google.cloud import bigquery
 from google.cloud import drive_v3
+from googleapiclient.discovery import build
 import functions_framework
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
+
+# 変更フィードの取り込みは backend の共通モジュールを使う（デプロイ時に src を同梱する）
+from src.drive_change_feed import (
+    DriveChangeFeed, FileChangeDispatcher, FirestorePageTokenStore, poll_response
+)
+from src.idempotency import FirestoreIdempotencyStore, IdempotentProcessor, processing_key
+from src.matcher import NameMatcher
+from src.ocr_cache import FirestoreCacheBackend, OcrResultCache, digest_key
+
+# OCR結果キャッシュのキーに含めるエンジンのバージョン（変更時は再OCRされる）
+VISION_OCR_VERSION = os.getenv('VISION_OCR_VERSION', 'text_detection')
+# 変更フィードのポーリング1回で読むページ数（1ページ1000件）と、OCRを並行して行う数
+DRIVE_FEED_MAX_PAGES = int(os.getenv('DRIVE_FEED_MAX_PAGES', '10'))
+DRIVE_FEED_OCR_WORKERS = int(os.getenv('DRIVE_FEED_OCR_WORKERS', '8'))
+# 同じファイルの版を処理中とみなす時間（これを過ぎると別のインスタンスが引き継ぐ）
+PROCESSING_LEASE_SECONDS = float(os.getenv('PROCESSING_LEASE_SECONDS', '600'))
+SUPPORTED_TYPES = ['image/', 'application/pdf']
+
+# ウォームインスタンス間で再利用するクライアント
+_clients = {}
+
+def get_client(name: str, factory):
+    """クライアントをインスタンス内で1度だけ生成して再利用"""
+    if name not in _clients:
+        _clients[name] = factory()
+    return _clients[name]
+
+_processor = None
+
+def get_processor() -> IdempotentProcessor:
+    """ファイルの版（file_id, modifiedTime, md5Checksum）ごとの処理状態を管理するプロセッサ"""
+    global _processor
+    if _processor is None:
+        _processor = IdempotentProcessor(
+            FirestoreIdempotencyStore(get_client('firestore', firestore.Client)),
+            lease_seconds=PROCESSING_LEASE_SECONDS
+        )
+    return _processor
+
+# ユーザーマスターのインスタンス内キャッシュ（リスナーで差分を反映）
+_active_users = {}
+_users_lock = threading.Lock()
+_users_ready = threading.Event()
+_users_watch = None
+_users_version = 0
+
+# ユーザーマスターから構築した照合エンジン（backend の API と同じ正規化・照合を行う）
+_name_matcher = NameMatcher()
+_name_matcher_version = None
+
+def _on_users_snapshot(doc_snapshots, changes, read_time):
+    """usersコレクションの差分をキャッシュに反映"""
+    global _users_version
+    with _users_lock:
+        _users_version += 1
+        for change in changes:
+            doc = change.document
+            user_data = doc.to_dict() if change.type.name != 'REMOVED' else None
+            if user_data is None or user_data.get('is_deleted', False):
+                _active_users.pop(doc.id, None)
+            else:
+                _active_users[doc.id] = user_data
+    _users_ready.set()
+
+def get_active_users(timeout: float = 30.0) -> list:
+    """論理削除されていないユーザーの (user_id, ユーザーデータ) 一覧を取得
+
+    初回呼び出し時にリスナーを登録し、以降はウォームインスタンス間で
+    キャッシュを再利用する。
+    """
+    global _users_watch
+    if _users_watch is None:
+        _users_watch = get_client('firestore', firestore.Client).collection('users').on_snapshot(_on_users_snapshot)
+    if not _users_ready.wait(timeout):
+        raise TimeoutError('User master snapshot was not received')
+    with _users_lock:
+        return list(_active_users.items())
+
+def get_name_matcher() -> NameMatcher:
+    """ユーザーマスターの照合エンジンを取得（マスターの変更後の初回のみ再構築）"""
+    global _name_matcher_version
+    # 一覧の取得中に変更が届いた場合は次回も再構築されるよう、取得前の版を記録する
+    version = _users_version
+    users = get_active_users()
+    if _name_matcher_version != version:
+        _name_matcher.build(users)
+        _name_matcher_version = version
+    return _name_matcher
 
 @functions_framework.cloud_event
 def process_drive_change(cloud_event):
@@ -27,7 +117,7 @@ def process_drive_change(cloud_event):
         # ファイルのメタデータを取得
         file_metadata = drive_service.files().get(
             fileId=message['file_id'],
-            fields='id, name, mimeType, parents, modifiedTime, trashed'
+            fields='id, name, mimeType, parents, modifiedTime, trashed, md5Checksum'
         ).execute()
     except Exception as e:
         print(f'Error getting file metadata: {str(e)}')
@@ -39,8 +129,7 @@ def process_drive_change(cloud_event):
         return
 
     # ファイルのMIMEタイプをチェック（画像またはPDFのみ処理）
-    supported_types = ['image/', 'application/pdf']
-    if not any(t in file_metadata.get('mimeType', '') for t in supported_types):
+    if not is_supported(file_metadata):
         print(f'Unsupported file type: {file_metadata.get("mimeType")}')
         return
 
@@ -52,68 +141,211 @@ def process_drive_change(cloud_event):
         # ファイルのメタデータのみ更新（移動・リネームなど）
         update_file_metadata(message['file_id'], file_metadata)
 
+def is_supported(file_metadata: dict) -> bool:
+    """OCR対象のファイル（画像またはPDF）か"""
+    return any(t in file_metadata.get('mimeType', '') for t in SUPPORTED_TYPES)
+
 def process_ocr(file_id: str, file_metadata: dict):
     """ファイルのOCR処理を実行し、結果を保存
 
+    同じ版への重複通知や再配信は処理済み・処理中であれば OCR をスキップし、
+    メタデータだけを記録する。
+    失敗した場合は例外を送出し、再配信時に完了したステップ（OCR）から再開する。
+
     Args:
         file_id (str): Google DriveのファイルID
         file_metadata (dict): ファイルのメタデータ
     """
-    storage_client = storage.Client()
+    key = processing_key(file_id, file_metadata)
+
+    def process(context):
+        ocr_data = context.step('ocr', lambda: run_ocr_or_raise(file_id, file_metadata))
+        context.step('stage', lambda: stage_file_metadata_or_raise(
+            [build_metadata_row(file_id, file_metadata, ocr_data)]
+        ))
+
+    if get_processor().run(key, process) == 'skipped':
+        # OCR は省き、メタデータ（移動・リネーム）だけ記録する
+        print(f'Skipping OCR for processed or in-flight change: {key}')
+        update_file_metadata(file_id, file_metadata)
+
+def run_ocr_or_raise(file_id: str, file_metadata: dict) -> dict:
+    """run_ocr の失敗を例外にする（失敗した版を処理済みにしない）"""
+    ocr_data = run_ocr(file_id, file_metadata)
+    if ocr_data is None:
+        raise RuntimeError(f'OCR failed: {file_id}')
+    return ocr_data
+
+def run_ocr(file_id: str, file_metadata: dict):
+    """ファイルのOCR処理と照合を行い、ステージングに追加する列を返す
+
+    Args:
+        file_id (str): Google DriveのファイルID
+        file_metadata (dict): ファイルのメタデータ
+
+    Returns:
+        dict: OCRテキストと照合結果（OCRに失敗した場合は None）
+    """
+    storage_client = get_client('storage', storage.Client)
     bucket = storage_client.bucket(os.getenv('TEMP_BUCKET'))
     temp_blob = bucket.blob(f"temp/{file_id}")
 
-    # Vision APIでOCR処理
-    vision_client = vision.ImageAnnotatorClient()
-    image = vision.Image()
-    image.source.image_uri = f"gs://{os.getenv('TEMP_BUCKET')}/temp/{file_id}"
-    
-    response = vision_client.text_detection(image=image)
-    if response.error.message:
-        print(f'Error: {response.error.message}')
-        return
+    # 同じ内容（md5Checksum）のOCR結果があればVision APIを呼ばない
+    md5_checksum = file_metadata.get('md5Checksum')
+    extracted_text = get_ocr_cache().get(ocr_cache_key(md5_checksum)) if md5_checksum else None
+    if extracted_text is None:
+        # Vision APIでOCR処理
+        vision_client = get_client('vision', vision.ImageAnnotatorClient)
+        image = vision.Image()
+        image.source.image_uri = f"gs://{os.getenv('TEMP_BUCKET')}/temp/{file_id}"
+        
+        response = vision_client.text_detection(image=image)
+        if response.error.message:
+            print(f'Error: {response.error.message}')
+            return None
 
-    # OCRテキストの取得
-    texts = response.text_annotations
-    extracted_text = texts[0].description if texts else ""
+        # OCRテキストの取得
+        texts = response.text_annotations
+        extracted_text = texts[0].description if texts else ""
+        if md5_checksum:
+            get_ocr_cache().set(ocr_cache_key(md5_checksum), extracted_text)
 
-    # Firestoreでユーザーマッチング
-    db = firestore.Client()
-    users_ref = db.collection('users')
-    query = users_ref.where('is_deleted', '==', False)
+    # キャッシュ済みユーザーマスターで照合（NFKC・かな統一・空白除去した上で一括照合）
     matched_users = []
     matched_names = []
+    for user_id, matches in get_name_matcher().find_users(extracted_text).items():
+        matched_users.append(user_id)
+        matched_names.append(matches[0].name)
 
-    for user in query.stream():
-        user_data = user.to_dict()
-        user_names = [user_data['name']] + user_data.get('alternate_names', [])
-        
-        for name in user_names:
-            if name in extracted_text:
-                matched_users.append(user.id)
-                matched_names.append(name)
-                break
-
-    # BigQueryにデータを更新
-    update_file_metadata(file_id, file_metadata, {
+    # 一時ファイルの削除
+    temp_blob.delete()
+
+    return {
         'ocr_text': extracted_text,
         'matched_user_ids': matched_users,
         'matched_names': matched_names
-    })
+    }
 
-    # 一時ファイルの削除
-    temp_blob.delete()
+def dispatch_file_changes(changes: list):
+    """変更フィードでまとめた変更をOCR・メタデータのパイプラインに一括で渡す
+
+    削除（ゴミ箱への移動を含む）は1回の UPDATE、OCR対象のファイルは並行して
+    OCRし、ステージングテーブルへの行は1回の挿入で記録する。どれかが失敗した場合は
+    例外を送出し、ページトークンを進めずに次回のポーリングで読み直す。
+
+    Args:
+        changes (list): drive_change_feed.FileChange のリスト
+    """
+    FileChangeDispatcher(
+        processor=get_processor(),
+        run_ocr=run_ocr_or_raise,
+        stage_rows=stage_file_metadata_or_raise,
+        mark_deleted=lambda file_ids: update_files_status(file_ids, is_deleted=True),
+        build_row=build_metadata_row,
+        is_supported=is_supported,
+        max_workers=DRIVE_FEED_OCR_WORKERS
+    )(changes)
+
+_change_feed = None
+
+@functions_framework.http
+def poll_drive_changes(request):
+    """Drive の変更フィードをポーリングしてまとめて処理する
+
+    Cloud Scheduler から定期的に呼び出す。Webhook ごとの Pub/Sub 発行と
+    files().get の代わりに、changes.list で最大1000件ずつ変更とメタデータを取得する。
+    反映できなかった変更があれば 500 を返し、次回の呼び出しで同じ変更を読み直す。
+
+    Args:
+        request (flask.Request): HTTPリクエストオブジェクト
+
+    Returns:
+        tuple: レスポンスとステータスコード
+    """
+    global _change_feed
+    if _change_feed is None:
+        _change_feed = DriveChangeFeed(
+            drive=build('drive', 'v3', cache_discovery=False),
+            store=FirestorePageTokenStore(
+                get_client('firestore', firestore.Client), os.getenv('DRIVE_CHANGE_FEED_ID', 'default')
+            ),
+            dispatch=dispatch_file_changes,
+            drive_id=os.getenv('DRIVE_ID')
+        )
+    return poll_response(_change_feed, DRIVE_FEED_MAX_PAGES)
+
+# 変更を一時的に溜めるステージングテーブルの列定義
+STAGING_SCHEMA = [
+    bigquery.SchemaField('file_id', 'STRING', mode='REQUIRED'),
+    bigquery.SchemaField('file_name', 'STRING'),
+    bigquery.SchemaField('file_url', 'STRING'),
+    bigquery.SchemaField('parent_folder_id', 'STRING'),
+    bigquery.SchemaField('mime_type', 'STRING'),
+    bigquery.SchemaField('modified_time', 'TIMESTAMP'),
+    bigquery.SchemaField('updated_at', 'TIMESTAMP'),
+    bigquery.SchemaField('has_ocr', 'BOOLEAN'),
+    bigquery.SchemaField('ocr_text', 'STRING'),
+    bigquery.SchemaField('matched_user_ids', 'STRING', mode='REPEATED'),
+    bigquery.SchemaField('matched_names', 'STRING', mode='REPEATED'),
+    bigquery.SchemaField('staged_at', 'TIMESTAMP', mode='REQUIRED'),
+]
+
+# ステージングテーブルのパーティションの有効期間
+STAGING_EXPIRATION_SECONDS = 24 * 60 * 60
+# 前回反映した位置より前にさかのぼって読む時間（遅れて挿入された行を取りこぼさない）
+METADATA_APPLY_OVERLAP_SECONDS = int(os.getenv('METADATA_APPLY_LOOKBACK_SECONDS', '600'))
+
+_staging_table_ready = False
+
+def get_table_id(table_name: str) -> str:
+    return f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.{table_name}"
+
+def ensure_staging_table(client):
+    """ステージングテーブルを作成（インスタンスごとに1回、パーティションは1日で失効）"""
+    global _staging_table_ready
+    if _staging_table_ready:
+        return
+    table = bigquery.Table(get_table_id('file_metadata_changes'), schema=STAGING_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field='staged_at',
+        expiration_ms=STAGING_EXPIRATION_SECONDS * 1000
+    )
+    client.create_table(table, exists_ok=True)
+    _staging_table_ready = True
+
+_ocr_cache = None
+
+def get_ocr_cache() -> OcrResultCache:
+    """backend と同じ形式で Firestore に保存するOCR結果キャッシュ（インスタンス内の LRU 付き）"""
+    global _ocr_cache
+    if _ocr_cache is None:
+        _ocr_cache = OcrResultCache(
+            max_entries=int(os.getenv('OCR_CACHE_MAX_ENTRIES', '1000')),
+            backend=FirestoreCacheBackend(get_client('firestore', firestore.Client))
+        )
+    return _ocr_cache
+
+def ocr_cache_key(md5_checksum: str) -> str:
+    """Drive の md5Checksum からキャッシュキーを作成（内容をダウンロードせずに引ける）"""
+    return digest_key(f'md5-{md5_checksum}', 'vision', VISION_OCR_VERSION)
 
 def update_file_metadata(file_id: str, file_metadata: dict, additional_data: dict = None):
-    """BigQueryのファイルメタデータを更新
+    """ファイルメタデータの変更をステージングテーブルに記録
+
+    file_metadata への反映は apply_file_metadata_changes が一定間隔で
+    まとめて1回の MERGE で行う。
 
     Args:
         file_id (str): ファイルID
         file_metadata (dict): Drive APIから取得したメタデータ
-        additional_data (dict, optional): 追加のメタデータ
+        additional_data (dict, optional): 追加のメタデータ（OCR結果）
     """
-    client = bigquery.Client()
-    table_id = f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata"
+    stage_file_metadata([build_metadata_row(file_id, file_metadata, additional_data)])
+
+def build_metadata_row(file_id: str, file_metadata: dict, additional_data: dict = None) -> dict:
+    """ステージングテーブルに記録する1行を作成"""
+    now = datetime.utcnow().isoformat()
 
     # 基本的なメタデータ
     row_data = {
@@ -123,36 +355,145 @@ def update_file_metadata(file_id: str, file_metadata: dict, additional_data: dic
         'parent_folder_id': file_metadata.get('parents', [None])[0],
         'mime_type': file_metadata.get('mimeType'),
         'modified_time': file_metadata.get('modifiedTime'),
-        'updated_at': datetime.utcnow().isoformat()
+        'updated_at': now,
+        'has_ocr': bool(additional_data),
+        'staged_at': now
     }
 
     # 追加のメタデータがある場合は統合
     if additional_data:
         row_data.update(additional_data)
+    return row_data
 
-    # UPSERTクエリの実行
-    query = f"""
+def stage_file_metadata(rows: list) -> bool:
+    """ステージングテーブルに行をまとめて挿入（成功したかを返す）"""
+    client = get_client('bigquery', bigquery.Client)
+    try:
+        ensure_staging_table(client)
+        errors = client.insert_rows_json(get_table_id('file_metadata_changes'), rows)
+        if errors:
+            print(f'Error staging file metadata: {errors}')
+            return False
+        return True
+    except Exception as e:
+        print(f'Error staging file metadata: {str(e)}')
+        return False
+
+def stage_file_metadata_or_raise(rows: list):
+    """stage_file_metadata の失敗を例外にする（再配信時にステージングから再開する）"""
+    if not stage_file_metadata(rows):
+        raise RuntimeError('Staging failed')
+
+def build_apply_changes_query(table_id: str, staging_table_id: str) -> str:
+    """ステージング済みの変更を file_metadata に一括反映する MERGE 文
+
+    file_id ごとに modifiedTime が最新の変更を採用し、OCR結果は OCR を伴う
+    最新の変更から取る（メタデータのみの変更で OCR 結果を消さない）。
+    既存行より古い変更は反映しないため、同じ範囲を再適用しても結果は変わらない。
+    """
+    return f"""
     MERGE `{table_id}` T
-    USING (SELECT '{file_id}' as file_id) S
+    USING (
+        SELECT
+            file_id,
+            latest.file_name, latest.file_url, latest.parent_folder_id,
+            latest.mime_type, latest.modified_time, latest.updated_at,
+            ARRAY_LENGTH(ocr) > 0 AS has_ocr,
+            ocr[SAFE_OFFSET(0)].ocr_text AS ocr_text,
+            ocr[SAFE_OFFSET(0)].matched_user_ids AS matched_user_ids,
+            ocr[SAFE_OFFSET(0)].matched_names AS matched_names
+        FROM (
+            SELECT
+                file_id,
+                ARRAY_AGG(
+                    STRUCT(file_name, file_url, parent_folder_id, mime_type, modified_time, updated_at)
+                    ORDER BY modified_time DESC, staged_at DESC LIMIT 1
+                )[OFFSET(0)] AS latest,
+                ARRAY_AGG(
+                    IF(has_ocr, STRUCT(ocr_text, matched_user_ids, matched_names), NULL) IGNORE NULLS
+                    ORDER BY modified_time DESC, staged_at DESC LIMIT 1
+                ) AS ocr
+            FROM `{staging_table_id}`
+            WHERE staged_at >= @since AND staged_at <= @until
+            GROUP BY file_id
+        )
+    ) S
     ON T.file_id = S.file_id
-    WHEN MATCHED THEN
-        UPDATE SET {', '.join(f'{k} = @{k}' for k in row_data.keys())}
+    WHEN MATCHED AND (T.modified_time IS NULL OR S.modified_time >= T.modified_time) THEN
+        UPDATE SET
+            file_name = S.file_name,
+            file_url = S.file_url,
+            parent_folder_id = S.parent_folder_id,
+            mime_type = S.mime_type,
+            modified_time = S.modified_time,
+            updated_at = S.updated_at,
+            ocr_text = IF(S.has_ocr, S.ocr_text, T.ocr_text),
+            matched_user_ids = IF(S.has_ocr, S.matched_user_ids, T.matched_user_ids),
+            matched_names = IF(S.has_ocr, S.matched_names, T.matched_names)
     WHEN NOT MATCHED THEN
-        INSERT ({', '.join(row_data.keys())})
-        VALUES ({', '.join(f'@{k}' for k in row_data.keys())})
+        INSERT (file_id, file_name, file_url, parent_folder_id, mime_type, modified_time, updated_at,
+                ocr_text, matched_user_ids, matched_names, is_deleted, created_at)
+        VALUES (S.file_id, S.file_name, S.file_url, S.parent_folder_id, S.mime_type, S.modified_time,
+                S.updated_at, S.ocr_text, S.matched_user_ids, S.matched_names, FALSE, S.updated_at)
+    """
+
+def _apply_state_ref():
+    return get_client('firestore', firestore.Client).collection('metadata_apply_state').document('file_metadata')
+
+def get_apply_since(now: datetime) -> datetime:
+    """MERGE で読むステージングの開始位置
+
+    前回反映した位置（staged_at）から METADATA_APPLY_OVERLAP_SECONDS さかのぼる。
+    記録がない場合やパーティションが失効するほど前の場合は、残っている範囲の先頭から読む。
+    """
+    earliest = now - timedelta(seconds=STAGING_EXPIRATION_SECONDS)
+    doc = _apply_state_ref().get()
+    applied_until = doc.to_dict().get('applied_until') if doc.exists else None
+    if applied_until is None:
+        return earliest
+    since = applied_until.replace(tzinfo=None) - timedelta(seconds=METADATA_APPLY_OVERLAP_SECONDS)
+    return max(since, earliest)
+
+def set_applied_until(until: datetime):
+    _apply_state_ref().set({'applied_until': until, 'updated_at': datetime.utcnow()}, merge=True)
+
+@functions_framework.http
+def apply_file_metadata_changes(request):
+    """ステージングテーブルの変更を1回の MERGE で file_metadata に反映する
+
+    Cloud Scheduler から定期的に呼び出す。前回反映した位置を Firestore に記録し、
+    そこから現在までの変更を反映するため、実行の失敗や停止が続いても
+    ステージングのパーティションが失効するまでの変更は取りこぼさない。
+    前回と重なる範囲を読んでも MERGE は冪等なため問題ない。
+
+    Args:
+        request (flask.Request): HTTPリクエストオブジェクト
+
+    Returns:
+        tuple: レスポンスとステータスコード
     """
+    client = get_client('bigquery', bigquery.Client)
+    until = datetime.utcnow()
+    since = get_apply_since(until)
 
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
-            bigquery.ScalarQueryParameter(k, infer_bigquery_type(v), v)
-            for k, v in row_data.items()
+            bigquery.ScalarQueryParameter('since', 'TIMESTAMP', since.isoformat()),
+            bigquery.ScalarQueryParameter('until', 'TIMESTAMP', until.isoformat())
         ]
     )
-
     try:
-        client.query(query, job_config=job_config).result()
+        ensure_staging_table(client)
+        job = client.query(
+            build_apply_changes_query(get_table_id('file_metadata'), get_table_id('file_metadata_changes')),
+            job_config=job_config
+        )
+        job.result()
+        set_applied_until(until)
+        return f'Applied {job.num_dml_affected_rows or 0} changes', 200
     except Exception as e:
-        print(f'Error updating BigQuery: {str(e)}')
+        print(f'Error applying file metadata changes: {str(e)}')
+        return f'Error applying file metadata changes: {str(e)}', 500
 
 def update_file_status(file_id: str, is_deleted: bool):
     """ファイルの状態（削除フラグ）を更新
@@ -161,8 +502,8 @@ def update_file_status(file_id: str, is_deleted: bool):
         file_id (str): ファイルID
         is_deleted (bool): 削除フラグ
     """
-    client = bigquery.Client()
-    table_id = f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata"
+    client = get_client('bigquery', bigquery.Client)
+    table_id = get_table_id('file_metadata')
 
     query = f"""
     UPDATE `{table_id}`
@@ -185,22 +526,30 @@ def update_file_status(file_id: str, is_deleted: bool):
     except Exception as e:
         print(f'Error updating file status: {str(e)}')
 
-def infer_bigquery_type(value):
-    """値からBigQueryの型を推測
+def update_files_status(file_ids: list, is_deleted: bool):
+    """複数ファイルの状態（削除フラグ）を1回の UPDATE で更新（失敗時は例外）
 
     Args:
-        value: 任意の値
+        file_ids (list): ファイルIDのリスト
+        is_deleted (bool): 削除フラグ
+    """
+    client = get_client('bigquery', bigquery.Client)
+    table_id = get_table_id('file_metadata')
 
-    Returns:
-        str: BigQueryの型名
+    query = f"""
+    UPDATE `{table_id}`
+    SET is_deleted = @is_deleted,
+        deleted_at = @deleted_at
+    WHERE file_id IN UNNEST(@file_ids)
     """
-    if isinstance(value, bool):
-        return 'BOOL'
-    elif isinstance(value, int):
-        return 'INT64'
-    elif isinstance(value, float):
-        return 'FLOAT64'
-    elif isinstance(value, (list, tuple)):
-        return 'ARRAY'
-    else:
-        return 'STRING'
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter('is_deleted', 'BOOLEAN', is_deleted),
+            bigquery.ScalarQueryParameter('deleted_at', 'STRING',
+                datetime.utcnow().isoformat() if is_deleted else None),
+            bigquery.ArrayQueryParameter('file_ids', 'STRING', file_ids)
+        ]
+    )
+
+    client.query(query, job_config=job_config).result()
@@ -0,0 +1,218 @@
+from typing import Callable, Optional
+import threading
+import time
+
+# auth_settings/config が未作成の場合の既定値（models.AuthSettings と同じ）
+DEFAULT_SETTINGS = {
+    "allow_only_listed_domains": True,
+    "allow_personal_gmail": False,
+    "allow_listed_emails_only": True
+}
+PERSONAL_GMAIL_DOMAIN = "gmail.com"
+# 許可リストを書き換えたら更新するバージョンスタンプ（ポーリング時はこれだけを読む）
+VERSION_DOC_ID = "allow_list_version"
+
+
+def normalize_domain(value: str) -> str:
+    return value.strip().lower().lstrip("@").strip(".")
+
+
+def normalize_email(value: str) -> str:
+    return value.strip().lower()
+
+
+def domain_suffixes(domain: str) -> list[str]:
+    """サブドメインの照合用に、ドメイン自身と親ドメインを返す（a.b.example.com → b.example.com → ...）"""
+    labels = domain.split(".")
+    return [".".join(labels[i:]) for i in range(len(labels) - 1)] or [domain]
+
+
+class AllowList:
+    """許可ドメイン・許可メールアドレスのプロセス内判定エンジン
+
+    allowed_domains / allowed_emails / auth_settings を一度だけ読み込み、有効な
+    ドメインとメールアドレスをそれぞれ set で保持する。登録したドメインは
+    サブドメインも許可する（親ドメインを順に引く）。更新は Firestore の
+    on_snapshot リスナーで反映するか、poll_interval 秒ごとに
+    auth_settings/allow_list_version のスタンプを読み、変わっていれば再読み込みする。
+    変更のたびに version を進め、subscribe() したコールバックを呼ぶ。
+    """
+
+    def __init__(self, db, domains_collection: str = "allowed_domains",
+                 emails_collection: str = "allowed_emails", settings_collection: str = "auth_settings"):
+        self._db = db
+        self._collections = {
+            "domains": domains_collection,
+            "emails": emails_collection,
+            "settings": settings_collection
+        }
+        self._lock = threading.Lock()
+        self._docs: dict[str, dict[str, dict]] = {"domains": {}, "emails": {}, "settings": {}}
+        self._domains: frozenset[str] = frozenset()
+        self._emails: frozenset[str] = frozenset()
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._stamp = None
+        self._version = 0
+        self._updated_at: Optional[float] = None
+        self._ready = threading.Event()
+        self._initial = set()
+        self._watches = []
+        self._subscribers: list[Callable[[], None]] = []
+        self._poll_stop = threading.Event()
+        self._poll_thread: Optional[threading.Thread] = None
+        self._checks = 0
+        self._reloads = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def start(self, poll_interval: Optional[float] = None, timeout: float = 30.0) -> "AllowList":
+        """リスナー（poll_interval 指定時はポーリング）を開始し、初回の読み込みを待つ"""
+        if poll_interval:
+            self.load()
+            if self._poll_thread is None:
+                self._poll_thread = threading.Thread(
+                    target=self._poll_loop, args=(poll_interval,), name="allow-list-poll", daemon=True
+                )
+                self._poll_thread.start()
+            return self
+        if not self._watches:
+            for kind, collection in self._collections.items():
+                self._watches.append(self._db.collection(collection).on_snapshot(
+                    lambda docs, changes, read_time, kind=kind: self._on_snapshot(kind, changes)
+                ))
+        if not self._ready.wait(timeout):
+            # リスナーの初回応答が遅い場合は直接読み込む
+            self.load()
+        return self
+
+    def stop(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+        self._poll_stop.set()
+
+    def load(self):
+        """3つのコレクションを読み込んでまとめて置き換え"""
+        docs = {
+            kind: {doc.id: doc.to_dict() for doc in self._db.collection(collection).stream()}
+            for kind, collection in self._collections.items()
+        }
+        with self._lock:
+            self._docs = docs
+            self._rebuild()
+            self._reloads += 1
+        self._ready.set()
+        self._notify()
+
+    def poll(self) -> bool:
+        """バージョンスタンプが変わっていれば再読み込みし、再読み込みしたかを返す"""
+        doc = self._db.collection(self._collections["settings"]).document(VERSION_DOC_ID).get()
+        stamp = doc.to_dict().get("stamp") if doc.exists else None
+        with self._lock:
+            self._updated_at = time.time()
+            if stamp == self._stamp:
+                return False
+        self.load()
+        return True
+
+    def subscribe(self, callback: Callable[[], None]):
+        """許可リスト・認証設定が変わったときに呼ぶコールバックを登録"""
+        self._subscribers.append(callback)
+
+    def is_domain_allowed(self, domain: str) -> bool:
+        self._checks += 1
+        domain = normalize_domain(domain)
+        settings = self._settings
+        if not settings["allow_only_listed_domains"]:
+            return True
+        if settings["allow_personal_gmail"] and domain == PERSONAL_GMAIL_DOMAIN:
+            return True
+        domains = self._domains
+        return any(suffix in domains for suffix in domain_suffixes(domain))
+
+    def is_email_allowed(self, email: str) -> bool:
+        """登録済みのメールアドレスは常に許可し、allow_listed_emails_only でなければドメインで判定"""
+        email = normalize_email(email)
+        if email in self._emails:
+            self._checks += 1
+            return True
+        if self._settings["allow_listed_emails_only"] or "@" not in email:
+            self._checks += 1
+            return False
+        return self.is_domain_allowed(email.rsplit("@", 1)[1])
+
+    def index(self, kind: str) -> dict[str, tuple[str, dict]]:
+        """正規化した値 → (doc_id, データ) の対応表（一括登録時の重複判定用）"""
+        field, normalize = ("domain", normalize_domain) if kind == "domains" else ("email", normalize_email)
+        with self._lock:
+            items = list(self._docs[kind].items())
+        return {normalize(data.get(field) or ""): (doc_id, data) for doc_id, data in items}
+
+    def staleness(self) -> Optional[float]:
+        """最後に反映・確認してからの経過秒数（未読み込みなら None）"""
+        if self._updated_at is None:
+            return None
+        return time.time() - self._updated_at
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "domain_count": len(self._domains),
+            "email_count": len(self._emails),
+            "checks": self._checks,
+            "reloads": self._reloads,
+            "listening": bool(self._watches),
+            "polling": self._poll_thread is not None and not self._poll_stop.is_set(),
+            "staleness_seconds": self.staleness()
+        }
+
+    def _rebuild(self):
+        """保持しているドキュメントから判定用の set を作り直す（ロック保持中に呼ぶ）"""
+        self._domains = frozenset(
+            normalize_domain(data["domain"]) for data in self._docs["domains"].values()
+            if data.get("domain") and data.get("is_active", True)
+        )
+        self._emails = frozenset(
+            normalize_email(data["email"]) for data in self._docs["emails"].values()
+            if data.get("email") and data.get("is_active", True)
+        )
+        settings = dict(DEFAULT_SETTINGS)
+        settings.update({
+            key: value for key, value in (self._docs["settings"].get("config") or {}).items()
+            if key in DEFAULT_SETTINGS
+        })
+        self._settings = settings
+        self._stamp = (self._docs["settings"].get(VERSION_DOC_ID) or {}).get("stamp")
+        self._version += 1
+        self._updated_at = time.time()
+
+    def _notify(self):
+        for callback in list(self._subscribers):
+            callback()
+
+    def _on_snapshot(self, kind: str, changes):
+        """on_snapshot コールバック（初回は全件が ADDED として届く）"""
+        with self._lock:
+            docs = dict(self._docs[kind])
+            for change in changes:
+                doc = change.document
+                if change.type.name == "REMOVED":
+                    docs.pop(doc.id, None)
+                else:
+                    docs[doc.id] = doc.to_dict()
+            self._docs[kind] = docs
+            self._rebuild()
+            self._initial.add(kind)
+            ready = self._initial >= set(self._collections)
+        if ready:
+            self._ready.set()
+        self._notify()
+
+    def _poll_loop(self, interval: float):
+        while not self._poll_stop.wait(interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Allow list poll error: {e}")
@@ -0,0 +1,236 @@
+from collections import deque
+from datetime import datetime
+from typing import Optional
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Firestore のバッチ書き込み1回あたりの上限
+FIRESTORE_BATCH_LIMIT = 500
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: dict):
+    if set(obj) == {"$datetime"}:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+class AuditLogPipeline:
+    """監査ログを非同期にまとめて Firestore と BigQuery に書き込む
+
+    enqueue() はメモリ上の上限付きキューに追加してすぐに戻る。バックグラウンド
+    スレッドが batch_size 件ごと、または最古のログから flush_interval 秒後に
+    Firestore のバッチ書き込みと BigQuery の insert_rows で送信する。キューが
+    満杯の場合や書き込みに失敗した場合は spill_dir に NDJSON で退避し、キューに
+    余裕ができた時点で読み戻す（spill_dir がない場合は破棄して件数を数える）。
+    書き込みに失敗している間の読み戻しは flush_interval から max_retry_delay 秒まで
+    倍々に間隔を空け、書き込みに成功したら元に戻す。BigQuery のテーブル情報は初回のみ
+    取得する。close() で残りをすべて書き込み、close() 後の enqueue() は破棄して件数を数える。
+    """
+
+    def __init__(self, db, bq_client, table_id: str, collection: str = "auth_audit_logs",
+                 max_queue: int = 10000, batch_size: int = FIRESTORE_BATCH_LIMIT,
+                 flush_interval: float = 1.0, spill_dir: Optional[str] = None,
+                 max_retry_delay: float = 60.0):
+        self._db = db
+        self._bq_client = bq_client
+        self._table_id = table_id
+        self._collection = collection
+        self._max_queue = max_queue
+        self._batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self._flush_interval = flush_interval
+        self._max_retry_delay = max_retry_delay
+        self._spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self._table = None
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._queue: deque[dict] = deque()
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._enqueued = 0
+        self._written = 0
+        self._spilled = 0
+        self._dropped = 0
+        self._failed_batches = 0
+        self._batch_count = 0
+        self._last_batch_seconds: Optional[float] = None
+        # 書き込みの失敗が続いている間の読み戻しの間隔と、次に読み戻す時刻
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+
+    def enqueue(self, log: dict):
+        """ログをキューに追加（ブロックしない）"""
+        with self._cond:
+            if self._closed:
+                # 停止処理中に届いたリクエストは失敗させず、ログだけを破棄する
+                self._dropped += 1
+                logger.warning("Audit log dropped after close: %s", log.get("log_id"))
+                return
+            self._enqueued += 1
+            if len(self._queue) >= self._max_queue:
+                self._overflow([log])
+                return
+            self._queue.append(log)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self):
+        """キューと退避ファイルのログをすべて書き込む（再試行の間隔を待たずに読み戻す）"""
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._reload_spilled(force=True)
+                batch = self._take_batch()
+            if not batch:
+                return
+            if not self._write(batch):
+                return
+
+    def close(self, timeout: Optional[float] = None):
+        """新規受付を止め、残りのログを書き込んでから停止
+
+        書き込みに失敗して残ったログは spill_dir に退避する（spill_dir がない場合は
+        破棄した件数を数える）。
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        with self._cond:
+            if self._queue:
+                remaining = list(self._queue)
+                self._queue.clear()
+                self._oldest = None
+                self._overflow(remaining)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._queue),
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "spilled": self._spilled,
+            "spill_files": len(self._spill_files()),
+            "dropped": self._dropped,
+            "failed_batches": self._failed_batches,
+            "retry_delay_seconds": self._retry_delay,
+            "batch_count": self._batch_count,
+            "last_batch_latency_ms": self._last_batch_seconds * 1000 if self._last_batch_seconds is not None else None
+        }
+
+    def _is_due(self) -> bool:
+        return bool(self._queue) and (
+            len(self._queue) >= self._batch_size
+            or time.monotonic() - self._oldest >= self._flush_interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._is_due():
+                    timeout = self._flush_interval
+                    if self._oldest is not None:
+                        timeout = max(self._flush_interval - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                    if not self._queue:
+                        self._reload_spilled()
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _take_batch(self) -> list[dict]:
+        batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+        self._oldest = time.monotonic() if self._queue else None
+        return batch
+
+    def _write(self, batch: list[dict]) -> bool:
+        with self._write_lock:
+            start = time.monotonic()
+            try:
+                firestore_batch = self._db.batch()
+                collection = self._db.collection(self._collection)
+                for log in batch:
+                    firestore_batch.set(collection.document(log["log_id"]), log)
+                firestore_batch.commit()
+
+                if self._table is None:
+                    self._table = self._bq_client.get_table(self._table_id)
+                errors = self._bq_client.insert_rows(self._table, batch, row_ids=[log["log_id"] for log in batch])
+                if errors:
+                    logger.error("Audit log BigQuery insertion errors: %s", errors[:3])
+            except Exception as e:
+                logger.error("Audit log write error (%d logs): %s", len(batch), e)
+                self._failed_batches += 1
+                with self._cond:
+                    self._overflow(batch)
+                    # 書き込み先が復旧するまで退避ファイルの読み戻しと書き戻しを繰り返さない
+                    self._retry_delay = min(max(self._retry_delay * 2, self._flush_interval), self._max_retry_delay)
+                    self._retry_at = time.monotonic() + self._retry_delay
+                return False
+            finally:
+                self._last_batch_seconds = time.monotonic() - start
+
+            self._written += len(batch)
+            self._batch_count += 1
+            self._retry_delay = 0.0
+            self._retry_at = 0.0
+            return True
+
+    def _overflow(self, logs: list[dict]):
+        """キューに入らない・書き込めなかったログを退避（ロック保持中に呼ぶ）"""
+        if not self._spill_dir:
+            self._dropped += len(logs)
+            logger.warning("Audit log dropped: %d logs", len(logs))
+            return
+        path = os.path.join(self._spill_dir, "spill.ndjson")
+        with open(path, "a", encoding="utf-8") as f:
+            for log in logs:
+                f.write(json.dumps(log, default=_encode, ensure_ascii=False) + "\n")
+        self._spilled += len(logs)
+
+    def _spill_files(self) -> list[str]:
+        if not self._spill_dir:
+            return []
+        return sorted(glob.glob(os.path.join(self._spill_dir, "*.ndjson")))
+
+    def _reload_spilled(self, force: bool = False):
+        """キューが空のときに退避ファイルを1つ読み戻す（ロック保持中に呼ぶ）
+
+        書き込みの失敗後は force でなければ再試行の時刻まで読み戻さない。
+        """
+        if not force and time.monotonic() < self._retry_at:
+            return
+        for path in self._spill_files():
+            # 読み戻し中に追記されないよう名前を変えてから読む
+            reading_path = os.path.join(self._spill_dir, f"reload-{uuid.uuid4().hex}.tmp")
+            os.replace(path, reading_path)
+            with open(reading_path, encoding="utf-8") as f:
+                logs = [json.loads(line, object_hook=_decode) for line in f if line.strip()]
+            os.remove(reading_path)
+            self._queue.extend(logs)
+            if self._queue and self._oldest is None:
+                self._oldest = time.monotonic()
+            return
@@ -5,6 +5,7 @@ from firebase_admin import auth, credentials, initialize_app
 import os
 
 from .crud import get_user, is_domain_allowed, log_auth_action
+from .utils import get_auth_cache
 
 # Firebase Admin SDKの初期化
 cred = credentials.Certificate(os.getenv('FIREBASE_ADMIN_CREDENTIALS'))
@@ -17,17 +18,36 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
     if not credentials:
         raise HTTPException(status_code=401, detail="認証情報が必要です")
     
+    # 検証済みのクレームはトークンの有効期限までキャッシュから返す
+    auth_cache = get_auth_cache()
+    decoded_token = auth_cache.get(credentials.credentials, "claims")
+    if decoded_token is not None:
+        return decoded_token
+    
     try:
         decoded_token = auth.verify_id_token(credentials.credentials)
-        return decoded_token
     except Exception as e:
         raise HTTPException(status_code=401, detail="無効なトークンです")
+    auth_cache.set(credentials.credentials, "claims", decoded_token, exp=decoded_token.get('exp'), user_id=decoded_token.get('uid'))
+    return decoded_token
 
 async def get_current_user(
     request: Request,
-    token: dict = Depends(verify_token)
+    token: dict = Depends(verify_token),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> Optional[dict]:
-    """現在のユーザー情報を取得"""
+    """現在のユーザー情報を取得（ユーザー・ドメインの判定結果はキャッシュ）"""
+    auth_cache = get_auth_cache()
+    user = auth_cache.get(credentials.credentials, "current_user")
+    if user is not None:
+        await log_auth_action(
+            user_id=user.id,
+            action="user_access",
+            details="User accessed the system",
+            request=request
+        )
+        return user
+    
     try:
         # ユーザー情報を取得
         user = await get_user(token.get('uid'))
@@ -60,6 +80,7 @@ async def get_current_user(
             request=request
         )
         
+        auth_cache.set(credentials.credentials, "current_user", user, exp=token.get('exp'), user_id=user.id)
         return user
         
     except HTTPException:
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Any, Optional
+import hashlib
+import threading
+import time
+
+
+def token_key(token: str, scope: str) -> str:
+    """IDトークンそのものは保持せず、SHA-256 をキーにする"""
+    return f"{scope}:{hashlib.sha256(token.encode('utf-8')).hexdigest()}"
+
+
+class AuthCache:
+    """検証済みIDトークンと認可判定のキャッシュ
+
+    トークンのハッシュと用途（scope）ごとに、デコード済みのクレームや解決した
+    ユーザー・ロール・許可判定を保持する。有効期限は ttl 秒とトークンの exp の
+    早い方。ユーザーの変更時は invalidate_user()、許可ドメイン・メールや認証設定の
+    変更時は invalidate_all() で破棄する（utils.get_auth_cache() でユーザーキャッシュと
+    許可リストの変更通知に登録する）。
+    拒否した結果はキャッシュしない。
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 10000):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Optional[str], Any]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, token: str, scope: str) -> Optional[Any]:
+        key = token_key(token, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() >= entry[0]:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def set(self, token: str, scope: str, value: Any, exp: Optional[float] = None, user_id: Optional[str] = None):
+        """結果を保持（exp はトークンの有効期限の UNIX 時刻）"""
+        expires_at = time.time() + self._ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= time.time():
+            return
+        key = token_key(token, scope)
+        with self._lock:
+            self._entries[key] = (expires_at, user_id, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        """ユーザーの削除・ロール変更時に、そのユーザーの結果を破棄"""
+        with self._lock:
+            for key in [key for key, (_, uid, _) in self._entries.items() if uid == user_id]:
+                del self._entries[key]
+            self._invalidations += 1
+
+    def invalidate_all(self):
+        """許可リストや認証設定の変更時にすべて破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else None,
+            "invalidations": self._invalidations
+        }
@@ -0,0 +1,180 @@
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
+import json
+import threading
+import time
+import uuid
+
+
+class BatchedRowWriter:
+    """BigQuery ストリーミング挿入のバッファ付きライター
+
+    add() で受け取った行をメモリ上に溜め、行数・バイト数・最古行の経過時間の
+    いずれかが上限に達した時点でバックグラウンドスレッドが insert_rows_json で
+    まとめて送信する。一部の行だけが失敗した場合はその行のみを1行ずつ再送し、
+    close() でキューに残った行をすべて送信してから停止する。add() が返す Future は
+    行を挿入できた時点で完了し、再送しても挿入できなかった場合は例外が設定される。
+    """
+
+    def __init__(self, client, table_id: str, max_rows: int = 500, max_bytes: int = 5 * 1024 * 1024,
+                 max_age: float = 1.0, max_retries: int = 3, retry_delay: float = 0.5):
+        self._client = client
+        self._table_id = table_id
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending: list[tuple[str, dict, int, Future]] = []
+        self._pending_bytes = 0
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._flushed_rows = 0
+        self._failed_rows: deque[dict] = deque(maxlen=1000)
+        self._failed_count = 0
+        self._last_error: Optional[str] = None
+        self._flush_count = 0
+        self._flush_seconds = 0.0
+        self._last_flush_seconds: Optional[float] = None
+
+    @property
+    def table_id(self) -> str:
+        return self._table_id
+
+    def add(self, row: dict, row_id: Optional[str] = None) -> Future:
+        """行をキューに追加（送信は非同期。挿入の結果は返した Future で受け取る）"""
+        size = len(json.dumps(row, default=str).encode("utf-8"))
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchedRowWriter is closed")
+            self._pending.append((row_id or str(uuid.uuid4()), row, size, future))
+            self._pending_bytes += size
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bq-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def flush(self):
+        """キューに溜まっている行をすべて送信"""
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._send(batch)
+
+    def close(self, timeout: Optional[float] = None):
+        """新規受付を止め、残りの行を送信してから停止"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def failed_rows(self) -> list[dict]:
+        """再送しても挿入できなかった行（直近1000件）"""
+        return list(self._failed_rows)
+
+    def stats(self) -> dict:
+        return {
+            "table_id": self._table_id,
+            "queue_depth": len(self._pending),
+            "pending_bytes": self._pending_bytes,
+            "flushed_rows": self._flushed_rows,
+            "failed_rows": self._failed_count,
+            "last_error": self._last_error,
+            "flush_count": self._flush_count,
+            "last_flush_latency_ms": self._last_flush_seconds * 1000 if self._last_flush_seconds is not None else None,
+            "avg_flush_latency_ms": self._flush_seconds / self._flush_count * 1000 if self._flush_count else None
+        }
+
+    def _is_due(self) -> bool:
+        return (
+            len(self._pending) >= self._max_rows
+            or self._pending_bytes >= self._max_bytes
+            or (self._oldest is not None and time.monotonic() - self._oldest >= self._max_age)
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not (self._pending and self._is_due()):
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self._max_age - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            if batch:
+                self._send(batch)
+
+    def _take_batch(self) -> list[tuple[str, dict, int, Future]]:
+        """上限内で先頭から1バッチ分を取り出す（ロック保持中に呼ぶ）"""
+        batch = []
+        batch_bytes = 0
+        while self._pending and len(batch) < self._max_rows:
+            size = self._pending[0][2]
+            if batch and batch_bytes + size > self._max_bytes:
+                break
+            batch.append(self._pending.pop(0))
+            batch_bytes += size
+        self._pending_bytes -= batch_bytes
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+
+    def _insert(self, batch: list[tuple[str, dict, int, Future]]) -> list[dict]:
+        """insert_rows_json を呼び出し、リクエスト全体の失敗は再試行する"""
+        for attempt in range(self._max_retries + 1):
+            try:
+                return self._client.insert_rows_json(
+                    self._table_id,
+                    [entry[1] for entry in batch],
+                    row_ids=[entry[0] for entry in batch]
+                )
+            except Exception as e:
+                if attempt == self._max_retries:
+                    return [{"index": i, "errors": [{"message": str(e)}]} for i in range(len(batch))]
+                time.sleep(self._retry_delay * (2 ** attempt))
+
+    def _send(self, batch: list[tuple[str, dict, int, Future]]):
+        with self._flush_lock:
+            start = time.monotonic()
+            errors = {error["index"]: error for error in self._insert(batch) or []}
+
+            # 部分失敗した行は1行ずつ再送（row_ids により重複挿入は抑止される）
+            if errors and len(batch) > 1:
+                retried = {}
+                for index in errors:
+                    row_errors = self._insert([batch[index]])
+                    if row_errors:
+                        retried[index] = row_errors[0]
+                errors = retried
+
+            for index, (row_id, row, _, future) in enumerate(batch):
+                if index not in errors:
+                    future.set_result(row_id)
+                    continue
+                message = f"BigQuery insertion error: {self._table_id}: {row.get('file_id')}: {errors[index].get('errors')}"
+                print(message)
+                self._failed_rows.append(row)
+                self._last_error = message
+                future.set_exception(RuntimeError(message))
+            self._failed_count += len(errors)
+
+            elapsed = time.monotonic() - start
+            self._flushed_rows += len(batch) - len(errors)
+            self._flush_count += 1
+            self._flush_seconds += elapsed
+            self._last_flush_seconds = elapsed
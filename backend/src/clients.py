@@ -0,0 +1,111 @@
+from google.cloud import vision, documentai, storage, firestore, bigquery
+from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+from googleapiclient.discovery import build
+from requests.adapters import HTTPAdapter
+import google.auth
+import os
+import threading
+
+# HTTP系クライアント（Storage / BigQuery）のコネクションプールの大きさ
+HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "32"))
+# gRPC系クライアント（Vision / Document AI）の送受信メッセージ上限
+GRPC_MAX_MESSAGE_BYTES = int(os.getenv("GOOGLE_GRPC_MAX_MESSAGE_BYTES", str(64 * 1024 * 1024)))
+
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive.file']
+
+_lock = threading.Lock()
+_clients = {}
+_local = threading.local()
+
+def _get_or_create(name: str, factory):
+    """クライアントをプロセス内で1度だけ生成して再利用"""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def _grpc_options() -> list:
+    return [
+        ("grpc.max_send_message_length", GRPC_MAX_MESSAGE_BYTES),
+        ("grpc.max_receive_message_length", GRPC_MAX_MESSAGE_BYTES),
+        ("grpc.keepalive_time_ms", 30000)
+    ]
+
+def _http_session() -> AuthorizedSession:
+    """コネクションプールを拡張した認証済みHTTPセッション"""
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_vision_client() -> vision.ImageAnnotatorClient:
+    def create():
+        transport_cls = vision.ImageAnnotatorClient.get_transport_class("grpc")
+        channel = transport_cls.create_channel(options=_grpc_options())
+        return vision.ImageAnnotatorClient(transport=transport_cls(channel=channel))
+    return _get_or_create("vision", create)
+
+def get_documentai_client() -> documentai.DocumentProcessorServiceClient:
+    def create():
+        transport_cls = documentai.DocumentProcessorServiceClient.get_transport_class("grpc")
+        channel = transport_cls.create_channel(options=_grpc_options())
+        return documentai.DocumentProcessorServiceClient(transport=transport_cls(channel=channel))
+    return _get_or_create("documentai", create)
+
+def get_storage_client() -> storage.Client:
+    def create():
+        if os.getenv("STORAGE_EMULATOR_HOST"):
+            return storage.Client()
+        return storage.Client(_http=_http_session())
+    return _get_or_create("storage", create)
+
+def get_bigquery_client() -> bigquery.Client:
+    def create():
+        if os.getenv("BIGQUERY_EMULATOR_HOST"):
+            return bigquery.Client()
+        return bigquery.Client(_http=_http_session())
+    return _get_or_create("bigquery", create)
+
+def get_firestore_client() -> firestore.Client:
+    return _get_or_create("firestore", firestore.Client)
+
+def get_drive_credentials() -> service_account.Credentials:
+    return _get_or_create("drive_credentials", lambda: service_account.Credentials.from_service_account_file(
+        os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+        scopes=DRIVE_SCOPES
+    ))
+
+def get_drive_service():
+    """Drive APIサービスを取得
+
+    discovery で構築したサービスは httplib2 を使うためスレッドセーフではない。
+    認証情報はプロセスで共有し、サービスはスレッドごとに1度だけ構築する。
+    """
+    service = getattr(_local, "drive_service", None)
+    if service is None:
+        service = build('drive', 'v3', credentials=get_drive_credentials(), cache_discovery=False)
+        _local.drive_service = service
+    return service
+
+def close_all():
+    """生成済みクライアントのチャネル・セッションを閉じる"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close is None:
+            transport = getattr(client, "transport", None)
+            close = getattr(transport, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                print(f"Error closing client: {str(e)}")
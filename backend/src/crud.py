@@ -1,22 +1,32 @@
 from typing import List, Optional
 from datetime import datetime
+import os
 import uuid
 
-from google.cloud import firestore
-from google.cloud import bigquery
 from fastapi import HTTPException, Request
 
+from . import clients, utils
+from .audit_log import AuditLogPipeline, FIRESTORE_BATCH_LIMIT
+from .allow_list import VERSION_DOC_ID, normalize_domain, normalize_email
 from .models import (
     User, UserCreate, UserUpdate,
     AuthSettings, AuthSettingsUpdate,
     AuthDomain, AuthDomainCreate, AuthDomainUpdate,
-    AuthAuditLog,
+    AuthAuditLog, AllowListImport, AllowListImportResult,
     user_from_dict, user_to_dict,
     auth_domain_from_dict, auth_domain_to_dict
 )
 
-db = firestore.Client()
-bq = bigquery.Client()
+db = clients.get_firestore_client()
+bq = clients.get_bigquery_client()
+
+# 監査ログはキューに積み、バックグラウンドでまとめて書き込む
+audit_log_pipeline = AuditLogPipeline(
+    db, bq, f"{bq.project}.auth_management.auth_audit_logs",
+    max_queue=int(os.getenv("AUDIT_LOG_MAX_QUEUE", "10000")),
+    flush_interval=float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "1.0")),
+    spill_dir=os.getenv("AUDIT_LOG_SPILL_DIR") or None
+)
 
 # ユーザー管理
 async def create_user(user: UserCreate) -> User:
@@ -96,6 +106,7 @@ async def update_auth_settings(settings: AuthSettingsUpdate) -> AuthSettings:
     update_data['updated_at'] = datetime.utcnow()
     
     doc_ref.update(update_data)
+    touch_allow_list_version()
     return AuthSettings(**doc_ref.get().to_dict())
 
 # ドメイン管理
@@ -109,6 +120,7 @@ async def create_auth_domain(domain: AuthDomainCreate) -> AuthDomain:
     doc_ref = db.collection('allowed_domains').document()
     domain_data = auth_domain_to_dict(domain)
     doc_ref.set(domain_data)
+    touch_allow_list_version()
     
     return auth_domain_from_dict(domain_data, doc_ref.id)
 
@@ -132,9 +144,69 @@ async def update_auth_domain(domain_id: str, domain: AuthDomainUpdate) -> Option
     
     update_data = auth_domain_to_dict(domain)
     doc_ref.update(update_data)
+    touch_allow_list_version()
     
     return auth_domain_from_dict(doc_ref.get().to_dict(), domain_id)
 
+def touch_allow_list_version():
+    """許可リスト・認証設定の変更をポーリング中のプロセスに知らせるスタンプを更新"""
+    db.collection('auth_settings').document(VERSION_DOC_ID).set({
+        'stamp': str(uuid.uuid4()),
+        'updated_at': datetime.utcnow()
+    })
+
+async def bulk_import_allow_list(request: AllowListImport) -> AllowListImportResult:
+    """許可ドメイン・メールアドレスをまとめて登録（500件ごとのバッチ書き込み）
+
+    登録済みで有効なものはスキップ、無効化されているものは有効に戻す。
+    重複判定は許可リスト判定エンジンが保持している内容で行う。
+    """
+    allow_list = utils.get_allow_list()
+    result = AllowListImportResult()
+    now = datetime.utcnow()
+    writes = []
+    for kind, field, values, normalize, is_valid in (
+        ('domains', 'domain', request.domains, normalize_domain, lambda v: '.' in v and '@' not in v),
+        ('emails', 'email', request.emails, normalize_email, lambda v: v.count('@') == 1 and '.' in v.split('@')[1]),
+    ):
+        collection = db.collection(f'allowed_{kind}')
+        existing = allow_list.index(kind)
+        seen = set()
+        for raw in values:
+            value = normalize(raw)
+            if not is_valid(value):
+                result.invalid.append(raw)
+                continue
+            if value in seen:
+                result.skipped += 1
+                continue
+            seen.add(value)
+            if value in existing:
+                doc_id, data = existing[value]
+                if data.get('is_active', True):
+                    result.skipped += 1
+                    continue
+                writes.append(('update', collection.document(doc_id), {'is_active': True, 'updated_at': now}))
+                result.reactivated += 1
+            else:
+                writes.append(('set', collection.document(), {
+                    field: value,
+                    'description': request.description,
+                    'is_active': True,
+                    'created_at': now,
+                    'updated_at': now
+                }))
+                result.created += 1
+
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for method, doc_ref, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            getattr(batch, method)(doc_ref, data)
+        batch.commit()
+    if writes:
+        touch_allow_list_version()
+    return result
+
 # BigQuery連携
 async def sync_user_to_bigquery(user_id: str, data: dict):
     """ユーザー情報の変更をBigQueryに同期"""
@@ -180,30 +252,13 @@ async def log_auth_action(
         ip_address=request.client.host,
         user_agent=request.headers.get('user-agent', '')
     )
-    
-    # Firestoreに保存
-    doc_ref = db.collection('auth_audit_logs').document(log.log_id)
-    doc_ref.set(log.dict())
-    
-    # BigQueryに保存
-    table = bq.get_table('auth_audit_logs')
-    rows = [log.dict()]
-    bq.insert_rows(table, rows)
+    audit_log_pipeline.enqueue(log.dict())
 
 # ドメイン検証
 async def is_domain_allowed(domain: str) -> bool:
-    """ドメインが許可リストに含まれているかチェック"""
-    settings = await get_auth_settings()
-    if not settings.allow_only_listed_domains:
-        return True
-    
-    if settings.allow_personal_gmail and domain == 'gmail.com':
-        return True
-    
-    query = db.collection('allowed_domains')\
-        .where('domain', '==', domain)\
-        .where('is_active', '==', True)\
-        .limit(1)
-    
-    docs = query.get()
-    return len(docs) > 0
+    """ドメインが許可リストに含まれているかチェック（サブドメインを含む）"""
+    return utils.get_allow_list().is_domain_allowed(domain)
+
+async def is_email_allowed(email: str) -> bool:
+    """メールアドレスが許可されているかチェック（許可メールアドレス・許可ドメイン）"""
+    return utils.get_allow_list().is_email_allowed(email)
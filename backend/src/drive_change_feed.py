@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+import json
+
+from src.idempotency import processing_key
+
+# changes.list の1ページあたりの件数（上限1000）
+DRIVE_CHANGES_PAGE_SIZE = 1000
+# 変更ごとに process_drive_change が必要とするメタデータをまとめて取得する（files().get を省く）
+CHANGE_FIELDS = (
+    "nextPageToken,newStartPageToken,"
+    "changes(changeType,fileId,removed,time,"
+    "file(id,name,mimeType,parents,modifiedTime,trashed,md5Checksum))"
+)
+
+
+@dataclass
+class FileChange:
+    """Drive のファイルの変更1件（同じファイルの変更は最新のものにまとめる）"""
+    file_id: str
+    removed: bool
+    file: Optional[dict]
+    time: Optional[str] = None
+
+    @property
+    def is_deleted(self) -> bool:
+        return self.removed or bool((self.file or {}).get("trashed"))
+
+
+def collapse_changes(changes: list[dict], into: Optional[dict[str, FileChange]] = None) -> dict[str, FileChange]:
+    """changes.list の変更を file_id ごとに最新の1件にまとめる（ファイル以外の変更は除く）"""
+    collapsed = into if into is not None else {}
+    for change in changes:
+        if change.get("changeType", "file") != "file" or not change.get("fileId"):
+            continue
+        file_id = change["fileId"]
+        # 最後の変更が有効。順序は最後に変更された位置に合わせる
+        collapsed.pop(file_id, None)
+        collapsed[file_id] = FileChange(
+            file_id=file_id,
+            removed=bool(change.get("removed")),
+            file=change.get("file"),
+            time=change.get("time")
+        )
+    return collapsed
+
+
+class FirestorePageTokenStore:
+    """changes.list のページトークンを Firestore に保存する永続層"""
+
+    def __init__(self, db, feed_id: str = "default", collection: str = "drive_change_feeds"):
+        self._doc = db.collection(collection).document(feed_id)
+
+    def get(self) -> Optional[str]:
+        doc = self._doc.get()
+        return doc.to_dict().get("page_token") if doc.exists else None
+
+    def set(self, page_token: str):
+        self._doc.set({"page_token": page_token, "updated_at": datetime.utcnow()}, merge=True)
+
+
+class DriveChangeFeed:
+    """Drive の変更フィードを changes.list のポーリングで取り込む
+
+    保存済みのページトークンから最大 max_pages ページ（1ページ1000件）を読み、
+    同じファイルへの変更を最新の1件にまとめてから dispatch に一括で渡す。
+    変更には必要なメタデータを含めて取得するため、ファイルごとの files().get は
+    不要になる。dispatch が成功してからページトークンを保存するため、失敗した
+    場合は次回のポーリングで同じ範囲を読み直す（dispatch は冪等であること）。
+    drive には discovery で構築した Drive API v3 のサービス（またはフェイク）を渡す。
+    """
+
+    def __init__(self, drive, store, dispatch: Callable[[list[FileChange]], None],
+                 page_size: int = DRIVE_CHANGES_PAGE_SIZE, drive_id: Optional[str] = None):
+        self._drive = drive
+        self._store = store
+        self._dispatch = dispatch
+        self._page_size = page_size
+        self._drive_id = drive_id
+
+    def _drive_params(self) -> dict:
+        params = {"supportsAllDrives": True}
+        if self._drive_id:
+            params["driveId"] = self._drive_id
+        return params
+
+    def poll(self, max_pages: int = 10) -> dict:
+        """変更を読み込んで dispatch し、処理件数を返す"""
+        page_token = self._store.get()
+        if page_token is None:
+            # 初回は現在位置を保存するだけ（それ以前の変更は取り込まない）
+            start = self._drive.changes().getStartPageToken(**self._drive_params()).execute()
+            self._store.set(start["startPageToken"])
+            return {"status": "initialized", "page_token": start["startPageToken"]}
+
+        collapsed: dict[str, FileChange] = {}
+        received = 0
+        pages = 0
+        next_token = page_token
+        caught_up = False
+        while pages < max_pages:
+            response = self._drive.changes().list(
+                pageToken=next_token,
+                pageSize=self._page_size,
+                includeRemoved=True,
+                includeItemsFromAllDrives=True,
+                fields=CHANGE_FIELDS,
+                **self._drive_params()
+            ).execute()
+            pages += 1
+            changes = response.get("changes", [])
+            received += len(changes)
+            collapse_changes(changes, collapsed)
+            if response.get("nextPageToken"):
+                next_token = response["nextPageToken"]
+            else:
+                next_token = response["newStartPageToken"]
+                caught_up = True
+                break
+
+        if collapsed:
+            self._dispatch(list(collapsed.values()))
+        if next_token != page_token:
+            self._store.set(next_token)
+        return {
+            "status": "success" if caught_up else "more",
+            "pages": pages,
+            "changes": received,
+            "dispatched": len(collapsed),
+            "page_token": next_token
+        }
+
+
+def poll_response(feed: DriveChangeFeed, max_pages: int) -> tuple[str, int]:
+    """ポーリングを1回行い、HTTP のレスポンスとステータスコードを返す
+
+    反映できなかった変更があれば 500 を返し、Cloud Scheduler の再試行と次回の
+    ポーリングで同じ変更を読み直す（解放した処理権はそのときに取り直す）。
+    """
+    try:
+        result = feed.poll(max_pages=max_pages)
+    except Exception as e:
+        print(f"Error polling drive changes: {str(e)}")
+        return f"Error polling drive changes: {str(e)}", 500
+    print(f"Drive change feed: {result}")
+    return json.dumps(result), 200
+
+class DispatchError(RuntimeError):
+    """変更の一部を反映できなかった（ページトークンを進めず、次回のポーリングで読み直す）"""
+
+    def __init__(self, failed: list[str], total: int):
+        super().__init__(f"Failed to apply {len(failed)} of {total} changes: {', '.join(failed[:10])}")
+        self.failed = failed
+        self.total = total
+
+
+class FileChangeDispatcher:
+    """まとめた変更を削除・OCR・ステージングのパイプラインに一括で渡す
+
+    削除は mark_deleted で1回、OCR対象のファイルは並行してOCRし、ステージングへの
+    行は stage_rows で1回で記録する。処理済み・処理中の版は OCR を省いてメタデータ
+    だけを記録する。OCR・ステージング・削除のどれかが失敗した場合は処理権を解放して
+    DispatchError（または元の例外）を送出し、DriveChangeFeed にページトークンを
+    保存させない。次回のポーリングでは同じ変更を読み直し、解放した版を完了した
+    ステップから再開する。mark_deleted と stage_rows は失敗時に例外を送出すること。
+    """
+
+    def __init__(self, processor, run_ocr: Callable[[str, dict], dict],
+                 stage_rows: Callable[[list[dict]], None],
+                 mark_deleted: Callable[[list[str]], None],
+                 build_row: Callable[[str, dict, Optional[dict]], dict],
+                 is_supported: Callable[[dict], bool], max_workers: int = 8):
+        self._processor = processor
+        self._run_ocr = run_ocr
+        self._stage_rows = stage_rows
+        self._mark_deleted = mark_deleted
+        self._build_row = build_row
+        self._is_supported = is_supported
+        self._max_workers = max_workers
+
+    def _ocr(self, change: FileChange):
+        """(context, OCR結果, 失敗したか) を返す"""
+        context = self._processor.claim(processing_key(change.file_id, change.file))
+        if context is None:
+            # 処理済み・処理中の版は OCR だけ省き、メタデータ（移動・リネーム）は記録する
+            return None, None, False
+        try:
+            return context, context.step("ocr", lambda: self._run_ocr(change.file_id, change.file)), False
+        except Exception as e:
+            print(f"Error processing OCR for {change.file_id}: {str(e)}")
+            context.fail(e)
+            return None, None, True
+
+    def __call__(self, changes: list[FileChange]):
+        deleted = [change.file_id for change in changes if change.is_deleted]
+        targets = [change for change in changes
+                   if not change.is_deleted and change.file and self._is_supported(change.file)]
+        if deleted:
+            self._mark_deleted(deleted)
+        if not targets:
+            return
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results = list(executor.map(self._ocr, targets))
+        try:
+            # OCRに失敗した版もメタデータ（移動・リネーム）は記録する
+            self._stage_rows([
+                self._build_row(change.file_id, change.file, ocr_data)
+                for change, (_, ocr_data, _) in zip(targets, results)
+            ])
+        except Exception as e:
+            for context, _, _ in results:
+                if context is not None:
+                    context.fail(e)
+            raise
+        for context, _, _ in results:
+            if context is not None:
+                context.finish()
+
+        failed = [change.file_id for change, (_, _, error) in zip(targets, results) if error]
+        if failed:
+            raise DispatchError(failed, len(targets))
@@ -0,0 +1,128 @@
+from typing import Callable
+import json
+import os
+import threading
+
+# BatchSettings: 通知は小さいため件数と待ち時間で区切る
+PUBLISH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "500"))
+PUBLISH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+PUBLISH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.05"))
+
+
+def create_publisher_client():
+    """バッチ送信と順序指定キーを有効にした PublisherClient を作成
+
+    PUBSUB_EMULATOR_HOST が設定されていればクライアントライブラリがエミュレータに接続する。
+    """
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient(
+        batch_settings=pubsub_v1.types.BatchSettings(
+            max_messages=PUBLISH_MAX_MESSAGES,
+            max_bytes=PUBLISH_MAX_BYTES,
+            max_latency=PUBLISH_MAX_LATENCY
+        ),
+        publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=True)
+    )
+
+
+class NotificationCoalescer:
+    """発行中の同じファイル・同じ種類の通知を1件にまとめる
+
+    まとめるのは Pub/Sub への送信が完了していない通知だけにする。購読側はその通知を
+    受け取ってからメタデータを読むため、まとめた通知の変更も必ず反映される。
+    まとめた通知には元の通知と同じ Future を返すため、発行に失敗した場合は
+    まとめた通知の呼び出し元にも失敗が返る（確認応答せずに通知が失われることはない）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str], object] = {}
+
+    def get_or_publish(self, file_id: str, change_type: str, publish: Callable[[], object]):
+        """発行中の Future があればそれを返し、なければ publish() で発行する
+
+        Returns:
+            tuple: (Future, まとめたかどうか)
+        """
+        key = (file_id, change_type)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending, True
+            future = publish()
+            self._pending[key] = future
+
+        def on_done(done_future):
+            with self._lock:
+                if self._pending.get(key) is done_future:
+                    del self._pending[key]
+
+        future.add_done_callback(on_done)
+        return future, False
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+class DriveChangePublisher:
+    """Drive の変更通知を Pub/Sub に発行する（プロセスで共有する）
+
+    PublisherClient は初回の発行時に1度だけ作成し、BatchSettings で複数の
+    リクエストの通知をまとめて送る。ordering_key に file_id を指定して同じ
+    ファイルの通知の順序を保ち、発行中の同じ通知には新たに発行せず同じ Future を返す。
+    順序指定キーの発行に失敗した場合は resume_publish でそのキーの発行を再開する。
+    """
+
+    def __init__(self, project_id: str, topic: str, client_factory: Callable = create_publisher_client):
+        self._project_id = project_id
+        self._topic = topic
+        self._client_factory = client_factory
+        self._client = None
+        self._topic_path = None
+        self._lock = threading.Lock()
+        self._coalescer = NotificationCoalescer()
+        self._published = 0
+        self._coalesced = 0
+        self._failed = 0
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._client_factory()
+                    self._topic_path = client.topic_path(self._project_id, self._topic)
+                    self._client = client
+        return self._client
+
+    def publish(self, message: dict):
+        """通知を発行し、Future を返す（発行中の同じ通知があればその Future を返す）"""
+        file_id = message["file_id"]
+        change_type = message.get("change_type") or ""
+        client = self._get_client()
+
+        def send():
+            future = client.publish(self._topic_path, json.dumps(message).encode("utf-8"), ordering_key=file_id)
+            future.add_done_callback(on_done)
+            return future
+
+        def on_done(done_future):
+            if done_future.exception() is None:
+                self._published += 1
+                return
+            self._failed += 1
+            print(f"Error publishing drive change for {file_id}: {done_future.exception()}")
+            client.resume_publish(self._topic_path, file_id)
+
+        future, coalesced = self._coalescer.get_or_publish(file_id, change_type, send)
+        if coalesced:
+            self._coalesced += 1
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "published": self._published,
+            "coalesced": self._coalesced,
+            "failed": self._failed,
+            "pending": self._coalescer.pending_count()
+        }
@@ -0,0 +1,193 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+import threading
+import time
+
+
+@dataclass
+class DriveChange:
+    """Drive の変更通知1件（同じ file_id の通知は最後のものが有効）"""
+    file_id: str
+    change_type: str
+    changed_at: datetime
+
+
+def build_drive_change_merge(table_id: str) -> str:
+    """溜めた変更通知を file_id の一致で file_metadata に反映する MERGE 文
+
+    変更は @file_ids / @change_types / @changed_at の同じ位置の要素を1件として渡す。
+    削除は論理削除（is_deleted, deleted_at）、それ以外は updated_at のみを更新する。
+    """
+    return f"""
+    MERGE `{table_id}` T
+    USING (
+        SELECT file_id, @change_types[OFFSET(i)] AS change_type, @changed_at[OFFSET(i)] AS changed_at
+        FROM UNNEST(@file_ids) AS file_id WITH OFFSET i
+    ) S
+    ON T.file_id = S.file_id
+    WHEN MATCHED AND S.change_type = 'delete' THEN
+        UPDATE SET is_deleted = TRUE, deleted_at = S.changed_at, updated_at = S.changed_at
+    WHEN MATCHED THEN
+        UPDATE SET updated_at = S.changed_at
+    """
+
+
+def merge_drive_changes(client, table_id: str, changes: list[DriveChange]) -> Optional[int]:
+    """変更通知をパラメータ化した1回の MERGE で反映し、更新行数を返す"""
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("file_ids", "STRING", [change.file_id for change in changes]),
+        bigquery.ArrayQueryParameter("change_types", "STRING", [change.change_type for change in changes]),
+        bigquery.ArrayQueryParameter("changed_at", "TIMESTAMP", [change.changed_at for change in changes])
+    ])
+    job = client.query(build_drive_change_merge(table_id), job_config=job_config)
+    job.result()
+    return job.num_dml_affected_rows
+
+
+class DriveChangeBuffer:
+    """Drive の変更通知を溜めてまとめて反映する
+
+    add() は通知を file_id ごとに上書き（最後の通知が有効）し、反映の結果を受け取る
+    Future を返す。バックグラウンドスレッドが最古の通知から interval 秒後、または
+    max_pending 件に達した時点で apply に全件を渡し、同じ MERGE に含めた通知の
+    Future をまとめて完了させる（失敗時は例外を設定する）。呼び出し側は Future の
+    完了を待ってから応答し、失敗した通知は送信元に再送させる。apply が失敗した
+    場合は、その後に新しい通知が来ていない file_id のみを戻して次回にも再試行する。
+    close() で反映できなかった通知は unmerged_at_close に数え、一覧を返す。
+    """
+
+    def __init__(self, apply: Callable[[list[DriveChange]], Optional[int]], interval: float = 5.0,
+                 max_pending: int = 1000):
+        self._apply = apply
+        self._interval = interval
+        self._max_pending = max_pending
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending: dict[str, DriveChange] = {}
+        self._waiters: list[Future] = []
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._received = 0
+        self._applied = 0
+        self._affected_rows = 0
+        self._merge_count = 0
+        self._failure_count = 0
+        self._last_error: Optional[str] = None
+        self._last_merge_seconds: Optional[float] = None
+        self._unmerged_at_close = 0
+
+    def add(self, file_id: str, change_type: str, changed_at: Optional[datetime] = None) -> Future:
+        """変更通知を記録（反映は非同期。反映が終わると Future が完了する）"""
+        change = DriveChange(file_id, change_type, changed_at or datetime.now(timezone.utc))
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DriveChangeBuffer is closed")
+            self._pending[file_id] = change
+            self._waiters.append(future)
+            self._received += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="drive-change-buffer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def flush(self):
+        """溜まっている通知をすぐに反映"""
+        with self._cond:
+            batch, waiters = self._take_batch()
+        if batch:
+            self._merge(batch, waiters)
+
+    def close(self, timeout: Optional[float] = None) -> list[DriveChange]:
+        """新規受付を止め、残りの通知を反映してから停止（反映できなかった通知を返す）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        with self._cond:
+            unmerged, _ = self._take_batch()
+        if unmerged:
+            # 送信元には失敗を返しているため再送される。反映できなかった file_id を残す
+            self._unmerged_at_close += len(unmerged)
+            print(f"Drive changes not merged at close ({len(unmerged)}): "
+                  f"{', '.join(change.file_id for change in unmerged)}")
+        return unmerged
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self._received,
+            "applied": self._applied,
+            "deduplicated": self._received - self._applied - len(self._pending),
+            "affected_rows": self._affected_rows,
+            "merge_count": self._merge_count,
+            "failure_count": self._failure_count,
+            "unmerged_at_close": self._unmerged_at_close,
+            "last_error": self._last_error,
+            "last_merge_latency_ms": self._last_merge_seconds * 1000 if self._last_merge_seconds is not None else None
+        }
+
+    def _is_due(self) -> bool:
+        return bool(self._pending) and (
+            len(self._pending) >= self._max_pending
+            or time.monotonic() - self._oldest >= self._interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._is_due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self._interval - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch, waiters = self._take_batch()
+            self._merge(batch, waiters)
+
+    def _take_batch(self) -> tuple[list[DriveChange], list[Future]]:
+        batch = list(self._pending.values())
+        waiters = self._waiters
+        self._pending = {}
+        self._waiters = []
+        self._oldest = None
+        return batch, waiters
+
+    def _merge(self, batch: list[DriveChange], waiters: list[Future]):
+        with self._flush_lock:
+            start = time.monotonic()
+            try:
+                affected = self._apply(batch)
+            except Exception as e:
+                print(f"Drive change merge error ({len(batch)} changes): {e}")
+                self._failure_count += 1
+                self._last_error = str(e)
+                with self._cond:
+                    # 失敗中に新しい通知が来た file_id はそちらを優先
+                    for change in batch:
+                        self._pending.setdefault(change.file_id, change)
+                    if self._pending and self._oldest is None:
+                        self._oldest = time.monotonic()
+                for future in waiters:
+                    future.set_exception(e)
+                return
+            finally:
+                self._last_merge_seconds = time.monotonic() - start
+
+            self._applied += len(batch)
+            self._affected_rows += affected or 0
+            self._merge_count += 1
+        for future in waiters:
+            future.set_result(affected)
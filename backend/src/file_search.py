@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import base64
+import hashlib
+import json
+import threading
+import time
+
+from .normalize import normalize, normalize_with_offsets
+
+# 検索結果で常に返す列（ocr_text は include_ocr_text を指定した場合のみ取得する）
+SEARCH_COLUMNS = (
+    "file_id", "file_name", "file_url", "mime_type", "matched_user_ids", "matched_names",
+    "is_deleted", "created_at", "updated_at"
+)
+
+
+class InvalidPageToken(ValueError):
+    """ページトークンを解釈できない、または別の検索条件のもの"""
+    pass
+
+
+def query_fingerprint(where_clause: str, params: list[tuple[str, str, object]]) -> str:
+    """検索条件（WHERE句とパラメータ）から件数キャッシュ・ページトークン用の識別子を作成
+
+    Args:
+        params: (パラメータ名, 型, 値) のリスト
+    """
+    payload = json.dumps([where_clause, sorted(params)], default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_page_token(fingerprint: str, created_at: datetime, file_id: str) -> str:
+    """最後に返した行の (created_at, file_id) を次ページのトークンにする"""
+    payload = json.dumps({"q": fingerprint, "c": created_at.isoformat(), "f": file_id})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token: str, fingerprint: str) -> tuple[datetime, str]:
+    """ページトークンから (created_at, file_id) を取り出す"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        created_at = datetime.fromisoformat(payload["c"])
+        file_id = payload["f"]
+        token_fingerprint = payload["q"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidPageToken(f"Invalid page token: {e}")
+    if token_fingerprint != fingerprint:
+        raise InvalidPageToken("Page token does not match the search conditions")
+    return created_at, file_id
+
+
+def default_date_from(lookback_days: int, now: Optional[datetime] = None) -> datetime:
+    """期間の指定がない検索で使う created_at の下限（パーティションの絞り込み用）
+
+    件数キャッシュとページトークンが同じ日の間は同じ検索条件になるよう、日付の境界に丸める。
+    """
+    now = now or datetime.now(timezone.utc)
+    day = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=lookback_days)
+
+
+def snippet_expression() -> str:
+    """ocr_text の最初の一致箇所の前後 @snippet_chars 文字を BigQuery 側で切り出す式
+
+    一致位置が見つからない場合（CONTAINS_SUBSTR の正規化でのみ一致した場合）は先頭を返す。
+    """
+    return (
+        "SUBSTR(ocr_text, GREATEST(STRPOS(LOWER(ocr_text), LOWER(@query_text)) - @snippet_chars, 1), "
+        "CHAR_LENGTH(@query_text) + 2 * @snippet_chars) AS snippet"
+    )
+
+
+def highlight_spans(snippet: str, query_text: str) -> list[tuple[int, int]]:
+    """スニペット中の検索語の位置 [start, end) を返す（全角・半角、かな、大小文字の違いは無視）"""
+    key = normalize(query_text)
+    if not snippet or not key:
+        return []
+    normalized = normalize_with_offsets(snippet)
+    spans = []
+    start = normalized.text.find(key)
+    while start != -1:
+        spans.append(normalized.span(start, start + len(key)))
+        start = normalized.text.find(key, start + len(key))
+    return spans
+
+
+def build_search_query(table_id: str, where_clause: str, include_ocr_text: bool = False,
+                       after_cursor: bool = False, use_offset: bool = False, snippet: bool = False,
+                       ranked: bool = False) -> str:
+    """(created_at, file_id) の降順で1ページ分を取得するクエリ
+
+    after_cursor の場合は @cursor_created_at / @cursor_file_id より後の行のみを対象にし、
+    OFFSET による読み飛ばしを行わない。use_offset は従来の offset 指定との互換用。
+    snippet の場合は ocr_text 全体の代わりに一致箇所周辺のみを取得する。
+    ranked の場合は全文検索インデックスの順位（@index_file_ids の並び）で返し、
+    カーソルは @cursor_rank を使う。
+    """
+    columns = list(SEARCH_COLUMNS) + (["ocr_text"] if include_ocr_text else [])
+    if snippet:
+        columns.append(snippet_expression())
+    conditions = [where_clause]
+    source = f"`{table_id}`"
+    order_by = "created_at DESC, file_id DESC"
+    if ranked:
+        source += " JOIN UNNEST(@index_file_ids) AS hit_id WITH OFFSET AS hit_rank ON hit_id = file_id"
+        order_by = "hit_rank"
+        if after_cursor:
+            conditions.append("hit_rank > @cursor_rank")
+    elif after_cursor:
+        # 単独の created_at <= @cursor_created_at は以降のページでパーティションの絞り込みに使われる
+        conditions.append(
+            "created_at <= @cursor_created_at AND (created_at < @cursor_created_at"
+            " OR (created_at = @cursor_created_at AND file_id < @cursor_file_id))"
+        )
+    return f"""
+    SELECT {", ".join(columns)}
+    FROM {source}
+    WHERE {" AND ".join(conditions)}
+    ORDER BY {order_by}
+    LIMIT @limit{" OFFSET @offset" if use_offset else ""}
+    """
+
+
+def build_text_query(table_id: str, by_created_at: bool = False) -> str:
+    """1ファイル分の OCR テキスト全体を取得するクエリ（by_created_at の場合は @created_at のパーティションのみ）"""
+    partition_filter = " AND created_at = @created_at" if by_created_at else ""
+    return f"""
+    SELECT file_id, matched_user_ids, ocr_text
+    FROM `{table_id}`
+    WHERE file_id = @file_id{partition_filter}
+    LIMIT 1
+    """
+
+
+def build_count_query(table_id: str, where_clause: str) -> str:
+    return f"""
+    SELECT COUNT(*) as total
+    FROM `{table_id}`
+    WHERE {where_clause}
+    """
+
+
+class CountCache:
+    """検索条件ごとの総件数を TTL 付きで保持する
+
+    ページ送りのたびに COUNT(*) を再実行しないよう、query_fingerprint() をキーに
+    件数を ttl 秒間キャッシュする。
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 1000):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, fingerprint: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None or time.monotonic() - entry[0] > self._ttl:
+                if entry is not None:
+                    del self._entries[fingerprint]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, fingerprint: str, total: int):
+        with self._lock:
+            self._entries[fingerprint] = (time.monotonic(), total)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else None
+        }
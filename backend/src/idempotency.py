@@ -0,0 +1,266 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+import json
+import threading
+import time
+import uuid
+
+# 処理中の印の有効期間（これを過ぎた処理は中断したとみなして引き継ぐ）
+DEFAULT_LEASE_SECONDS = 600
+# 途中結果として保存する値の上限（Firestore のドキュメント上限 1MiB に収める）
+MAX_STEP_BYTES = 512 * 1024
+# 処理済みの記録を残す期間（Firestore の TTL ポリシーで expires_at を指定する）
+RECORD_TTL_DAYS = 7
+
+
+def processing_key(file_id: str, file_metadata: dict) -> str:
+    """ファイルの版を表すキー（同じ版への重複イベント・再配信は同じキーになる）"""
+    return ":".join([
+        file_id,
+        file_metadata.get("modifiedTime") or "",
+        file_metadata.get("md5Checksum") or ""
+    ])
+
+
+def _storable(value: Any) -> bool:
+    try:
+        return len(json.dumps(value, ensure_ascii=False).encode("utf-8")) <= MAX_STEP_BYTES
+    except (TypeError, ValueError):
+        return False
+
+
+@dataclass
+class Claim:
+    """処理権の取得結果（status は acquired / done / in_flight）"""
+    status: str
+    steps: dict = field(default_factory=dict)
+
+
+class MemoryIdempotencyStore:
+    """処理状態をプロセス内に保持するストア（ローカル実行・テスト用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: dict[str, dict] = {}
+
+    def claim(self, key: str, owner: str, lease_seconds: float) -> Claim:
+        now = time.time()
+        with self._lock:
+            record = self._records.get(key, {})
+            if record.get("status") == "done":
+                return Claim("done")
+            if record.get("status") == "in_progress" and record["lease_expires_at"] > now:
+                return Claim("in_flight")
+            steps = dict(record.get("steps", {}))
+            self._records[key] = {
+                "status": "in_progress", "owner": owner, "lease_expires_at": now + lease_seconds,
+                "attempts": record.get("attempts", 0) + 1, "steps": steps
+            }
+            return Claim("acquired", dict(steps))
+
+    def _owned(self, key: str, owner: str) -> Optional[dict]:
+        record = self._records.get(key)
+        if record is None or record.get("owner") != owner or record.get("status") != "in_progress":
+            return None
+        return record
+
+    def complete_step(self, key: str, owner: str, name: str, value: Any) -> bool:
+        with self._lock:
+            record = self._owned(key, owner)
+            if record is None:
+                return False
+            record["steps"][name] = value
+            return True
+
+    def finish(self, key: str, owner: str) -> bool:
+        with self._lock:
+            if self._owned(key, owner) is None:
+                return False
+            self._records[key] = {"status": "done", "owner": owner}
+            return True
+
+    def release(self, key: str, owner: str, error: str) -> bool:
+        with self._lock:
+            record = self._owned(key, owner)
+            if record is None:
+                return False
+            record.update({"status": "failed", "lease_expires_at": 0, "last_error": error})
+            return True
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._records.get(key)
+
+
+class FirestoreIdempotencyStore:
+    """処理状態を Firestore に保持するストア（インスタンス間で共有）
+
+    処理権の取得はトランザクションで行い、同じキーを同時に処理できるのは
+    1インスタンスだけにする。完了した記録は expires_at を過ぎたら TTL で削除される。
+    """
+
+    def __init__(self, db, collection: str = "drive_processing"):
+        self._db = db
+        self._collection = db.collection(collection)
+
+    def _document(self, key: str):
+        # ドキュメントIDに "/" は使えない
+        return self._collection.document(key.replace("/", "_"))
+
+    def claim(self, key: str, owner: str, lease_seconds: float) -> Claim:
+        from google.cloud import firestore
+        ref = self._document(key)
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            record = snapshot.to_dict() if snapshot.exists else {}
+            now = time.time()
+            if record.get("status") == "done":
+                return Claim("done")
+            if record.get("status") == "in_progress" and record.get("lease_expires_at", 0) > now:
+                return Claim("in_flight")
+            steps = record.get("steps", {})
+            transaction.set(ref, {
+                "key": key,
+                "status": "in_progress",
+                "owner": owner,
+                "lease_expires_at": now + lease_seconds,
+                "attempts": record.get("attempts", 0) + 1,
+                "steps": steps,
+                "updated_at": datetime.utcnow(),
+                "expires_at": datetime.utcnow() + timedelta(days=RECORD_TTL_DAYS)
+            })
+            return Claim("acquired", steps)
+
+        return claim_in_transaction(self._db.transaction())
+
+    def _update_if_owner(self, key: str, owner: str, updates: dict) -> bool:
+        """処理権を持っている（owner が一致し処理中）場合だけ更新する
+
+        リースが切れて別のインスタンスに引き継がれた後の書き込みは行わない。
+        """
+        from google.cloud import firestore
+        ref = self._document(key)
+
+        @firestore.transactional
+        def update_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            record = snapshot.to_dict() if snapshot.exists else {}
+            if record.get("owner") != owner or record.get("status") != "in_progress":
+                return False
+            transaction.update(ref, {**updates, "updated_at": datetime.utcnow()})
+            return True
+
+        return update_in_transaction(self._db.transaction())
+
+    def complete_step(self, key: str, owner: str, name: str, value: Any) -> bool:
+        return self._update_if_owner(key, owner, {f"steps.{name}": value})
+
+    def finish(self, key: str, owner: str) -> bool:
+        # 途中結果は不要になるため消す
+        return self._update_if_owner(key, owner, {"status": "done", "steps": {}})
+
+    def release(self, key: str, owner: str, error: str) -> bool:
+        return self._update_if_owner(key, owner, {
+            "status": "failed", "lease_expires_at": 0, "last_error": error[:1000]
+        })
+
+
+class ProcessingContext:
+    """処理権を取得した1件の処理（完了したステップは再実行しない）"""
+
+    def __init__(self, processor: "IdempotentProcessor", key: str, owner: str, steps: dict):
+        self._processor = processor
+        self.key = key
+        self._owner = owner
+        self._steps = steps
+
+    @property
+    def resumed_steps(self) -> list[str]:
+        return list(self._steps)
+
+    def step(self, name: str, fn: Callable[[], Any]) -> Any:
+        """ステップを実行して結果を記録（前回の試行で完了していれば記録した結果を返す）"""
+        if name in self._steps:
+            self._processor._resumed += 1
+            return self._steps[name]
+        value = fn()
+        # 大きすぎる結果は記録せず、再開時に再実行する
+        if _storable(value):
+            if not self._processor._store.complete_step(self.key, self._owner, name, value):
+                self._processor._lost_lease(self.key)
+            self._steps[name] = value
+        return value
+
+    def finish(self) -> bool:
+        """処理済みにする（処理権を失っていた場合は False）"""
+        if not self._processor._store.finish(self.key, self._owner):
+            self._processor._lost_lease(self.key)
+            return False
+        self._processor._processed += 1
+        return True
+
+    def fail(self, error: Exception):
+        if not self._processor._store.release(self.key, self._owner, str(error)):
+            self._processor._lost_lease(self.key)
+            return
+        self._processor._failed += 1
+
+
+class IdempotentProcessor:
+    """ファイルの版ごとに処理を1回だけ有効にする
+
+    キーごとに処理権を取得してから処理し、処理済みのキーや他のインスタンスが
+    処理中（リース期間内）のキーは処理しない。ステップごとに結果を記録するため、
+    途中で失敗した処理は再配信時に未完了のステップから再開する。
+    """
+
+    def __init__(self, store, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self._store = store
+        self._lease_seconds = lease_seconds
+        self._processed = 0
+        self._skipped_done = 0
+        self._skipped_in_flight = 0
+        self._resumed = 0
+        self._failed = 0
+        self._lost_leases = 0
+
+    def _lost_lease(self, key: str):
+        self._lost_leases += 1
+        print(f"Lease lost for {key}: another instance has taken over")
+
+    def claim(self, key: str) -> Optional[ProcessingContext]:
+        """処理権を取得（処理済み・処理中なら None）"""
+        owner = uuid.uuid4().hex
+        claim = self._store.claim(key, owner, self._lease_seconds)
+        if claim.status == "done":
+            self._skipped_done += 1
+            return None
+        if claim.status == "in_flight":
+            self._skipped_in_flight += 1
+            return None
+        return ProcessingContext(self, key, owner, claim.steps)
+
+    def run(self, key: str, fn: Callable[[ProcessingContext], None]) -> str:
+        """処理権を取得して fn を実行し、processed / skipped を返す（失敗時は例外）"""
+        context = self.claim(key)
+        if context is None:
+            return "skipped"
+        try:
+            fn(context)
+        except Exception as e:
+            context.fail(e)
+            raise
+        context.finish()
+        return "processed"
+
+    def stats(self) -> dict:
+        return {
+            "processed": self._processed,
+            "skipped_done": self._skipped_done,
+            "skipped_in_flight": self._skipped_in_flight,
+            "resumed_steps": self._resumed,
+            "failed": self._failed,
+            "lost_leases": self._lost_leases
+        }
@@ -1,22 +1,90 @@
 from fastapi import FastAPI, HTTPException, Request, Query, Depends
-from google.cloud import vision, documentai, storage, firestore, bigquery
+from fastapi.responses import StreamingResponse
+from google.cloud import bigquery
 from typing import Optional, List
+from datetime import datetime
+import asyncio
+import json
+import logging
 import os
 from firebase_admin import auth, credentials, initialize_app
-from . import utils, crud
-from .models import UserCreate, UserUpdate, User, FileSearchQuery, FileSearchResult, AuthSettings, AuthDomain, AllowedEmail, AuthDomainCreate, AuthDomainUpdate, AllowedEmailCreate, AllowedEmailUpdate, AuthSettingsUpdate, AuthDomainResponse, AllowedEmailResponse, AuthSettingsResponse
+from . import utils, crud, clients
+from .ocr_pool import OcrExecutor, QueueFullError
+from .storage_io import PeakRssMonitor
+from .drive_changes import DriveChangeBuffer, merge_drive_changes
+from .file_search import CountCache, InvalidPageToken, query_fingerprint, encode_page_token, decode_page_token, build_search_query, build_count_query, build_text_query, highlight_spans, default_date_from
+from .models import UserCreate, UserUpdate, User, FileSearchQuery, FileSearchResult, AuthSettings, AuthDomain, AllowedEmail, AuthDomainCreate, AuthDomainUpdate, AllowedEmailCreate, AllowedEmailUpdate, AuthSettingsUpdate, AuthDomainResponse, AllowedEmailResponse, AuthSettingsResponse, DocumentRequest, DocumentBatchRequest, FileText, DriveFileRequest, DriveChangeNotification
 
 app = FastAPI(title="ファイル管理システム API")
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
 # Firebase Admin初期化
 cred = credentials.Certificate(os.getenv('FIREBASE_ADMIN_CREDENTIALS'))
 initialize_app(cred)
 
-# クライアントの初期化
-vision_client = vision.ImageAnnotatorClient()
-storage_client = storage.Client()
-firestore_client = firestore.Client()
-bigquery_client = bigquery.Client()
+# クライアントの初期化（utils・crud と同じインスタンスを共有）
+firestore_client = clients.get_firestore_client()
+bigquery_client = clients.get_bigquery_client()
+
+# OCR処理の実行エンジン（ブロッキング処理をステージ別の上限付きで実行）
+ocr_executor = OcrExecutor(
+    max_workers=int(os.getenv("OCR_MAX_WORKERS", "16")),
+    max_pending=int(os.getenv("OCR_MAX_PENDING", "64")),
+    stage_limits={
+        "download": int(os.getenv("OCR_DOWNLOAD_CONCURRENCY", "8")),
+        "ocr": int(os.getenv("OCR_CONCURRENCY", "4")),
+        "store": int(os.getenv("OCR_STORE_CONCURRENCY", "8"))
+    }
+)
+
+# /files/search の総件数キャッシュ（検索条件ごと、ページ送りでは再集計しない）
+search_count_cache = CountCache(ttl=float(os.getenv("SEARCH_COUNT_CACHE_TTL", "300")))
+# 全文検索インデックス（SEARCH_INDEX_DIR 設定時）から取得する検索結果の上限
+SEARCH_INDEX_MAX_HITS = int(os.getenv("SEARCH_INDEX_MAX_HITS", "1000"))
+# インデックスがすべてのファイルを含む場合のみ true にする（インスタンスごとのローカルのインデックスは
+# 他のインスタンスや process_drive_change がOCRしたファイルを含まないため、既定では BigQuery で検索する）
+SEARCH_INDEX_AUTHORITATIVE = os.getenv("SEARCH_INDEX_AUTHORITATIVE", "false").lower() == "true"
+# 期間を指定しない検索で対象にする日数（file_metadata は created_at の日単位パーティション）。
+# 検索結果と総件数が変わるため既定（0）では期間で絞り込まず、設定した場合のみ直近の日数に限る
+SEARCH_DEFAULT_LOOKBACK_DAYS = int(os.getenv("SEARCH_DEFAULT_LOOKBACK_DAYS", "0"))
+
+# Drive変更通知のバッファ（file_id ごとに最新の通知のみを一定間隔で1回の MERGE で反映）
+drive_change_buffer = DriveChangeBuffer(
+    lambda changes: merge_drive_changes(
+        bigquery_client,
+        f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata",
+        changes
+    ),
+    interval=float(os.getenv("DRIVE_CHANGE_INTERVAL", "5.0")),
+    max_pending=int(os.getenv("DRIVE_CHANGE_MAX_PENDING", "1000"))
+)
+
+@app.on_event("startup")
+async def start_user_cache():
+    """ユーザーマスターキャッシュ・許可リストを起動時に読み込み、リスナーを開始"""
+    utils.get_user_cache()
+    utils.get_allow_list()
+    utils.get_auth_cache()
+
+@app.on_event("shutdown")
+async def stop_user_cache():
+    utils.get_user_cache().stop()
+    utils.get_allow_list().stop()
+
+@app.on_event("shutdown")
+async def drain_ocr_writer():
+    """実行中のOCR処理の完了を待ち、バッファに残ったOCR結果・Drive変更通知・監査ログをBigQueryと全文検索インデックスへ書き出し"""
+    ocr_executor.shutdown()
+    # 実行中の処理が待っているバッチを送り終えてからクライアントを閉じる
+    utils.close_vision_batcher()
+    utils.get_ocr_writer().close()
+    drive_change_buffer.close()
+    crud.audit_log_pipeline.close()
+    if utils.get_search_index() is not None:
+        utils.get_search_index().flush()
+    clients.close_all()
 
 # 認証ミドルウェア
 async def verify_token(request: Request):
@@ -24,21 +92,31 @@ async def verify_token(request: Request):
     if not token:
         raise HTTPException(status_code=401, detail="No authentication token provided")
     
+    # 検証済みのトークンはキャッシュから返す（トークンの有効期限まで、ユーザー変更時は破棄）
+    auth_cache = utils.get_auth_cache()
+    cached_user = auth_cache.get(token, "user")
+    if cached_user is not None:
+        return cached_user
+    
     try:
         decoded_token = auth.verify_id_token(token)
         user_id = decoded_token['uid']
         
-        # Firestoreからユーザー情報を取得
-        user_doc = firestore_client.collection('users').document(user_id).get()
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="User not found")
+        # ユーザーマスターキャッシュから取得（未反映の新規ユーザーのみFirestoreを参照）
+        user_data = utils.get_user_cache().get(user_id)
+        if user_data is None:
+            user_doc = firestore_client.collection('users').document(user_id).get()
+            if not user_doc.exists:
+                raise HTTPException(status_code=404, detail="User not found")
+            user_data = user_doc.to_dict()
         
-        user_data = user_doc.to_dict()
-        return {
+        current_user = {
             'user_id': user_id,
             'role': user_data.get('role', 'user'),
             'email': decoded_token.get('email')
         }
+        auth_cache.set(token, "user", current_user, exp=decoded_token.get('exp'), user_id=user_id)
+        return current_user
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
@@ -66,6 +144,12 @@ async def verify_token_auth(
     """Firebase認証トークンを検証"""
     try:
         token = credentials.credentials
+        # 許可済みと判定したトークンはキャッシュから返す（許可リスト・認証設定の変更時は破棄）
+        auth_cache = utils.get_auth_cache()
+        cached_token = auth_cache.get(token, "allowed_email")
+        if cached_token is not None:
+            return cached_token
+        
         decoded_token = auth.verify_id_token(token)
         
         # メールアドレスの許可確認
@@ -73,9 +157,10 @@ async def verify_token_auth(
         if not email:
             raise ForbiddenError("メールアドレスが取得できません")
             
-        if not crud.is_email_allowed(firestore_client, email):
+        if not await crud.is_email_allowed(email):
             raise ForbiddenError("このメールアドレスではアクセスできません")
         
+        auth_cache.set(token, "allowed_email", decoded_token, exp=decoded_token.get('exp'), user_id=decoded_token.get('uid'))
         return decoded_token
     except Exception as e:
         raise AuthError(str(e))
@@ -224,24 +309,47 @@ async def delete_email(
         raise HTTPException(status_code=404, detail="メールアドレスが見つかりません")
     return {"message": "メールアドレスを削除しました"}
 
+@app.get("/metrics", tags=["metrics"])
+async def get_metrics(admin = Depends(verify_admin)):
+    """プロセス内キャッシュ等の稼働状況を取得（管理者のみ）"""
+    return {
+        "user_cache": utils.get_user_cache().stats(),
+        "ocr_writer": utils.get_ocr_writer().stats(),
+        "ocr_executor": ocr_executor.stats(),
+        "ocr_cache": utils.get_ocr_cache().stats(),
+        "vision_batcher": utils.get_vision_batcher_stats(),
+        "search_count_cache": search_count_cache.stats(),
+        "search_index": utils.get_search_index().stats() if utils.get_search_index() else None,
+        "drive_change_buffer": drive_change_buffer.stats(),
+        "auth_cache": utils.get_auth_cache().stats(),
+        "allow_list": utils.get_allow_list().stats(),
+        "audit_log": crud.audit_log_pipeline.stats()
+    }
+
 @app.get("/")
 async def root():
     return {"status": "healthy", "service": "ファイル管理システム API"}
 
-@app.post("/process-document")
-async def process_document(request: DocumentRequest):
-    try:
-        # Cloud Storageからファイルを取得
-        file_content = utils.get_file_from_storage(request.bucket_name, request.file_path)
-        
-        # OCR処理を実行（Vision API → Document AI）
-        extracted_text, ocr_method, matched_user, matched_names = utils.process_document_with_ocr(
-            file_content=file_content,
-            content_type=request.content_type
+async def run_document_pipeline(request: DocumentRequest) -> dict:
+    """1ファイル分のOCRパイプラインを実行エンジン上で実行"""
+    with PeakRssMonitor() as rss:
+        # Cloud Storageからファイルを分割読み込みで取得（大きなファイルは gs:// URI のまま処理）
+        stored_file = await ocr_executor.run(
+            "download", utils.open_from_storage, request.bucket_name, request.file_path
         )
+        with stored_file:
+            # OCR処理を実行（Vision API → Document AI）
+            extracted_text, ocr_method, matched_user, matched_names = await ocr_executor.run(
+                "ocr", utils.process_document_with_ocr,
+                file_content=stored_file,
+                content_type=request.content_type,
+                mode=request.ocr_mode,
+                gcs_uri=f"gs://{request.bucket_name}/{request.file_path}"
+            )
         
         # BigQueryにメタデータを保存
-        utils.store_to_bigquery(
+        await ocr_executor.run(
+            "store", utils.store_to_bigquery,
             file_path=request.file_path,
             content_type=request.content_type,
             extracted_text=extracted_text,
@@ -249,19 +357,73 @@ async def process_document(request: DocumentRequest):
             matched_user=matched_user,
             matched_names=matched_names
         )
-        
-        return {
-            "status": "success",
-            "file_path": request.file_path,
-            "text_length": len(extracted_text),
-            "ocr_method": ocr_method,
-            "matched_user": matched_user["user_id"] if matched_user else None,
-            "matched_names": matched_names
-        }
     
+    # 常駐メモリはプロセス全体の値（同時に処理中の他のリクエストを含む）のため、レスポンスには含めない
+    logger.info(
+        "OCR completed: %s size=%d inline=%s process_peak_rss_mb=%.1f process_rss_increase_mb=%.1f",
+        request.file_path, stored_file.size, stored_file.inline,
+        rss.peak_bytes / (1024 * 1024), rss.increase_bytes / (1024 * 1024)
+    )
+    
+    return {
+        "status": "success",
+        "file_path": request.file_path,
+        "text_length": len(extracted_text),
+        "ocr_method": ocr_method,
+        "matched_user": matched_user["user_id"] if matched_user else None,
+        "matched_names": matched_names
+    }
+
+# 実行中のバッチジョブ（タスクがGCされないよう参照を保持）
+batch_tasks = set()
+
+def queue_full_response(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+@app.post("/process-document")
+async def process_document(request: DocumentRequest):
+    try:
+        async with ocr_executor.slot():
+            return await run_document_pipeline(request)
+    except QueueFullError as e:
+        raise queue_full_response(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/process-documents")
+async def process_documents(request: DocumentBatchRequest):
+    """複数ファイルをまとめて受け付け、完了した順に結果をNDJSONで返す"""
+    # 受付枠の上限を超えるバッチは再試行しても受け付けられないため 413 を返す
+    if len(request.documents) > ocr_executor.max_pending:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many documents in one batch (max {ocr_executor.max_pending})"
+        )
+    try:
+        ocr_executor.reserve(len(request.documents))
+    except QueueFullError as e:
+        raise queue_full_response(e)
+
+    async def run_one(document: DocumentRequest) -> dict:
+        try:
+            return await run_document_pipeline(document)
+        except Exception as e:
+            return {"status": "error", "file_path": document.file_path, "error": str(e)}
+        finally:
+            ocr_executor.release()
+
+    # 受付済みのジョブはクライアントが切断しても完了させる
+    tasks = [asyncio.create_task(run_one(document)) for document in request.documents]
+    batch_tasks.update(tasks)
+    for task in tasks:
+        task.add_done_callback(batch_tasks.discard)
+
+    async def stream_results():
+        for task in asyncio.as_completed(tasks):
+            yield json.dumps(await task, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/update-drive-file")
 async def update_drive_file(request: DriveFileRequest):
     try:
@@ -281,28 +443,17 @@ async def update_drive_file(request: DriveFileRequest):
 
 @app.post("/drive-change-notification")
 async def handle_drive_change(notification: DriveChangeNotification):
+    """変更通知を file_metadata に反映してから応答
+
+    反映は drive_change_buffer が同時に届いた通知とまとめて1回の MERGE で行う。
+    反映に失敗した場合は 500 を返し、送信元に再送させる（インスタンスの停止で通知を失わない）。
+    削除されたファイルは全文検索インデックスからも除く。
+    """
     try:
-        # BigQueryのデータを更新
-        table_id = f"{os.getenv('PROJECT_ID')}.ocr_data.documents"
-        
-        if notification.change_type == "delete":
-            # ファイルが削除された場合、BigQueryのレコードも削除
-            query = f"""
-                DELETE FROM `{table_id}`
-                WHERE file_path LIKE '%{notification.file_id}%'
-            """
-        else:
-            # ファイルが更新された場合、BigQueryのレコードも更新
-            query = f"""
-                UPDATE `{table_id}`
-                SET updated_at = CURRENT_TIMESTAMP()
-                WHERE file_path LIKE '%{notification.file_id}%'
-            """
-        
-        job = bigquery_client.query(query)
-        job.result()  # クエリの完了を待つ
-        
-        return {"status": "success", "file_id": notification.file_id}
+        await asyncio.wrap_future(drive_change_buffer.add(notification.file_id, notification.change_type))
+        if notification.change_type == "delete" and utils.get_search_index() is not None:
+            utils.get_search_index().delete(notification.file_id)
+        return {"status": "applied", "file_id": notification.file_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -364,6 +515,12 @@ async def delete_user(
     return {"status": "success", "message": "User deleted successfully"}
 
 # ファイル検索API
+def query_parameter_key(param) -> tuple:
+    """件数キャッシュ・ページトークン用にクエリパラメータを (名前, 型, 値) で表す"""
+    if isinstance(param, bigquery.ArrayQueryParameter):
+        return (param.name, param.array_type, param.values)
+    return (param.name, param.type_, param.value)
+
 @app.post("/files/search", response_model=FileSearchResult, tags=["files"])
 async def search_files(query: FileSearchQuery, current_user = Depends(verify_token)):
     """ファイルを検索（認証済みユーザーのみ）"""
@@ -376,7 +533,18 @@ async def search_files(query: FileSearchQuery, current_user = Depends(verify_tok
         conditions = []
         params = []
         
-        if query.query_text:
+        search_index = utils.get_search_index()
+        index_file_ids = None
+        if query.query_text and search_index is not None and SEARCH_INDEX_AUTHORITATIVE:
+            # 全文検索インデックスで検索語を含むファイルを順位付きで取得し、BigQueryではメタデータの条件のみ評価
+            hits = await asyncio.to_thread(search_index.search, query.query_text, SEARCH_INDEX_MAX_HITS + 1)
+            # 上限を超えた場合は結果と総件数が欠けるため BigQuery の条件で検索する
+            if len(hits) <= SEARCH_INDEX_MAX_HITS:
+                index_file_ids = [hit.file_id for hit in hits]
+        if index_file_ids is not None:
+            conditions.append("file_id IN UNNEST(@index_file_ids)")
+            params.append(bigquery.ArrayQueryParameter("index_file_ids", "STRING", index_file_ids))
+        elif query.query_text:
             conditions.append("CONTAINS_SUBSTR(ocr_text, @query_text)")
             params.append(bigquery.ScalarQueryParameter("query_text", "STRING", query.query_text))
         
@@ -388,9 +556,13 @@ async def search_files(query: FileSearchQuery, current_user = Depends(verify_tok
             conditions.append("mime_type = @file_type")
             params.append(bigquery.ScalarQueryParameter("file_type", "STRING", query.file_type))
         
-        if query.date_from:
+        # 期間の指定がなく SEARCH_DEFAULT_LOOKBACK_DAYS を設定した場合は直近の日数の created_at のパーティションに絞り込む
+        date_from = query.date_from
+        if date_from is None and SEARCH_DEFAULT_LOOKBACK_DAYS > 0:
+            date_from = default_date_from(SEARCH_DEFAULT_LOOKBACK_DAYS)
+        if date_from:
             conditions.append("created_at >= @date_from")
-            params.append(bigquery.ScalarQueryParameter("date_from", "TIMESTAMP", query.date_from.isoformat()))
+            params.append(bigquery.ScalarQueryParameter("date_from", "TIMESTAMP", date_from.isoformat()))
         
         if query.date_to:
             conditions.append("created_at <= @date_to")
@@ -401,60 +573,138 @@ async def search_files(query: FileSearchQuery, current_user = Depends(verify_tok
 
         # WHERE句の構築
         where_clause = " AND ".join(conditions) if conditions else "1=1"
-
-        # 総件数を取得
-        count_query = f"""
-        SELECT COUNT(*) as total
-        FROM `{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata`
-        WHERE {where_clause}
-        """
-        
-        job_config = bigquery.QueryJobConfig(query_parameters=params)
-        count_results = bigquery_client.query(count_query, job_config=job_config).result()
-        total_count = next(count_results).total
-
-        # 検索結果を取得
-        search_query = f"""
-        SELECT *
-        FROM `{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata`
-        WHERE {where_clause}
-        ORDER BY created_at DESC
-        LIMIT @limit
-        OFFSET @offset
-        """
-        
-        params.extend([
-            bigquery.ScalarQueryParameter("limit", "INT64", query.limit),
-            bigquery.ScalarQueryParameter("offset", "INT64", query.offset)
-        ])
-        
-        job_config = bigquery.QueryJobConfig(query_parameters=params)
-        search_results = bigquery_client.query(search_query, job_config=job_config).result()
+        table_id = f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata"
+        fingerprint = query_fingerprint(where_clause, [query_parameter_key(p) for p in params])
+
+        # ページトークンがあれば前ページの最後の行より後から取得（OFFSETで読み飛ばさない）
+        search_params = list(params)
+        if query.page_token:
+            try:
+                cursor_created_at, cursor_file_id = decode_page_token(query.page_token, fingerprint)
+                if index_file_ids is not None and cursor_file_id not in index_file_ids:
+                    raise InvalidPageToken("Page token does not match the search results")
+            except InvalidPageToken as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if index_file_ids is not None:
+                search_params.append(
+                    bigquery.ScalarQueryParameter("cursor_rank", "INT64", index_file_ids.index(cursor_file_id))
+                )
+            else:
+                search_params.extend([
+                    bigquery.ScalarQueryParameter("cursor_created_at", "TIMESTAMP", cursor_created_at.isoformat()),
+                    bigquery.ScalarQueryParameter("cursor_file_id", "STRING", cursor_file_id)
+                ])
+        use_offset = not query.page_token and query.offset > 0
+        search_params.append(bigquery.ScalarQueryParameter("limit", "INT64", query.limit))
+        if use_offset:
+            search_params.append(bigquery.ScalarQueryParameter("offset", "INT64", query.offset))
+        # 検索語がある場合は ocr_text 全体ではなく一致箇所周辺のスニペットのみを取得
+        use_snippet = bool(query.query_text) and not query.include_ocr_text
+        if use_snippet:
+            search_params.append(bigquery.ScalarQueryParameter("snippet_chars", "INT64", query.snippet_chars))
+            if index_file_ids is not None:
+                search_params.append(bigquery.ScalarQueryParameter("query_text", "STRING", query.query_text))
+
+        search_query = build_search_query(
+            table_id, where_clause,
+            include_ocr_text=query.include_ocr_text,
+            after_cursor=bool(query.page_token),
+            use_offset=use_offset,
+            snippet=use_snippet,
+            ranked=index_file_ids is not None
+        )
+        bytes_billed = {}
+
+        def run_search() -> list:
+            job_config = bigquery.QueryJobConfig(query_parameters=search_params)
+            job = bigquery_client.query(search_query, job_config=job_config)
+            rows = list(job.result())
+            bytes_billed["search"] = job.total_bytes_billed
+            return rows
+
+        def run_count() -> int:
+            job_config = bigquery.QueryJobConfig(query_parameters=params)
+            job = bigquery_client.query(build_count_query(table_id, where_clause), job_config=job_config)
+            total = next(job.result()).total
+            bytes_billed["count"] = job.total_bytes_billed
+            return total
+
+        # 総件数は検索条件ごとにキャッシュし、未取得の場合のみ検索と並行して取得
+        total_count = search_count_cache.get(fingerprint)
+        if total_count is None:
+            search_rows, total_count = await asyncio.gather(
+                asyncio.to_thread(run_search), asyncio.to_thread(run_count)
+            )
+            search_count_cache.set(fingerprint, total_count)
+        else:
+            search_rows = await asyncio.to_thread(run_search)
 
         # 結果の整形
         items = []
-        for row in search_results:
+        for row in search_rows:
             items.append({
                 'file_id': row.file_id,
                 'file_name': row.file_name,
                 'file_url': row.file_url,
                 'mime_type': row.mime_type,
-                'ocr_text': row.ocr_text,
+                'ocr_text': row.ocr_text if query.include_ocr_text else None,
                 'matched_user_ids': row.matched_user_ids,
                 'matched_names': row.matched_names,
                 'is_deleted': row.is_deleted,
                 'created_at': row.created_at,
-                'updated_at': row.updated_at
+                'updated_at': row.updated_at,
+                'snippet': row.snippet if use_snippet else None,
+                'highlights': highlight_spans(row.snippet, query.query_text) if use_snippet else []
             })
 
-        return {
+        next_page_token = None
+        if len(search_rows) == query.limit:
+            last_row = search_rows[-1]
+            next_page_token = encode_page_token(fingerprint, last_row.created_at, last_row.file_id)
+
+        result = {
             'total_count': total_count,
-            'items': items
+            'items': items,
+            'next_page_token': next_page_token
         }
+        response_bytes = len(json.dumps(result, default=str, ensure_ascii=False).encode("utf-8"))
+        print(f"File search: fingerprint={fingerprint} rows={len(items)} bytes_billed={bytes_billed} "
+              f"response_bytes={response_bytes}")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/files/{file_id}/text", response_model=FileText, tags=["files"])
+async def get_file_text(
+    file_id: str,
+    created_at: Optional[datetime] = Query(None, description="検索結果の created_at（指定するとそのパーティションのみを読む）"),
+    current_user = Depends(verify_token)
+):
+    """ファイルのOCRテキスト全体を取得（一般ユーザーは自分に照合されたファイルのみ）"""
+    table_id = f"{os.getenv('BIGQUERY_PROJECT_ID')}.{os.getenv('BIGQUERY_DATASET_ID')}.file_metadata"
+    query_parameters = [bigquery.ScalarQueryParameter("file_id", "STRING", file_id)]
+    if created_at:
+        query_parameters.append(bigquery.ScalarQueryParameter("created_at", "TIMESTAMP", created_at.isoformat()))
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+
+    def run_query() -> list:
+        job = bigquery_client.query(build_text_query(table_id, by_created_at=created_at is not None), job_config=job_config)
+        rows = list(job.result())
+        print(f"File text: file_id={file_id} bytes_billed={job.total_bytes_billed}")
+        return rows
+
+    rows = await asyncio.to_thread(run_query)
+    if not rows:
+        raise HTTPException(status_code=404, detail="File not found")
+    row = rows[0]
+    if current_user['role'] != 'admin' and current_user['user_id'] not in (row.matched_user_ids or []):
+        raise HTTPException(status_code=403, detail="Not authorized to access this file")
+
+    return {'file_id': row.file_id, 'ocr_text': row.ocr_text}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
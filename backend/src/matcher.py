@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from collections import deque
+from typing import Iterable, Optional
+import threading
+
+from .normalize import normalize, normalize_with_offsets
+
+
+@dataclass(frozen=True)
+class NameMatch:
+    """照合結果（1件の出現）"""
+    user_id: str
+    name: str
+    field: str
+    start: int
+    end: int
+
+
+class NameMatcher:
+    """Aho-Corasick法によるユーザー名の一括照合エンジン
+
+    ユーザーマスターの standardized_name と alternate_names から
+    オートマトンを一度だけ構築し、OCRテキストを1回の線形走査で照合する。
+    build() を再度呼び出すと、照合中のスレッドに影響を与えずに差し替える。
+    normalized=True の場合、マスター名は構築時に、OCRテキストは照合時に
+    同じ正規化（NFKC・かな統一・空白除去）を行い、出現位置は元テキスト基準で返す。
+    """
+
+    def __init__(self, users: Optional[Iterable[tuple[str, dict]]] = None, normalized: bool = True):
+        self._lock = threading.Lock()
+        self._normalized = normalized
+        self._automaton = self._compile([])
+        self._users: dict[str, dict] = {}
+        if users is not None:
+            self.build(users)
+
+    @property
+    def pattern_count(self) -> int:
+        return len(self._automaton[3])
+
+    def build(self, users: Iterable[tuple[str, dict]]):
+        """(user_id, ユーザーデータ) の列からオートマトンを再構築"""
+        user_map = {}
+        patterns = []
+        for user_id, user_data in users:
+            user_map[user_id] = user_data
+            for field, name in self._names(user_data):
+                key = normalize(name) if self._normalized else name
+                if key:
+                    patterns.append((key, name, user_id, field))
+
+        automaton = self._compile(patterns)
+        with self._lock:
+            self._automaton = automaton
+            self._users = user_map
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self._users.get(user_id)
+
+    def find_all(self, text: str) -> list[NameMatch]:
+        """テキスト中の全ての出現を出現位置順に返す"""
+        goto, fail, output, patterns = self._automaton
+        source = normalize_with_offsets(text) if self._normalized else None
+        matches = []
+        state = 0
+        for i, ch in enumerate(source.text if source else text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern_id in output[state]:
+                key, name, user_id, field = patterns[pattern_id]
+                start, end = i + 1 - len(key), i + 1
+                if source:
+                    start, end = source.span(start, end)
+                matches.append(NameMatch(user_id, name, field, start, end))
+        matches.sort(key=lambda m: (m.start, -m.end))
+        return matches
+
+    def find_users(self, text: str) -> dict[str, list[NameMatch]]:
+        """ユーザーIDごとに照合結果をまとめて返す（最初の出現順）"""
+        result: dict[str, list[NameMatch]] = {}
+        for match in self.find_all(text):
+            result.setdefault(match.user_id, []).append(match)
+        return result
+
+    def match(self, text: str) -> tuple[bool, Optional[dict], list]:
+        """check_firestore_match 互換の形式で最初に出現したユーザーを返す（ユーザーの dict には user_id を含める）"""
+        users = self.find_users(text)
+        if not users:
+            return False, None, []
+
+        user_id, matches = next(iter(users.items()))
+        if any(m.field == "standardized_name" for m in matches):
+            matched_names = ["standardized_name"]
+        else:
+            matched_names = list(dict.fromkeys(m.name for m in matches))
+        return True, {**self._users[user_id], "user_id": user_id}, matched_names
+
+    @staticmethod
+    def _names(user_data: dict) -> Iterable[tuple[str, str]]:
+        standardized_name = user_data.get("standardized_name")
+        if standardized_name:
+            yield "standardized_name", standardized_name
+        for alt_name in user_data.get("alternate_names") or []:
+            if alt_name:
+                yield "alternate_names", alt_name
+
+    @staticmethod
+    def _compile(patterns: list[tuple[str, str, str, str]]):
+        """goto / failure / output 表を構築（patterns は (照合キー, 名前, user_id, field)）"""
+        goto: list[dict[str, int]] = [{}]
+        output: list[list[int]] = [[]]
+
+        for pattern_id, (key, _, _, _) in enumerate(patterns):
+            state = 0
+            for ch in key:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(pattern_id)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0) if goto[f].get(ch) != next_state else 0
+                output[next_state] = output[next_state] + output[fail[next_state]]
+
+        return goto, fail, output, patterns
@@ -74,6 +74,19 @@ class AuthDomain(AuthDomainBase):
             datetime: lambda v: v.isoformat()
         }
 
+class AllowListImport(BaseModel):
+    """許可ドメイン・メールアドレスの一括登録リクエスト"""
+    domains: List[str] = Field(default_factory=list, description="許可ドメイン（サブドメインも許可される）")
+    emails: List[str] = Field(default_factory=list, description="許可メールアドレス")
+    description: str = Field("", description="登録する全件に付ける説明")
+
+class AllowListImportResult(BaseModel):
+    """一括登録の結果"""
+    created: int = 0
+    reactivated: int = 0
+    skipped: int = Field(0, description="登録済み・重複のため書き込まなかった件数")
+    invalid: List[str] = Field(default_factory=list, description="形式が不正で登録しなかった値")
+
 class AuthAuditLog(BaseModel):
     """認証・認可の監査ログ"""
     log_id: str = Field(..., description="ログID")
@@ -93,11 +106,14 @@ class FileSearchQuery(BaseModel):
     query_text: Optional[str] = Field(None, description="検索キーワード")
     user_id: Optional[str] = Field(None, description="ユーザーID")
     file_type: Optional[str] = Field(None, description="ファイルタイプ")
-    date_from: Optional[datetime] = Field(None, description="検索開始日")
+    date_from: Optional[datetime] = Field(None, description="検索開始日（未指定の場合は SEARCH_DEFAULT_LOOKBACK_DAYS を設定していれば直近の日数、なければ全期間）")
     date_to: Optional[datetime] = Field(None, description="検索終了日")
     include_deleted: bool = Field(False, description="削除済みファイルを含める")
     limit: int = Field(50, description="取得件数")
-    offset: int = Field(0, description="オフセット")
+    offset: int = Field(0, description="オフセット（page_token を使わない場合のみ。非推奨）")
+    page_token: Optional[str] = Field(None, description="前回の検索結果の next_page_token")
+    include_ocr_text: bool = Field(False, description="OCRテキスト全体を結果に含める（通常は /files/{file_id}/text を使用）")
+    snippet_chars: int = Field(60, ge=0, le=500, description="スニペットに含める検索語の前後の文字数")
 
 class FileMetadata(BaseModel):
     file_id: str = Field(..., description="ファイルID")
@@ -110,10 +126,35 @@ class FileMetadata(BaseModel):
     is_deleted: bool = Field(False, description="削除フラグ")
     created_at: datetime = Field(..., description="作成日時")
     updated_at: datetime = Field(..., description="更新日時")
+    snippet: Optional[str] = Field(None, description="検索語の一致箇所周辺のOCRテキスト")
+    highlights: List[List[int]] = Field(default=[], description="スニペット中の一致範囲 [開始, 終了)")
+
+class FileText(BaseModel):
+    file_id: str = Field(..., description="ファイルID")
+    ocr_text: Optional[str] = Field(None, description="OCRテキスト")
 
 class FileSearchResult(BaseModel):
     total_count: int = Field(..., description="総件数")
     items: List[FileMetadata] = Field(..., description="検索結果")
+    next_page_token: Optional[str] = Field(None, description="次ページのトークン（最終ページの場合は None）")
+
+class DocumentRequest(BaseModel):
+    bucket_name: str = Field(..., description="Cloud Storageバケット名")
+    file_path: str = Field(..., description="ファイルパス")
+    content_type: str = Field(..., description="MIMEタイプ")
+    ocr_mode: Optional[str] = Field(None, description="Vision APIの呼び出し方式（single / batch）")
+
+class DocumentBatchRequest(BaseModel):
+    documents: List[DocumentRequest] = Field(..., description="処理対象のファイル")
+
+class DriveFileRequest(BaseModel):
+    file_id: str = Field(..., description="DriveのファイルID")
+    new_name: Optional[str] = Field(None, description="変更後のファイル名")
+    new_parent: Optional[str] = Field(None, description="移動先のフォルダID")
+
+class DriveChangeNotification(BaseModel):
+    file_id: str = Field(..., description="DriveのファイルID")
+    change_type: str = Field(..., description="変更の種類（update / delete）")
 
 # Firestore用のヘルパー関数
 def auth_domain_from_dict(data: dict, doc_id: str) -> AuthDomain:
@@ -0,0 +1,62 @@
+from dataclasses import dataclass
+from functools import lru_cache
+import unicodedata
+
+# 結合用の濁点・半濁点（半角カナの ﾞ ﾟ は NFKC でこれらになる）
+_COMBINING_MARKS = {"゙", "゚"}
+
+# カタカナ → ひらがな（ァ〜ヶ）
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+@dataclass(frozen=True)
+class NormalizedText:
+    """正規化後のテキストと元テキストへの位置対応表
+
+    starts[i] / ends[i] は正規化後の i 文字目が由来する元テキストの範囲。
+    """
+    text: str
+    starts: tuple[int, ...]
+    ends: tuple[int, ...]
+
+    def span(self, start: int, end: int) -> tuple[int, int]:
+        """正規化後の範囲 [start, end) を元テキストの範囲に変換"""
+        return self.starts[start], self.ends[end - 1]
+
+
+@lru_cache(maxsize=8192)
+def _normalize_char(ch: str) -> str:
+    """1文字分の NFKC・小文字化・かな統一（空白は空文字）"""
+    normalized = unicodedata.normalize("NFKC", ch).lower().translate(_KANA_FOLD)
+    return "".join(c for c in normalized if not c.isspace())
+
+
+def normalize(text: str) -> str:
+    """照合用に正規化した文字列のみを返す（マスター名の事前正規化用）"""
+    return normalize_with_offsets(text).text
+
+
+def normalize_with_offsets(text: str) -> NormalizedText:
+    """OCRテキストを照合用に正規化
+
+    NFKC（全角・半角の統一）、英字の小文字化、カタカナのひらがな化、
+    空白・改行の除去を1回の走査で行い、元テキストへの位置対応を保持する。
+    """
+    chars: list[str] = []
+    starts: list[int] = []
+    ends: list[int] = []
+
+    for i, ch in enumerate(text):
+        for c in _normalize_char(ch):
+            if c in _COMBINING_MARKS and chars:
+                # 半角カナの濁点・半濁点を直前の文字と合成（ｶﾞ → が）
+                composed = unicodedata.normalize("NFC", chars[-1] + c)
+                if len(composed) == 1:
+                    chars[-1] = composed.translate(_KANA_FOLD)
+                    ends[-1] = i + 1
+                    continue
+            chars.append(c)
+            starts.append(i)
+            ends.append(i + 1)
+
+    return NormalizedText("".join(chars), tuple(starts), tuple(ends))
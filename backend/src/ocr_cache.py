@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+
+def cache_key(content: bytes, engine: str, version: str) -> str:
+    """ファイル内容のSHA-256とOCRエンジン・バージョンからキャッシュキーを作成"""
+    return digest_key(hashlib.sha256(content).hexdigest(), engine, version)
+
+
+def digest_key(digest: str, engine: str, version: str) -> str:
+    """計算済みのファイル内容のハッシュからキャッシュキーを作成"""
+    return f"{digest}:{engine}:{version}"
+
+
+class DiskCacheBackend:
+    """OCR結果をローカルディスクに gzip で保存する永続層"""
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, re.sub(r"[^\w.-]", "_", key) + ".txt.gz")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, text: str):
+        # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(text.encode("utf-8"))
+        os.replace(tmp_path, self._path(key))
+
+
+class FirestoreCacheBackend:
+    """OCR結果を Firestore に保存する永続層（インスタンス間で共有）"""
+
+    # Firestore のドキュメント上限（1MiB）に収まらない結果は保存しない
+    MAX_BYTES = 900 * 1024
+
+    def __init__(self, db, collection: str = "ocr_cache"):
+        self._collection = db.collection(collection)
+
+    def _document(self, key: str):
+        # ドキュメントIDに "/" は使えない
+        return self._collection.document(key.replace("/", "_"))
+
+    def get(self, key: str) -> Optional[str]:
+        doc = self._document(key).get()
+        if not doc.exists:
+            return None
+        return gzip.decompress(doc.to_dict()["text_gz"]).decode("utf-8")
+
+    def set(self, key: str, text: str):
+        data = gzip.compress(text.encode("utf-8"))
+        if len(data) > self.MAX_BYTES:
+            return
+        self._document(key).set({"text_gz": data})
+
+
+class OcrResultCache:
+    """OCR結果のキャッシュ
+
+    同じファイル内容・同じOCRエンジンの結果をメモリ上の LRU と任意の永続層
+    （ローカルディスクまたは Firestore）に保持し、ヒットした場合は OCR API の
+    呼び出しを省略する。照合と保存は呼び出し側で毎回行う。
+    """
+
+    def __init__(self, max_entries: int = 1000, backend=None):
+        self._max_entries = max_entries
+        self._backend = backend
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._backend_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return text
+
+        if self._backend is not None:
+            try:
+                text = self._backend.get(key)
+            except Exception as e:
+                print(f"OCR cache backend error: {str(e)}")
+                text = None
+            if text is not None:
+                self._put(key, text)
+                with self._lock:
+                    self._hits += 1
+                    self._backend_hits += 1
+                return text
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key: str, text: str):
+        self._put(key, text)
+        if self._backend is not None:
+            try:
+                self._backend.set(key, text)
+            except Exception as e:
+                print(f"OCR cache backend error: {str(e)}")
+
+    def get_or_compute(self, content: bytes, engine: str, version: str, compute: Callable[[], str]) -> str:
+        """キャッシュにあれば返し、なければ compute() でOCRして保存"""
+        return self.get_or_compute_digest(hashlib.sha256(content).hexdigest(), engine, version, compute)
+
+    def get_or_compute_digest(self, digest: str, engine: str, version: str, compute: Callable[[], str]) -> str:
+        """get_or_compute と同じだが、ファイル内容の代わりに計算済みのハッシュを受け取る"""
+        key = digest_key(digest, engine, version)
+        text = self.get(key)
+        if text is None:
+            text = compute()
+            self.set(key, text)
+        return text
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self._hits,
+            "backend_hits": self._backend_hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "hit_rate": self._hits / lookups if lookups else None
+        }
+
+    def _put(self, key: str, text: str):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
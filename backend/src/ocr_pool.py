@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, Optional
+import asyncio
+import math
+import time
+
+# ステージごとの同時実行数の既定値（OCR APIのクォータに合わせて小さめ）
+DEFAULT_STAGE_LIMITS = {
+    "download": 8,
+    "ocr": 4,
+    "store": 8
+}
+
+
+class QueueFullError(Exception):
+    """受付上限を超えたため処理を受け付けられない"""
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR queue is full (retry after {retry_after}s)")
+        self.retry_after = retry_after
+
+
+class _StageStats:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_latency_ms": self.total_seconds / self.completed * 1000 if self.completed else None
+        }
+
+
+class OcrExecutor:
+    """OCRパイプラインのブロッキング処理をスレッドプールで実行するエンジン
+
+    ダウンロード・OCR・保存の各ステージに同時実行数の上限を設け、イベントループを
+    塞がずにブロッキングなクライアント呼び出しを実行する。受付済みのジョブ数が
+    max_pending に達した場合は QueueFullError を送出し、呼び出し側で
+    429 / Retry-After を返せるようにする。
+    """
+
+    def __init__(self, max_workers: int = 16, max_pending: int = 64,
+                 stage_limits: Optional[dict[str, int]] = None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr")
+        self._max_pending = max_pending
+        self._pending = 0
+        limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in limits.items()}
+        self._stats = {stage: _StageStats(limit) for stage, limit in limits.items()}
+        self._rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def max_pending(self) -> int:
+        return self._max_pending
+
+    def reserve(self, count: int = 1):
+        """count 件分の受付枠を確保（全件確保できなければ QueueFullError）"""
+        if self._pending + count > self._max_pending:
+            self._rejected += 1
+            raise QueueFullError(self.retry_after())
+        self._pending += count
+
+    def release(self, count: int = 1):
+        self._pending = max(self._pending - count, 0)
+
+    @asynccontextmanager
+    async def slot(self):
+        """1件分の受付枠を確保して処理を実行"""
+        self.reserve()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, stage: str, func: Callable, *args, **kwargs):
+        """ブロッキング関数を指定ステージの同時実行数内でスレッドプールで実行"""
+        stats = self._stats[stage]
+        stats.waiting += 1
+        async with self._semaphores[stage]:
+            stats.waiting -= 1
+            stats.active += 1
+            start = time.monotonic()
+            try:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._pool, partial(func, *args, **kwargs))
+            except Exception:
+                stats.failed += 1
+                raise
+            else:
+                stats.completed += 1
+                stats.total_seconds += time.monotonic() - start
+                return result
+            finally:
+                stats.active -= 1
+
+    def retry_after(self) -> int:
+        """現在の待ち件数とOCRステージの平均処理時間から再試行までの秒数を見積もる"""
+        stats = self._stats.get("ocr")
+        if not stats or not stats.completed:
+            return 1
+        avg_seconds = stats.total_seconds / stats.completed
+        return max(math.ceil(avg_seconds * self._pending / stats.limit), 1)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "max_pending": self._max_pending,
+            "rejected": self._rejected,
+            "stages": {stage: stats.as_dict() for stage, stats in self._stats.items()}
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# Vision API の batch_annotate_files（同期）で1リクエストに指定できるページ数の上限
+VISION_PAGES_PER_REQUEST = 5
+# Document AI で1リクエストに指定するページ数
+DOCAI_PAGES_PER_REQUEST = 15
+
+
+# gcs_uri がある場合は内容を送らずに参照させる（ページ範囲ごとのリクエストでファイル全体を再送しない）
+def _vision_input(content: Optional[bytes], gcs_uri: Optional[str], mime_type: str) -> dict:
+    if gcs_uri:
+        return {"gcs_source": {"uri": gcs_uri}, "mime_type": mime_type}
+    return {"content": content, "mime_type": mime_type}
+
+
+def _documentai_input(content: Optional[bytes], gcs_uri: Optional[str], mime_type: str) -> dict:
+    if gcs_uri:
+        return {"gcs_document": {"gcs_uri": gcs_uri, "mime_type": mime_type}}
+    return {"raw_document": {"content": content, "mime_type": mime_type}}
+
+
+@dataclass
+class PageText:
+    """1ページ分のOCR結果"""
+    page_number: int
+    text: str
+    engine: str
+    start: int = 0
+    end: int = 0
+
+
+@dataclass
+class PagedOcrResult:
+    """ページ単位のOCR結果を結合したもの（各ページの結合後テキスト上の範囲を保持）"""
+    text: str
+    pages: list[PageText] = field(default_factory=list)
+
+    @property
+    def engines(self) -> set[str]:
+        return {page.engine for page in self.pages}
+
+    def page_at(self, offset: int) -> Optional[PageText]:
+        """結合後テキストの位置を含むページ"""
+        for page in self.pages:
+            if page.start <= offset < page.end:
+                return page
+        return None
+
+
+def vision_page_texts(client, content: Optional[bytes], mime_type: str, gcs_uri: Optional[str] = None,
+                      pages_per_request: int = VISION_PAGES_PER_REQUEST) -> dict[int, str]:
+    """Vision API の batch_annotate_files でPDF/TIFFの全ページをOCR
+
+    総ページ数は最初の応答の total_pages から取得し、以降は残りのページを
+    pages_per_request 件ずつ要求する。gcs_uri がある場合は content の代わりに URI を渡す。
+    """
+    pages_per_request = min(pages_per_request, VISION_PAGES_PER_REQUEST)
+    texts: dict[int, str] = {}
+    total_pages = None
+    first_page = 1
+    while total_pages is None or first_page <= total_pages:
+        last_page = first_page + pages_per_request - 1
+        if total_pages is not None:
+            last_page = min(last_page, total_pages)
+        response = client.batch_annotate_files(requests=[{
+            "input_config": _vision_input(content, gcs_uri, mime_type),
+            "features": [{"type_": "DOCUMENT_TEXT_DETECTION"}],
+            "pages": list(range(first_page, last_page + 1))
+        }])
+        file_response = response.responses[0]
+        # ファイル全体の失敗（壊れたPDF・権限・クォータ）は空の結果にせず例外にする（キャッシュさせない）
+        if file_response.error.message:
+            raise Exception(f"Error: {file_response.error.message}")
+        if total_pages is None:
+            total_pages = file_response.total_pages
+            if not total_pages:
+                raise Exception("Error: no pages were returned for the file")
+        for page_number, image_response in zip(range(first_page, last_page + 1), file_response.responses):
+            if image_response.error.message:
+                raise Exception(f"Error: {image_response.error.message}")
+            texts[image_response.context.page_number or page_number] = image_response.full_text_annotation.text
+        first_page = last_page + 1
+    return texts
+
+
+def documentai_page_texts(client, processor_name: str, content: Optional[bytes], mime_type: str,
+                          pages: list[int], gcs_uri: Optional[str] = None,
+                          pages_per_request: int = DOCAI_PAGES_PER_REQUEST) -> dict[int, str]:
+    """指定したページのみを Document AI で処理（individual_page_selector）"""
+    texts: dict[int, str] = {}
+    for i in range(0, len(pages), pages_per_request):
+        selected = pages[i:i + pages_per_request]
+        result = client.process_document(request={
+            "name": processor_name,
+            **_documentai_input(content, gcs_uri, mime_type),
+            "process_options": {"individual_page_selector": {"pages": selected}}
+        })
+        document = result.document
+        for page in document.pages:
+            segments = page.layout.text_anchor.text_segments
+            texts[page.page_number] = "".join(
+                document.text[int(segment.start_index):int(segment.end_index)] for segment in segments
+            )
+    return texts
+
+
+def merge_pages(page_texts: dict[int, tuple[str, str]], separator: str = "\f") -> PagedOcrResult:
+    """ページ番号順に結合し、各ページの結合後テキスト上の範囲を記録"""
+    pages = []
+    parts = []
+    offset = 0
+    for page_number in sorted(page_texts):
+        text, engine = page_texts[page_number]
+        if parts:
+            parts.append(separator)
+            offset += len(separator)
+        pages.append(PageText(page_number, text, engine, offset, offset + len(text)))
+        parts.append(text)
+        offset += len(text)
+    return PagedOcrResult("".join(parts), pages)
+
+
+def ocr_pages_with_fallback(vision_client, documentai_client, processor_name: str, content: Optional[bytes],
+                            mime_type: str, has_match: Callable[[str], bool], gcs_uri: Optional[str] = None,
+                            pages_per_request: Optional[int] = None) -> PagedOcrResult:
+    """ページ単位で Vision API を実行し、照合できなかったページのみ Document AI で再処理
+
+    1リクエストで扱うページ数は pages_per_request 以下に抑える。
+
+    Args:
+        vision_client: Vision API クライアント
+        documentai_client: Document AI クライアント
+        processor_name: Document AI プロセッサのリソース名
+        content: PDF/TIFF のバイト列（gcs_uri がない場合のみ送信する）
+        mime_type: application/pdf または image/tiff
+        has_match: ページのテキストがマスターと照合できたかを判定する関数
+        gcs_uri: 入力ファイルの gs:// URI（指定した場合は content より優先する）
+        pages_per_request: 1リクエストあたりのページ数の上限
+    """
+    vision_options = {"pages_per_request": pages_per_request} if pages_per_request else {}
+    docai_options = {"pages_per_request": min(pages_per_request, DOCAI_PAGES_PER_REQUEST)} if pages_per_request else {}
+    vision_texts = vision_page_texts(vision_client, content, mime_type, gcs_uri, **vision_options)
+    page_texts = {page: (text, "vision_api") for page, text in vision_texts.items()}
+
+    fallback_pages = [page for page, text in sorted(vision_texts.items()) if not has_match(text)]
+    if fallback_pages:
+        docai_texts = documentai_page_texts(
+            documentai_client, processor_name, content, mime_type, fallback_pages, gcs_uri, **docai_options
+        )
+        for page, text in docai_texts.items():
+            page_texts[page] = (text, "document_ai")
+
+    return merge_pages(page_texts)
@@ -6,12 +6,13 @@ from datetime import datetime
 from .models import (
     User, UserCreate, UserUpdate,
     AuthSettings, AuthSettingsUpdate,
-    AuthDomain, AuthDomainCreate, AuthDomainUpdate
+    AuthDomain, AuthDomainCreate, AuthDomainUpdate,
+    AllowListImport, AllowListImportResult
 )
 from .crud import (
     create_user, get_user, update_user, delete_user,
     get_auth_settings, update_auth_settings,
-    create_auth_domain, get_auth_domains, update_auth_domain,
+    create_auth_domain, get_auth_domains, update_auth_domain, bulk_import_allow_list,
     is_domain_allowed, log_auth_action
 )
 from .auth import get_current_user, admin_required
@@ -178,6 +179,26 @@ async def update_domain(
     
     return updated_domain
 
+@router.post("/auth/allow-list/import", response_model=AllowListImportResult)
+async def import_allow_list(
+    allow_list: AllowListImport,
+    request: Request,
+    current_user: User = Depends(admin_required)
+):
+    """許可ドメイン・メールアドレスを一括登録（管理者のみ）"""
+    result = await bulk_import_allow_list(allow_list)
+    
+    # 監査ログを記録
+    await log_auth_action(
+        user_id=current_user.id,
+        action="import_allow_list",
+        details=f"Imported allow list: {result.created} created, {result.reactivated} reactivated, "
+                f"{result.skipped} skipped, {len(result.invalid)} invalid",
+        request=request
+    )
+    
+    return result
+
 # ドメイン検証エンドポイント
 @router.get("/auth/validate-domain/{domain}")
 async def validate_domain(
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""過去ファイルのOCR一括再処理
+
+Cloud Storage のプレフィックス配下のファイルをOCRし、結果をステージング経由の
+ロードジョブ1回と MERGE 1回で file_metadata に取り込む。
+
+    python -m src.scripts.backfill_ocr --bucket my-bucket --prefix scans/2023/
+    python -m src.scripts.backfill_ocr --bucket my-bucket --local   # BigQueryに書き込まずに検証
+"""
+import argparse
+import asyncio
+import os
+import time
+from itertools import islice
+
+from google.cloud import bigquery, storage
+
+from .. import utils
+from ..bulk_ingest import BigQueryLoader, BulkOcrIngestor, LocalLoader
+from ..ocr_pool import OcrExecutor
+from ..storage_io import StoredFile
+
+def file_blobs(blobs, limit: int = None):
+    """ディレクトリの印（"/" で終わる空のオブジェクト）を除き、先頭から limit 件のファイルを返す"""
+    files = (blob for blob in blobs if not blob.name.endswith("/"))
+    return islice(files, limit) if limit is not None else files
+
+async def backfill(blobs, ingestor: BulkOcrIngestor, executor: OcrExecutor) -> tuple[int, int]:
+    """ファイルを OcrExecutor のステージ別の上限内で並行してOCRし、成功・失敗の件数を返す
+
+    同時に処理するファイル数は executor.max_pending までに抑える。内容は分割読み込みで
+    スプールし、OCR_INLINE_MAX_BYTES を超えるファイルは読み込まずに gs:// URI を参照させる。
+    """
+    slots = asyncio.Semaphore(executor.max_pending)
+    counts = {"processed": 0, "failed": 0}
+
+    async def process(blob):
+        try:
+            stored_file = await executor.run(
+                "download", StoredFile.from_blob, blob, inline_limit=utils.OCR_INLINE_MAX_BYTES
+            )
+            with stored_file:
+                extracted_text, ocr_method, matched_user, matched_names = await executor.run(
+                    "ocr", utils.process_document_with_ocr,
+                    file_content=stored_file,
+                    content_type=blob.content_type or "application/pdf"
+                )
+            ingestor.add(utils.build_ocr_row(blob.name, extracted_text, matched_user, matched_names))
+            counts["processed"] += 1
+        except Exception as e:
+            print(f"Error processing {blob.name}: {e}")
+            counts["failed"] += 1
+        finally:
+            slots.release()
+
+    tasks = set()
+    iterator = iter(blobs)
+    while True:
+        await slots.acquire()
+        # 一覧の次ページの取得はイベントループを塞がないようスレッドで行う
+        blob = await asyncio.to_thread(next, iterator, None)
+        if blob is None:
+            slots.release()
+            break
+        task = asyncio.create_task(process(blob))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    return counts["processed"], counts["failed"]
+
+def main():
+    parser = argparse.ArgumentParser(description="過去ファイルのOCR一括再処理")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--limit", type=int, default=None, help="処理するファイル数の上限")
+    parser.add_argument("--stage-dir", default=None, help="ステージングファイルの出力先")
+    parser.add_argument("--local", action="store_true", help="BigQueryに書き込まずローカルで検証")
+    args = parser.parse_args()
+
+    table_id = f"{os.getenv('PROJECT_ID')}.ocr_data.file_metadata"
+    staging_table_id = f"{table_id}_backfill_{int(time.time())}"
+    loader = LocalLoader() if args.local else BigQueryLoader(bigquery.Client())
+    ingestor = BulkOcrIngestor(loader, table_id, staging_table_id, stage_dir=args.stage_dir)
+    # API と同じ環境変数でステージ別の同時実行数を指定する
+    executor = OcrExecutor(
+        max_workers=int(os.getenv("OCR_MAX_WORKERS", "16")),
+        max_pending=int(os.getenv("OCR_MAX_PENDING", "64")),
+        stage_limits={
+            "download": int(os.getenv("OCR_DOWNLOAD_CONCURRENCY", "8")),
+            "ocr": int(os.getenv("OCR_CONCURRENCY", "4"))
+        }
+    )
+
+    storage_client = storage.Client()
+    start = time.perf_counter()
+    blobs = file_blobs(storage_client.list_blobs(args.bucket, prefix=args.prefix), args.limit)
+    try:
+        processed, failed = asyncio.run(backfill(blobs, ingestor, executor))
+    finally:
+        executor.shutdown()
+
+    merged = ingestor.commit()
+    elapsed = time.perf_counter() - start
+    print(f"processed: {processed}, failed: {failed}, merged: {merged} ({elapsed:.1f} s)")
+    if args.local:
+        print(f"load jobs: {len(loader.load_jobs)}, queries: {len(loader.queries)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""ユーザー名照合のベンチマーク
+
+従来のユーザー毎の部分文字列検索ループと NameMatcher を比較する。
+
+    python -m src.scripts.benchmark_matcher --users 20000 --docs 50
+"""
+import argparse
+import random
+import time
+
+from ..matcher import NameMatcher
+
+KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+KANJI = "山田川中村田佐藤鈴木高橋伊渡辺小林加吉松井上木下森本清水池野"
+
+def random_name(rng: random.Random) -> str:
+    return "".join(rng.choices(KANJI, k=2)) + " " + "".join(rng.choices(KANJI, k=2))
+
+def generate_users(count: int, rng: random.Random) -> list[tuple[str, dict]]:
+    users = []
+    for i in range(count):
+        users.append((f"user_{i}", {
+            "standardized_name": random_name(rng),
+            "alternate_names": ["".join(rng.choices(KANA, k=6)), "".join(rng.choices(KANA, k=7))],
+            "is_deleted": False
+        }))
+    return users
+
+def generate_text(users: list[tuple[str, dict]], length: int, rng: random.Random) -> str:
+    chars = rng.choices(KANA + KANJI + "\n", k=length)
+    _, user_data = rng.choice(users)
+    pos = rng.randrange(length)
+    chars.insert(pos, user_data["standardized_name"])
+    return "".join(chars)
+
+def naive_match(users: list[tuple[str, dict]], extracted_text: str):
+    """従来の check_firestore_match と同じ照合ループ"""
+    matches = []
+    for _, user_data in users:
+        if user_data["standardized_name"] in extracted_text:
+            return True, user_data, ["standardized_name"]
+        for alt_name in user_data.get("alternate_names", []):
+            if alt_name in extracted_text:
+                matches.append(alt_name)
+        if matches:
+            return True, user_data, matches
+    return False, None, []
+
+def main():
+    parser = argparse.ArgumentParser(description="ユーザー名照合のベンチマーク")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--text-length", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-normalize", action="store_true", help="テキスト正規化を行わずに照合")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    users = generate_users(args.users, rng)
+    texts = [generate_text(users, args.text_length, rng) for _ in range(args.docs)]
+
+    start = time.perf_counter()
+    matcher = NameMatcher(users, normalized=not args.no_normalize)
+    build_time = time.perf_counter() - start
+    print(f"build: {build_time * 1000:.1f} ms ({matcher.pattern_count} patterns)")
+
+    start = time.perf_counter()
+    naive_hits = sum(1 for text in texts if naive_match(users, text)[0])
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher_hits = sum(1 for text in texts if matcher.match(text)[0])
+    matcher_time = time.perf_counter() - start
+
+    print(f"naive loop: {naive_time / args.docs * 1000:.2f} ms/doc (hits={naive_hits})")
+    print(f"NameMatcher: {matcher_time / args.docs * 1000:.2f} ms/doc (hits={matcher_hits})")
+    print(f"speedup: {naive_time / matcher_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
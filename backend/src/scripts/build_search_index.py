@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""OCRテキストの全文検索インデックスをオフラインで構築・検索
+
+file_metadata のエクスポートやバックフィルのステージングファイル（file_id と
+ocr_text を含む NDJSON、.gz 可）からセグメントを作成する。
+
+    python -m src.scripts.build_search_index --index-dir /tmp/search_index export-*.json.gz
+    python -m src.scripts.build_search_index --index-dir /tmp/search_index --merge
+    python -m src.scripts.build_search_index --index-dir /tmp/search_index --query "山田 請求書"
+"""
+import argparse
+import gzip
+import json
+import time
+
+from ..search_index import SearchIndex
+
+def read_rows(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="OCRテキストの全文検索インデックスを構築・検索")
+    parser.add_argument("inputs", nargs="*", help="file_id と ocr_text を含む NDJSON ファイル")
+    parser.add_argument("--index-dir", required=True)
+    parser.add_argument("--buffer-docs", type=int, default=5000, help="1セグメントあたりの文書数")
+    parser.add_argument("--merge", action="store_true", help="構築後にセグメントを1つにまとめる")
+    parser.add_argument("--query", default=None, help="検索語（構築後に検索結果を表示）")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    index = SearchIndex(args.index_dir, max_buffer_docs=args.buffer_docs)
+    start = time.perf_counter()
+    added = 0
+    for path in args.inputs:
+        for row in read_rows(path):
+            if row.get("is_deleted"):
+                index.delete(row["file_id"])
+            else:
+                index.add(row["file_id"], row.get("ocr_text") or "")
+                added += 1
+    index.flush()
+    if args.merge:
+        index.merge()
+    if args.inputs or args.merge:
+        print(f"indexed: {added} ({time.perf_counter() - start:.1f} s) {index.stats()}")
+
+    if args.query:
+        start = time.perf_counter()
+        hits = index.search(args.query, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for hit in hits:
+            print(f"{hit.score:8.3f}  {hit.file_id}")
+        print(f"{len(hits)} hits ({elapsed:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,47 @@
 #!/usr/bin/env python3
 from google.cloud import bigquery
+import os
+
+# file_metadata の列定義（OCR結果の書き込み・Drive変更の反映・検索で使う列の和集合）
+FILE_METADATA_SCHEMA = [
+    bigquery.SchemaField("file_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("file_name", "STRING"),
+    bigquery.SchemaField("file_url", "STRING"),
+    bigquery.SchemaField("parent_folder_id", "STRING"),
+    bigquery.SchemaField("mime_type", "STRING"),
+    bigquery.SchemaField("modified_time", "TIMESTAMP"),
+    bigquery.SchemaField("user_id", "STRING"),
+    bigquery.SchemaField("office_id", "STRING"),
+    bigquery.SchemaField("document_id", "STRING"),
+    bigquery.SchemaField("matched_name", "STRING"),
+    bigquery.SchemaField("matched_alternate_names", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("matched_user_ids", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("matched_names", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("ocr_text", "STRING"),
+    bigquery.SchemaField("keywords", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("confidence", "FLOAT"),
+    bigquery.SchemaField("processed_at", "TIMESTAMP"),
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP"),
+    bigquery.SchemaField("is_deleted", "BOOLEAN"),
+    bigquery.SchemaField("deleted_at", "TIMESTAMP"),
+]
+
+# /files/search の条件（is_deleted = FALSE, mime_type = @file_type）と、file_id による
+# 本文の取得・全文検索インデックスの結果の結合・MERGE で使う列の順にクラスタリング
+# （created_at の日単位パーティション内で絞り込む）。ユーザーの絞り込みに使う
+# matched_user_ids は REPEATED 列のためクラスタリングできない
+FILE_METADATA_CLUSTERING = ["is_deleted", "mime_type", "file_id"]
+
+def file_metadata_table(table_id: str) -> bigquery.Table:
+    """created_at で日単位パーティション分割し、FILE_METADATA_CLUSTERING でクラスタ化した file_metadata"""
+    table = bigquery.Table(table_id, schema=FILE_METADATA_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="created_at"
+    )
+    table.clustering_fields = FILE_METADATA_CLUSTERING
+    return table
 
 def create_tables():
     """BigQueryテーブルを作成"""
@@ -51,6 +93,16 @@ def create_tables():
     )
     audit_table = client.create_table(audit_table, exists_ok=True)
     print(f"Created table {audit_table.project}.{audit_table.dataset_id}.{audit_table.table_id}")
+    
+    # OCRデータのデータセットの作成
+    ocr_dataset_id = f"{client.project}.{os.getenv('BIGQUERY_DATASET_ID', 'ocr_data')}"
+    ocr_dataset = bigquery.Dataset(ocr_dataset_id)
+    ocr_dataset.location = "asia-northeast1"
+    client.create_dataset(ocr_dataset, exists_ok=True)
+    
+    # file_metadataテーブルの作成（既存の非パーティションテーブルは migrate_file_metadata で移行）
+    file_table = client.create_table(file_metadata_table(f"{ocr_dataset_id}.file_metadata"), exists_ok=True)
+    print(f"Created table {file_table.project}.{file_table.dataset_id}.{file_table.table_id}")
 
 if __name__ == "__main__":
     create_tables()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""file_metadata をパーティション分割・クラスタ化したテーブルへ移行
+
+既存テーブルの全行を create_bigquery_tables.FILE_METADATA_SCHEMA の新テーブルに
+1回の INSERT ... SELECT でコピーし、件数を確認してからテーブル名を入れ替える。
+旧テーブルは file_metadata_backup_<日時> として残す。コピー後の書き込みは移行されないため、
+OCR処理と Drive 変更の反映を止めてから実行する。
+
+    python -m src.scripts.migrate_file_metadata --dry-run
+    python -m src.scripts.migrate_file_metadata
+"""
+import argparse
+import os
+import time
+
+from google.cloud import bigquery
+
+from .create_bigquery_tables import FILE_METADATA_SCHEMA, FILE_METADATA_CLUSTERING, file_metadata_table
+
+# SchemaField の型名 → SQL の型名
+SQL_TYPES = {"STRING": "STRING", "TIMESTAMP": "TIMESTAMP", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL"}
+
+def build_copy_query(source_table_id: str, target_table_id: str, source_columns: set[str]) -> str:
+    """旧テーブルの行を新しい列定義に合わせてコピーする INSERT 文
+
+    旧テーブルにない列は NULL（配列は空）にする。created_at が NULL の行は
+    processed_at / updated_at / modified_time の順で補い、パーティションを決める。
+    """
+    select_list = []
+    for field in FILE_METADATA_SCHEMA:
+        name = field.name
+        sql_type = SQL_TYPES[field.field_type]
+        if name == "created_at":
+            candidates = [c for c in ("created_at", "processed_at", "updated_at", "modified_time") if c in source_columns]
+            select_list.append(f"COALESCE({', '.join(candidates + ['CURRENT_TIMESTAMP()'])}) AS created_at")
+        elif name == "is_deleted" and name in source_columns:
+            select_list.append("COALESCE(is_deleted, FALSE) AS is_deleted")
+        elif name in source_columns:
+            select_list.append(name)
+        elif field.mode == "REPEATED":
+            select_list.append(f"CAST([] AS ARRAY<{sql_type}>) AS {name}")
+        elif name == "is_deleted":
+            select_list.append("FALSE AS is_deleted")
+        else:
+            select_list.append(f"CAST(NULL AS {sql_type}) AS {name}")
+
+    columns = ", ".join(field.name for field in FILE_METADATA_SCHEMA)
+    select_sql = ",\n        ".join(select_list)
+    return f"""
+    INSERT INTO `{target_table_id}` ({columns})
+    SELECT
+        {select_sql}
+    FROM `{source_table_id}`
+    """
+
+def is_migrated(table: bigquery.Table) -> bool:
+    partitioning = table.time_partitioning
+    return (
+        partitioning is not None and partitioning.field == "created_at"
+        and list(table.clustering_fields or []) == FILE_METADATA_CLUSTERING
+    )
+
+def count_rows(client: bigquery.Client, table_id: str) -> int:
+    return next(iter(client.query(f"SELECT COUNT(*) AS total FROM `{table_id}`").result())).total
+
+def main():
+    parser = argparse.ArgumentParser(description="file_metadata をパーティション分割テーブルへ移行")
+    parser.add_argument("--dataset", default=os.getenv("BIGQUERY_DATASET_ID", "ocr_data"))
+    parser.add_argument("--table", default="file_metadata")
+    parser.add_argument("--dry-run", action="store_true", help="コピー文とスキャン量の見積もりのみ表示")
+    args = parser.parse_args()
+
+    client = bigquery.Client()
+    source_table_id = f"{client.project}.{args.dataset}.{args.table}"
+    source_table = client.get_table(source_table_id)
+    if is_migrated(source_table):
+        print(f"{source_table_id} is already partitioned by created_at and clustered")
+        return
+
+    suffix = time.strftime("%Y%m%d%H%M%S")
+    target_table_id = f"{source_table_id}_partitioned_{suffix}"
+    copy_query = build_copy_query(
+        source_table_id, target_table_id, {field.name for field in source_table.schema}
+    )
+
+    if args.dry_run:
+        print(copy_query)
+        select_query = copy_query[copy_query.index("SELECT"):]
+        job = client.query(select_query, job_config=bigquery.QueryJobConfig(dry_run=True))
+        print(f"rows: {source_table.num_rows}, bytes to scan: {job.total_bytes_processed}")
+        return
+
+    client.create_table(file_metadata_table(target_table_id))
+    start = time.perf_counter()
+    job = client.query(copy_query)
+    job.result()
+    print(f"copied {job.num_dml_affected_rows} rows ({time.perf_counter() - start:.1f} s, "
+          f"{job.total_bytes_processed} bytes processed)")
+
+    source_count = count_rows(client, source_table_id)
+    target_count = count_rows(client, target_table_id)
+    if source_count != target_count:
+        raise SystemExit(f"Row count mismatch: {source_count} != {target_count} ({target_table_id} is kept)")
+
+    # 旧テーブルを退避してから新テーブルを file_metadata にする
+    backup_name = f"{args.table}_backup_{suffix}"
+    client.query(f"ALTER TABLE `{source_table_id}` RENAME TO `{backup_name}`").result()
+    client.query(f"ALTER TABLE `{target_table_id}` RENAME TO `{args.table}`").result()
+    print(f"{source_table_id} migrated (backup: {args.dataset}.{backup_name})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+
+from .normalize import normalize
+
+# セグメントファイルの先頭に置く識別子（形式を変更したら更新する）
+SEGMENT_MAGIC = b"OCRIDX1\n"
+# 文字 n-gram の長さ
+NGRAM = 2
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def ngrams(normalized: str, n: int = NGRAM) -> list[str]:
+    """正規化済みテキストを位置順の文字 n-gram に分割（n 文字未満の場合はそのまま）"""
+    if len(normalized) < n:
+        return [normalized] if normalized else []
+    return [normalized[i:i + n] for i in range(len(normalized) - n + 1)]
+
+
+def tokenize(text: str) -> list[str]:
+    """OCRテキストを照合と同じ規則で正規化し、文字 bigram に分割"""
+    return ngrams(normalize(text))
+
+
+def keywords(text: str, limit: int = 50) -> list[str]:
+    """出現頻度の高い bigram（記号を含むものを除く）をキーワードとして返す"""
+    counts = Counter(gram for gram in tokenize(text) if gram.isalnum())
+    return [gram for gram, _ in counts.most_common(limit)]
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_postings(postings: list[tuple[int, list[int]]]) -> bytes:
+    """(文書番号, 出現位置) のリストを差分 varint で符号化"""
+    out = bytearray()
+    previous_doc = 0
+    for doc_num, positions in postings:
+        _write_varint(out, doc_num - previous_doc)
+        _write_varint(out, len(positions))
+        previous_pos = 0
+        for pos in positions:
+            delta = pos - previous_pos
+            if delta < 0x80:
+                # 位置の差分はほとんどが1バイトに収まるので関数呼び出しを省く
+                out.append(delta)
+            else:
+                _write_varint(out, delta)
+            previous_pos = pos
+        previous_doc = doc_num
+    return bytes(out)
+
+
+def _decode_postings(data: bytes, count: int) -> list[tuple[int, list[int]]]:
+    postings = []
+    pos = 0
+    doc_num = 0
+    for _ in range(count):
+        delta, pos = _read_varint(data, pos)
+        doc_num += delta
+        tf, pos = _read_varint(data, pos)
+        positions = []
+        previous = 0
+        for _ in range(tf):
+            byte = data[pos]
+            if byte < 0x80:
+                pos += 1
+                previous += byte
+            else:
+                delta, pos = _read_varint(data, pos)
+                previous += delta
+            positions.append(previous)
+        postings.append((doc_num, positions))
+    return postings
+
+
+@dataclass
+class SearchHit:
+    file_id: str
+    score: float
+
+
+class Segment:
+    """変更しないインデックスの単位（文書表・語彙・ポスティングリスト・削除記録）
+
+    deletes は このセグメントより前のセグメントにある文書の削除を表す。
+    """
+
+    def __init__(self, name: str, docs: list[tuple[str, int]], deletes: list[str],
+                 terms: dict[str, tuple[int, int, int]], postings: bytes):
+        self.name = name
+        self.docs = docs
+        self.deletes = deletes
+        self._terms = terms
+        self._postings = postings
+
+    @property
+    def term_count(self) -> int:
+        return len(self._terms)
+
+    @classmethod
+    def build(cls, name: str, documents: dict[str, str], deletes: Iterable[str] = ()) -> "Segment":
+        """文書（file_id → OCRテキスト）を n-gram に分割してセグメントを作成"""
+        return cls.from_grams(name, {file_id: tokenize(text) for file_id, text in documents.items()}, deletes)
+
+    @classmethod
+    def from_grams(cls, name: str, documents: dict[str, list[str]], deletes: Iterable[str] = ()) -> "Segment":
+        """n-gram に分割済みの文書（file_id → n-gram の列）からセグメントを作成"""
+        docs = []
+        term_postings: dict[str, list[tuple[int, list[int]]]] = defaultdict(list)
+        for doc_num, file_id in enumerate(sorted(documents)):
+            grams = documents[file_id]
+            docs.append((file_id, len(grams)))
+            positions: dict[str, list[int]] = defaultdict(list)
+            for pos, gram in enumerate(grams):
+                positions[gram].append(pos)
+            for gram, gram_positions in positions.items():
+                term_postings[gram].append((doc_num, gram_positions))
+        return cls._from_postings(name, docs, sorted(deletes), term_postings)
+
+    @classmethod
+    def _from_postings(cls, name: str, docs: list[tuple[str, int]], deletes: list[str],
+                       term_postings: dict[str, list[tuple[int, list[int]]]]) -> "Segment":
+        terms = {}
+        blob = bytearray()
+        for term in sorted(term_postings):
+            encoded = _encode_postings(term_postings[term])
+            terms[term] = (len(blob), len(encoded), len(term_postings[term]))
+            blob.extend(encoded)
+        return cls(name, docs, deletes, terms, bytes(blob))
+
+    @classmethod
+    def merge(cls, name: str, segments: list["Segment"], live: set[tuple[int, int]]) -> "Segment":
+        """有効な文書のみを残して複数のセグメントを1つにまとめる（再分割は行わない）"""
+        docs = []
+        remap: dict[tuple[int, int], int] = {}
+        for i, segment in enumerate(segments):
+            for doc_num, doc in enumerate(segment.docs):
+                if (i, doc_num) in live:
+                    remap[(i, doc_num)] = len(docs)
+                    docs.append(doc)
+
+        term_postings: dict[str, list[tuple[int, list[int]]]] = defaultdict(list)
+        for i, segment in enumerate(segments):
+            for term in segment._terms:
+                for doc_num, positions in segment.postings(term):
+                    new_doc = remap.get((i, doc_num))
+                    if new_doc is not None:
+                        term_postings[term].append((new_doc, positions))
+        return cls._from_postings(name, docs, [], term_postings)
+
+    def postings(self, term: str) -> list[tuple[int, list[int]]]:
+        entry = self._terms.get(term)
+        if entry is None:
+            return []
+        offset, length, count = entry
+        return _decode_postings(self._postings[offset:offset + length], count)
+
+    def phrase_matches(self, normalized: str) -> dict[int, int]:
+        """正規化済みの検索語が連続して出現する文書と出現回数"""
+        counts: dict[int, int] = defaultdict(int)
+        if len(normalized) < NGRAM:
+            # 1文字の検索語は、その文字で始まる n-gram と文書末尾の n-gram から数える
+            for term in self._terms:
+                if term[0] == normalized:
+                    for doc_num, positions in self.postings(term):
+                        counts[doc_num] += len(positions)
+                if len(term) == NGRAM and term[-1] == normalized:
+                    for doc_num, positions in self.postings(term):
+                        if self.docs[doc_num][1] - 1 in positions:
+                            counts[doc_num] += 1
+            return dict(counts)
+
+        grams = ngrams(normalized)
+        gram_postings = []
+        for gram in grams:
+            postings = dict(self.postings(gram))
+            if not postings:
+                return {}
+            gram_postings.append(postings)
+
+        for doc_num in set.intersection(*(set(postings) for postings in gram_postings)):
+            following = [set(postings[doc_num]) for postings in gram_postings[1:]]
+            tf = sum(
+                1 for start in gram_postings[0][doc_num]
+                if all(start + k + 1 in positions for k, positions in enumerate(following))
+            )
+            if tf:
+                counts[doc_num] = tf
+        return dict(counts)
+
+    def write(self, path: str):
+        header = json.dumps(
+            {"docs": self.docs, "deletes": self.deletes, "terms": self._terms}, ensure_ascii=False
+        ).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(SEGMENT_MAGIC)
+            f.write(struct.pack(">I", len(header)))
+            f.write(header)
+            f.write(self._postings)
+
+    @classmethod
+    def read(cls, path: str) -> "Segment":
+        with open(path, "rb") as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"Not a search index segment: {path}")
+            (header_length,) = struct.unpack(">I", f.read(4))
+            header = json.loads(f.read(header_length))
+            postings = f.read()
+        docs = [(file_id, length) for file_id, length in header["docs"]]
+        terms = {term: tuple(entry) for term, entry in header["terms"].items()}
+        return cls(os.path.basename(path), docs, header["deletes"], terms, postings)
+
+
+class BufferSegment(Segment):
+    """未書き出しの文書を保持するメモリ上のセグメント
+
+    add() / delete() のたびにポスティングを差分で更新するため、検索のたびに作り直さない。
+    置き換え・削除した文書の番号は詰めずに空き（file_id が None）として残す。
+    deletes は書き出し済みのセグメントにある文書の削除を表す。
+    """
+
+    def __init__(self):
+        super().__init__("buffer", [], [], {}, b"")
+        self.documents: dict[str, list[str]] = {}
+        self.deletes: set[str] = set()
+        self._doc_nums: dict[str, int] = {}
+        self._terms: dict[str, dict[int, list[int]]] = {}
+
+    def add(self, file_id: str, grams: list[str]):
+        self._remove(file_id)
+        doc_num = len(self.docs)
+        self.docs.append((file_id, len(grams)))
+        self.documents[file_id] = grams
+        self._doc_nums[file_id] = doc_num
+        for pos, gram in enumerate(grams):
+            self._terms.setdefault(gram, {}).setdefault(doc_num, []).append(pos)
+
+    def delete(self, file_id: str):
+        self._remove(file_id)
+        self.deletes.add(file_id)
+
+    def clear(self):
+        self.__init__()
+
+    def postings(self, term: str) -> list[tuple[int, list[int]]]:
+        return sorted(self._terms.get(term, {}).items())
+
+    def _remove(self, file_id: str):
+        doc_num = self._doc_nums.pop(file_id, None)
+        if doc_num is None:
+            return
+        for gram in set(self.documents.pop(file_id)):
+            postings = self._terms[gram]
+            del postings[doc_num]
+            if not postings:
+                del self._terms[gram]
+        self.docs[doc_num] = (None, 0)
+
+
+def _live_docs(segments: list[Segment]) -> set[tuple[int, int]]:
+    """各 file_id の最新の文書（削除されていないもの）を (セグメント番号, 文書番号) で返す"""
+    latest: dict[str, tuple[int, int]] = {}
+    for i, segment in enumerate(segments):
+        for file_id in segment.deletes:
+            latest.pop(file_id, None)
+        for doc_num, (file_id, _) in enumerate(segment.docs):
+            # BufferSegment の空き番号は対象にしない
+            if file_id is not None:
+                latest[file_id] = (i, doc_num)
+    return set(latest.values())
+
+
+class SearchIndex:
+    """OCRテキストの全文検索用転置インデックス（ローカルのセグメントファイルに保存）
+
+    add() した文書は n-gram に分割してメモリ上のセグメント（BufferSegment）に差分で追加し、
+    flush() でセグメントファイルとして書き出す。
+    同じ file_id を再度 add() した場合は新しい方が有効になる。セグメント数が
+    max_segments を超えると merge() で1つにまとめる。検索は未書き出しの文書も対象にし、
+    検索語（空白区切りはAND）の出現回数を BM25 で順位付けする。
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory: str, max_buffer_docs: int = 1000, max_segments: int = 8):
+        self._directory = directory
+        self._max_buffer_docs = max_buffer_docs
+        self._max_segments = max_segments
+        self._lock = threading.RLock()
+        # 未書き出しの文書と削除。add() 時に1度だけ分割する
+        self._buffer = BufferSegment()
+        self._live: Optional[set[tuple[int, int]]] = None
+        os.makedirs(directory, exist_ok=True)
+
+        manifest_path = os.path.join(directory, self.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"segments": [], "next_id": 1}
+        self._next_id = manifest["next_id"]
+        self._segments = [Segment.read(os.path.join(directory, name)) for name in manifest["segments"]]
+
+    def add(self, file_id: str, text: str):
+        grams = tokenize(text)
+        with self._lock:
+            self._buffer.add(file_id, grams)
+            self._live = None
+            if len(self._buffer.documents) >= self._max_buffer_docs:
+                self.flush()
+
+    def delete(self, file_id: str):
+        with self._lock:
+            self._buffer.delete(file_id)
+            self._live = None
+
+    def flush(self):
+        """未書き出しの文書と削除をセグメントファイルに書き出す"""
+        with self._lock:
+            if not self._buffer.documents and not self._buffer.deletes:
+                return
+            segment = Segment.from_grams(self._new_segment_name(), self._buffer.documents, self._buffer.deletes)
+            self._write_segment(segment)
+            self._segments.append(segment)
+            self._buffer.clear()
+            self._live = None
+            if len(self._segments) > self._max_segments:
+                self.merge()
+            else:
+                self._write_manifest()
+
+    def merge(self):
+        """全セグメントを有効な文書のみの1セグメントにまとめ、古いファイルを削除"""
+        with self._lock:
+            if len(self._segments) <= 1 and not any(segment.deletes for segment in self._segments):
+                return
+            # 未書き出しの文書・削除は対象にしない（次の flush() で書き出される）
+            live = _live_docs(self._segments)
+            merged = Segment.merge(self._new_segment_name(), self._segments, live)
+            self._write_segment(merged)
+            old_names = [segment.name for segment in self._segments]
+            self._segments = [merged]
+            self._live = None
+            self._write_manifest()
+            for name in old_names:
+                os.remove(os.path.join(self._directory, name))
+
+    def search(self, query: str, limit: int = 100) -> list[SearchHit]:
+        """検索語をすべて含む文書をスコア順に返す"""
+        terms = [normalize(term) for term in query.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return []
+
+        with self._lock:
+            segments = list(self._segments)
+            live = self._live_docs()
+            # 未書き出し分は add() / delete() で更新されるため、ロック内で一致を数えて文書表を写す
+            buffer_matches = [self._buffer.phrase_matches(term) for term in terms]
+            docs = [segment.docs for segment in segments] + [list(self._buffer.docs)]
+
+        doc_count = len(live)
+        if not doc_count:
+            return []
+        avg_length = sum(docs[i][doc_num][1] for i, doc_num in live) / doc_count or 1
+
+        scores: Optional[dict[tuple[int, int], float]] = None
+        for term, term_buffer_matches in zip(terms, buffer_matches):
+            matches = {}
+            for i, segment_matches in enumerate(
+                [segment.phrase_matches(term) for segment in segments] + [term_buffer_matches]
+            ):
+                for doc_num, tf in segment_matches.items():
+                    if (i, doc_num) in live:
+                        matches[(i, doc_num)] = tf
+            idf = math.log(1 + (doc_count - len(matches) + 0.5) / (len(matches) + 0.5))
+            term_scores = {}
+            for doc, tf in matches.items():
+                if scores is not None and doc not in scores:
+                    continue
+                length = docs[doc[0]][doc[1]][1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                term_scores[doc] = (scores[doc] if scores is not None else 0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            scores = term_scores
+            if not scores:
+                return []
+
+        hits = [SearchHit(docs[i][doc_num][0], score) for (i, doc_num), score in scores.items()]
+        hits.sort(key=lambda hit: (-hit.score, hit.file_id))
+        return hits[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "documents": len(self._live_docs()),
+                "buffered": len(self._buffer.documents),
+                "pending_deletes": len(self._buffer.deletes),
+                "terms": sum(segment.term_count for segment in self._segments)
+            }
+
+    def _all_segments(self) -> list[Segment]:
+        """書き出し済みのセグメントと未書き出し分（最後尾）"""
+        return self._segments + [self._buffer]
+
+    def _live_docs(self) -> set[tuple[int, int]]:
+        if self._live is None:
+            self._live = _live_docs(self._all_segments())
+        return self._live
+
+    def _new_segment_name(self) -> str:
+        name = f"segment-{self._next_id:06d}.idx"
+        self._next_id += 1
+        return name
+
+    def _write_segment(self, segment: Segment):
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        os.close(fd)
+        segment.write(tmp_path)
+        os.replace(tmp_path, os.path.join(self._directory, segment.name))
+
+    def _write_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"segments": [segment.name for segment in self._segments], "next_id": self._next_id}, f)
+        os.replace(tmp_path, os.path.join(self._directory, self.MANIFEST))
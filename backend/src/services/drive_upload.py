@@ -0,0 +1,150 @@
+from typing import BinaryIO, Optional
+import base64
+import hashlib
+import io
+import mimetypes
+import time
+
+# 先頭のバイト列 → MIMEタイプ（OCR対象の判定に使うため拡張子より優先する）
+MAGIC_NUMBERS = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+]
+GENERIC_MIME_TYPES = ("", "application/octet-stream", "binary/octet-stream", "application/unknown")
+SNIFF_BYTES = 16
+# 再試行するHTTPステータス
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class Base64UrlReader(io.RawIOBase):
+    """base64url 文字列を必要な範囲だけデコードしながら読むストリーム
+
+    デコード後のバイト列全体をメモリに持たずに MediaIoBaseUpload に渡せる。
+    任意の位置に seek できるため、再開アップロードで確定済みの位置から読み直せる。
+    """
+
+    def __init__(self, data: str):
+        self._data = data
+        length = len(data)
+        while length and data[length - 1] == "=":
+            length -= 1
+        self._chars = length
+        self._size = length * 3 // 4
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        want = min(len(buffer), self._size - self._pos)
+        if want <= 0:
+            return 0
+        # 3バイト = 4文字 の単位で、必要な範囲を含む文字列だけをデコードする
+        first_group, skip = divmod(self._pos, 3)
+        last_group = -(-(self._pos + want) // 3)
+        chars = self._data[first_group * 4:min(last_group * 4, self._chars)]
+        decoded = base64.urlsafe_b64decode(chars + "=" * (-len(chars) % 4))
+        piece = decoded[skip:skip + want]
+        buffer[:len(piece)] = piece
+        self._pos += len(piece)
+        return len(piece)
+
+
+def open_attachment(data) -> BinaryIO:
+    """添付ファイルのデータを読み取り用のストリームにする
+
+    str は base64url として逐次デコード、bytes はそのまま、ファイルオブジェクトは
+    そのまま返す（seek できること）。
+    """
+    if isinstance(data, str):
+        return Base64UrlReader(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data)
+    return data
+
+
+def stream_size(stream: BinaryIO) -> int:
+    position = stream.tell()
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+def stream_digest(stream: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+    """ストリーム全体を先頭から chunk_size ずつ読んで SHA-256 を計算し、読み取り位置を戻す"""
+    position = stream.tell()
+    stream.seek(0)
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(position)
+    return digest.hexdigest()
+
+
+def detect_mime_type(head: bytes, filename: str = "", declared: Optional[str] = None) -> str:
+    """先頭のバイト列からMIMEタイプを判定（判定できなければ申告値・拡張子の順）"""
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if declared and declared.lower() not in GENERIC_MIME_TYPES:
+        return declared
+    guessed, _ = mimetypes.guess_type(filename or "")
+    return guessed or "application/octet-stream"
+
+
+def sniff_mime_type(stream: BinaryIO, filename: str = "", declared: Optional[str] = None) -> str:
+    """ストリームの先頭を読んでMIMEタイプを判定し、読み取り位置を戻す"""
+    position = stream.tell()
+    head = stream.read(SNIFF_BYTES) or b""
+    stream.seek(position)
+    return detect_mime_type(head, filename, declared)
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        return int(status) in RETRYABLE_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+def upload_resumable(request, max_attempts: int = 5, retry_delay: float = 1.0, num_retries: int = 3):
+    """再開可能アップロードを最後のチャンクまで送信し、作成されたファイルを返す
+
+    next_chunk が失敗した場合は間隔を空けて呼び直す。googleapiclient は失敗後の
+    呼び出しでサーバーに確定済みの位置を問い合わせ、そこから送信を再開する。
+    """
+    failures = 0
+    response = None
+    while response is None:
+        try:
+            _, response = request.next_chunk(num_retries=num_retries)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            if not _is_retryable(e) or failures >= max_attempts:
+                raise
+            print(f"Drive upload interrupted, resuming ({failures}/{max_attempts}): {e}")
+            time.sleep(retry_delay * 2 ** (failures - 1))
+    return response
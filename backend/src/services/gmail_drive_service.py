@@ -1,8 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaInMemoryUpload
-import base64
+from googleapiclient.http import MediaIoBaseUpload
 import os
+import threading
+
+from .drive_upload import open_attachment, sniff_mime_type, stream_size, upload_resumable
+
+# 再開可能アップロードの1チャンクの大きさ（256KiB の倍数）
+UPLOAD_CHUNK_SIZE = int(os.getenv('DRIVE_UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+# これ以下のファイルは1回のマルチパートアップロードで送る（再開可能アップロードは最低2往復）
+RESUMABLE_THRESHOLD = int(os.getenv('DRIVE_RESUMABLE_THRESHOLD', str(5 * 1024 * 1024)))
+# 同時にアップロードする添付ファイルの数
+UPLOAD_WORKERS = int(os.getenv('DRIVE_UPLOAD_WORKERS', '4'))
 
 class GmailDriveService:
     def __init__(self):
@@ -14,48 +24,93 @@ class GmailDriveService:
             ]
         )
         self.drive_service = build('drive', 'v3', credentials=self.credentials)
+        self._local = threading.local()
+
+    def _thread_drive_service(self):
+        """スレッドごとの Drive APIサービス（httplib2 はスレッドセーフではない）"""
+        service = getattr(self._local, 'drive_service', None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+            self._local.drive_service = service
+        return service
         
-    def save_attachment_to_drive(self, attachment_data: str, filename: str, target_folder_id: str):
+    def save_attachment_to_drive(self, attachment_data, filename: str, target_folder_id: str,
+                                 mime_type: str = None):
         """
-        Base64エンコードされた添付ファイルをGoogleドライブに保存
+        添付ファイルをGoogleドライブに保存
+        
+        ファイル全体をメモリに展開せず、ストリームから UPLOAD_CHUNK_SIZE ずつ送信する。
+        送信が中断した場合はサーバーに確定済みの位置から再開する。
+        MIMEタイプはファイル先頭のバイト列から判定する（判定できなければ mime_type・拡張子）。
         
         Args:
-            attachment_data: Base64エンコードされたファイルデータ
+            attachment_data: Base64url エンコードされた文字列（逐次デコード）、
+                デコード済みのバイト列、または seek 可能なファイルオブジェクト
             filename: 保存するファイル名
             target_folder_id: 保存先フォルダのID
+            mime_type: 添付ファイルに指定されていたMIMEタイプ
         
         Returns:
             作成されたファイルのID
         """
         try:
-            # Base64デコード
-            file_data = base64.urlsafe_b64decode(attachment_data)
+            stream = open_attachment(attachment_data)
+            detected_mime_type = sniff_mime_type(stream, filename, mime_type)
+            resumable = stream_size(stream) > RESUMABLE_THRESHOLD
             
             # ファイルメタデータの設定
             file_metadata = {
                 'name': filename,
-                'parents': [target_folder_id]
+                'parents': [target_folder_id],
+                'mimeType': detected_mime_type
             }
             
             # メディアの準備
-            media = MediaInMemoryUpload(
-                file_data,
-                mimetype='application/octet-stream',
-                resumable=True
+            media = MediaIoBaseUpload(
+                stream,
+                mimetype=detected_mime_type,
+                chunksize=UPLOAD_CHUNK_SIZE,
+                resumable=resumable
             )
             
             # ファイルのアップロード
-            file = self.drive_service.files().create(
+            request = self._thread_drive_service().files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            )
+            file = upload_resumable(request) if resumable else request.execute(num_retries=3)
             
             return file.get('id')
             
         except Exception as e:
             print(f"Error saving file to Drive: {str(e)}")
             raise
+
+    def save_attachments_to_drive(self, attachments: list, target_folder_id: str,
+                                  max_workers: int = UPLOAD_WORKERS) -> list:
+        """
+        複数の添付ファイルを並行してGoogleドライブに保存
+        
+        Args:
+            attachments: (attachment_data, filename, mime_type) のリスト
+            target_folder_id: 保存先フォルダのID
+            max_workers: 同時にアップロードする数
+        
+        Returns:
+            attachments と同じ順の、作成されたファイルのID（失敗したものは例外）
+        """
+        def save(attachment):
+            attachment_data, filename, mime_type = attachment
+            try:
+                return self.save_attachment_to_drive(attachment_data, filename, target_folder_id, mime_type)
+            except Exception as e:
+                return e
+        
+        if len(attachments) <= 1 or max_workers <= 1:
+            return [save(attachment) for attachment in attachments]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(attachments))) as executor:
+            return list(executor.map(save, attachments))
             
     def setup_folder_permissions(self, folder_id: str, service_account_email: str):
         """
@@ -0,0 +1,316 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+import time
+
+from .drive_upload import open_attachment, stream_digest
+
+# Gmail API のバッチリクエスト1回あたりの件数（上限100、推奨50）
+GMAIL_BATCH_SIZE = 50
+# history().list の1ページあたりの件数（上限500）
+HISTORY_PAGE_SIZE = 500
+# Firestore のバッチ書き込み・get_all 1回あたりの件数
+FIRESTORE_BATCH_LIMIT = 500
+# 添付ファイルの一覧に必要なフィールドだけを取得する
+MESSAGE_FIELDS = "id,payload(mimeType,filename,body(attachmentId,size,data),parts)"
+
+
+@dataclass
+class Attachment:
+    """メッセージ内の添付ファイル1件"""
+    message_id: str
+    filename: str
+    mime_type: str
+    attachment_id: Optional[str] = None
+    data: Optional[str] = None
+
+
+def iter_attachments(message: dict) -> Iterable[Attachment]:
+    """メッセージの MIME パートを再帰的にたどり、ファイル名のあるパートを返す"""
+    stack = [message.get("payload", {})]
+    while stack:
+        part = stack.pop(0)
+        if part.get("filename"):
+            body = part.get("body", {})
+            if body.get("attachmentId") or body.get("data"):
+                yield Attachment(
+                    message_id=message["id"],
+                    filename=part["filename"],
+                    mime_type=part.get("mimeType") or "application/octet-stream",
+                    attachment_id=body.get("attachmentId"),
+                    data=body.get("data")
+                )
+        stack.extend(part.get("parts", []))
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    resp = getattr(error, "resp", None)
+    return getattr(resp, "status", None)
+
+
+class FirestoreIngestionStore:
+    """Gmail 取り込みの処理状態を Firestore に保存する永続層
+
+    gmail_ingestion/{mailbox} に最後に処理した historyId、その下の messages に
+    処理済み（またはデッドレター扱いにした）メッセージID、failures に取り込みに
+    失敗したメッセージの試行回数、attachments に保存済み添付ファイルの SHA-256 と
+    Drive のファイルIDを保持する。存在確認は get_all でまとめて行う。
+    """
+
+    def __init__(self, db, mailbox: str, collection: str = "gmail_ingestion"):
+        self._db = db
+        self._root = db.collection(collection).document(mailbox.replace("/", "_"))
+
+    def get_history_id(self) -> Optional[str]:
+        doc = self._root.get()
+        return doc.to_dict().get("history_id") if doc.exists else None
+
+    def set_history_id(self, history_id: str):
+        self._root.set({"history_id": str(history_id), "updated_at": datetime.utcnow()}, merge=True)
+
+    def unseen_messages(self, message_ids: list[str]) -> list[str]:
+        seen = self._existing("messages", message_ids)
+        return [message_id for message_id in message_ids if message_id not in seen]
+
+    def mark_messages(self, message_ids: list[str]):
+        now = datetime.utcnow()
+        self._write("messages", {message_id: {"processed_at": now} for message_id in message_ids})
+
+    def record_failures(self, message_ids: list[str]) -> dict[str, int]:
+        """失敗したメッセージの試行回数を1増やし、メッセージID → 試行回数を返す"""
+        attempts = {message_id: (count or 0) + 1
+                    for message_id, count in self._existing("failures", message_ids, "attempts").items()}
+        for message_id in message_ids:
+            attempts.setdefault(message_id, 1)
+        now = datetime.utcnow()
+        self._write("failures", {message_id: {"attempts": count, "last_failed_at": now}
+                                 for message_id, count in attempts.items()})
+        return attempts
+
+    def dead_letter(self, message_ids: list[str]):
+        """再試行しても取り込めないメッセージを処理済みとして記録する（以降は取り込まない）"""
+        now = datetime.utcnow()
+        self._write("messages", {message_id: {"processed_at": now, "dead_lettered": True}
+                                 for message_id in message_ids})
+
+    def find_attachments(self, digests: list[str]) -> dict[str, str]:
+        """SHA-256 → 保存済みの Drive ファイルID"""
+        return self._existing("attachments", digests)
+
+    def record_attachments(self, saved: dict[str, dict]):
+        self._write("attachments", saved)
+
+    def _existing(self, subcollection: str, doc_ids: list[str], field: str = "drive_file_id") -> dict:
+        collection = self._root.collection(subcollection)
+        found = {}
+        for start in range(0, len(doc_ids), FIRESTORE_BATCH_LIMIT):
+            refs = [collection.document(doc_id) for doc_id in doc_ids[start:start + FIRESTORE_BATCH_LIMIT]]
+            for doc in self._db.get_all(refs):
+                if doc.exists:
+                    found[doc.id] = (doc.to_dict() or {}).get(field)
+        return found
+
+    def _write(self, subcollection: str, docs: dict[str, dict]):
+        collection = self._root.collection(subcollection)
+        items = list(docs.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            batch = self._db.batch()
+            for doc_id, data in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(collection.document(doc_id), data)
+            batch.commit()
+
+
+class GmailIngestor:
+    """Gmail の受信メールから添付ファイルを取り込み、Google Drive に保存する
+
+    前回処理した historyId から history().list を最後のページまで読み、追加された
+    メッセージを集める。処理済みのメッセージIDは除き、メッセージと添付ファイルは
+    HTTP バッチリクエストでまとめて取得する。内容の SHA-256 が保存済みの添付
+    ファイルは保存せず、それ以外は base64url の文字列のまま
+    save_attachments（GmailDriveService.save_attachments_to_drive）に渡して並行して保存する。
+    ハッシュの計算もアップロードも逐次デコードで行い、デコード後の内容全体をメモリに持たない。
+    すべて処理してから historyId を保存するため、途中で失敗しても次の通知で
+    同じ範囲から再開する（処理済みのメッセージ・添付ファイルは再保存しない）。
+    max_message_attempts 回の通知で続けて失敗したメッセージはデッドレターとして
+    記録し、historyId がそのメッセージで止まり続けないようにする。
+    """
+
+    def __init__(self, gmail, store, save_attachments: Callable[[list[tuple[str, str, str]], str], list],
+                 folder_id: str, user_id: str = "me", batch_size: int = GMAIL_BATCH_SIZE,
+                 max_retries: int = 3, retry_delay: float = 1.0, max_message_attempts: int = 5):
+        self._gmail = gmail
+        self._store = store
+        self._save_attachments = save_attachments
+        self._folder_id = folder_id
+        self._user_id = user_id
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._max_message_attempts = max_message_attempts
+
+    def process_notification(self, notified_history_id: str) -> dict:
+        """Pub/Sub の通知1件を処理し、処理件数を返す"""
+        start_history_id = self._store.get_history_id()
+        if start_history_id is None:
+            # 初回は通知の historyId を起点にする（それ以前のメールは取り込まない）
+            self._store.set_history_id(notified_history_id)
+            return {"status": "initialized", "history_id": str(notified_history_id)}
+
+        try:
+            message_ids, latest_history_id = self.list_added_messages(start_history_id)
+        except Exception as e:
+            if _http_status(e) != 404:
+                raise
+            # 保存した historyId が古すぎる場合は通知の historyId からやり直す
+            print(f"Gmail history {start_history_id} is no longer available, restarting from {notified_history_id}")
+            self._store.set_history_id(notified_history_id)
+            return {"status": "reset", "history_id": str(notified_history_id)}
+
+        message_ids = self._store.unseen_messages(message_ids)
+        messages = self.fetch(
+            [self._gmail.users().messages().get(userId=self._user_id, id=message_id, fields=MESSAGE_FIELDS)
+             for message_id in message_ids],
+            message_ids
+        )
+        attachments = [attachment for message_id in message_ids if message_id in messages
+                       for attachment in iter_attachments(messages[message_id])]
+        saved, duplicates, failed_messages = self.save_attachments(attachments)
+
+        processed = [message_id for message_id in message_ids
+                     if message_id in messages and message_id not in failed_messages]
+        self._store.mark_messages(processed)
+        processed_ids = set(processed)
+        failed_ids = [message_id for message_id in message_ids if message_id not in processed_ids]
+        dead_lettered = []
+        if failed_ids:
+            attempts = self._store.record_failures(failed_ids)
+            dead_lettered = [message_id for message_id in failed_ids
+                             if attempts.get(message_id, 0) >= self._max_message_attempts]
+            if dead_lettered:
+                print(f"Dead-lettering Gmail messages after {self._max_message_attempts} attempts: {dead_lettered}")
+                self._store.dead_letter(dead_lettered)
+        failed = len(failed_ids) - len(dead_lettered)
+        if failed == 0:
+            self._store.set_history_id(latest_history_id or notified_history_id)
+        return {
+            "status": "success" if failed == 0 else "partial",
+            "history_id": str(latest_history_id),
+            "messages": len(processed),
+            "failed_messages": failed,
+            "dead_lettered": len(dead_lettered),
+            "attachments_saved": saved,
+            "attachments_skipped": duplicates
+        }
+
+    def list_added_messages(self, start_history_id: str) -> tuple[list[str], Optional[str]]:
+        """history().list を全ページ読み、追加されたメッセージIDと最新の historyId を返す"""
+        message_ids = []
+        seen = set()
+        page_token = None
+        latest_history_id = None
+        while True:
+            response = self._gmail.users().history().list(
+                userId=self._user_id,
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                maxResults=HISTORY_PAGE_SIZE,
+                pageToken=page_token
+            ).execute()
+            for history_item in response.get("history", []):
+                for message_added in history_item.get("messagesAdded", []):
+                    message_id = message_added["message"]["id"]
+                    if message_id not in seen:
+                        seen.add(message_id)
+                        message_ids.append(message_id)
+            latest_history_id = response.get("historyId", latest_history_id)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return message_ids, latest_history_id
+
+    def fetch(self, requests: list, keys: list[str]) -> dict[str, dict]:
+        """リクエストを batch_size 件ずつのバッチで実行し、キー → レスポンスを返す
+
+        レート制限などで失敗したリクエストは間隔を空けて再試行し、最後まで
+        失敗したものは結果に含めない。
+        """
+        results = {}
+        pending = list(zip(keys, requests))
+        for attempt in range(self._max_retries + 1):
+            failed = []
+            for start in range(0, len(pending), self._batch_size):
+                chunk = dict(pending[start:start + self._batch_size])
+
+                def callback(request_id, response, exception):
+                    if exception is not None:
+                        failed.append((request_id, chunk[request_id]))
+                        print(f"Gmail batch request failed ({request_id}): {exception}")
+                    else:
+                        results[request_id] = response
+
+                batch = self._gmail.new_batch_http_request(callback=callback)
+                for key, request in chunk.items():
+                    batch.add(request, request_id=key)
+                batch.execute()
+            if not failed or attempt == self._max_retries:
+                break
+            pending = failed
+            time.sleep(self._retry_delay * 2 ** attempt)
+        return results
+
+    def save_attachments(self, attachments: list[Attachment]) -> tuple[int, int, set[str]]:
+        """添付ファイルを取得して Drive に保存する
+
+        メモリに載せる添付ファイルを抑えるため batch_size 件ずつ処理し、
+        (保存件数, 重複でスキップした件数, 取得・保存に失敗したメッセージID) を返す。
+        """
+        saved_count = duplicates = 0
+        failed_messages = set()
+        for start in range(0, len(attachments), self._batch_size):
+            chunk = attachments[start:start + self._batch_size]
+            to_fetch = [attachment for attachment in chunk if attachment.data is None]
+            bodies = self.fetch(
+                [self._gmail.users().messages().attachments().get(
+                    userId=self._user_id, messageId=attachment.message_id, id=attachment.attachment_id)
+                 for attachment in to_fetch],
+                [f"{attachment.message_id}:{attachment.attachment_id}" for attachment in to_fetch]
+            )
+
+            contents = []
+            for attachment in chunk:
+                data = attachment.data
+                if data is None:
+                    body = bodies.get(f"{attachment.message_id}:{attachment.attachment_id}")
+                    if body is None:
+                        failed_messages.add(attachment.message_id)
+                        continue
+                    data = body["data"]
+                contents.append((attachment, stream_digest(open_attachment(data)), data))
+
+            existing = self._store.find_attachments(list({digest for _, digest, _ in contents}))
+            to_save = {}
+            for attachment, digest, content in contents:
+                if digest in existing or digest in to_save:
+                    duplicates += 1
+                    continue
+                to_save[digest] = (attachment, content)
+
+            # 1チャンク分の添付ファイルはまとめて（並行して）アップロードする
+            results = self._save_attachments(
+                [(content, attachment.filename, attachment.mime_type) for attachment, content in to_save.values()],
+                self._folder_id
+            ) if to_save else []
+            saved = {}
+            for (digest, (attachment, _)), result in zip(to_save.items(), results):
+                if isinstance(result, Exception):
+                    print(f"Error saving attachment {attachment.filename} ({attachment.message_id}): {result}")
+                    failed_messages.add(attachment.message_id)
+                    continue
+                saved[digest] = {
+                    "drive_file_id": result,
+                    "filename": attachment.filename,
+                    "message_id": attachment.message_id,
+                    "saved_at": datetime.utcnow()
+                }
+            self._store.record_attachments(saved)
+            saved_count += len(saved)
+        return saved_count, duplicates, failed_messages
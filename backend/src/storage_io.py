@@ -0,0 +1,136 @@
+from typing import Optional
+import hashlib
+import os
+import resource
+import tempfile
+import threading
+
+# ダウンロード時の1回あたりの読み込みサイズ
+DOWNLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# これを超えるとスプールをメモリからディスクに切り替える
+SPOOL_MEMORY_BYTES = 16 * 1024 * 1024
+
+
+class StoredFile:
+    """OCR対象ファイルの内容へのハンドル
+
+    inline の場合は内容をスプール（一定サイズまではメモリ、超えるとディスク）に
+    保持し、read() を呼んだときにだけバイト列を作る。inline でない大きなファイルは
+    ダウンロードせず、OCRエンジンには gcs_uri を渡す。digest はキャッシュキーに使う
+    内容のハッシュで、ダウンロードしない場合は Cloud Storage のチェックサムから作る。
+    """
+
+    def __init__(self, content_type: str, size: int, digest: str, gcs_uri: Optional[str] = None,
+                 spool=None, content: Optional[bytes] = None):
+        self.content_type = content_type
+        self.size = size
+        self.digest = digest
+        self.gcs_uri = gcs_uri
+        self._spool = spool
+        self._content = content
+
+    @property
+    def inline(self) -> bool:
+        return self._spool is not None or self._content is not None
+
+    @classmethod
+    def from_bytes(cls, content: bytes, content_type: str, gcs_uri: Optional[str] = None) -> "StoredFile":
+        return cls(content_type, len(content), hashlib.sha256(content).hexdigest(), gcs_uri, content=content)
+
+    @classmethod
+    def from_blob(cls, blob, inline_limit: int, chunk_size: int = DOWNLOAD_CHUNK_BYTES,
+                  spool_memory: int = SPOOL_MEMORY_BYTES) -> "StoredFile":
+        """Cloud Storage のオブジェクトを開く
+
+        inline_limit 以下のファイルは範囲指定の分割読み込みでスプールに書き込み、
+        同時に SHA-256 を計算する。超える場合は内容を読み込まない。
+        """
+        gcs_uri = f"gs://{blob.bucket.name}/{blob.name}"
+        content_type = blob.content_type or "application/octet-stream"
+        if blob.size > inline_limit:
+            if blob.md5_hash:
+                digest = f"md5-{blob.md5_hash}"
+            else:
+                digest = f"crc32c-{blob.crc32c}-{blob.size}"
+            return cls(content_type, blob.size, digest, gcs_uri)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_memory)
+        sha256 = hashlib.sha256()
+        try:
+            for start in range(0, blob.size, chunk_size):
+                chunk = blob.download_as_bytes(start=start, end=min(start + chunk_size, blob.size) - 1)
+                sha256.update(chunk)
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        return cls(content_type, blob.size, sha256.hexdigest(), gcs_uri, spool=spool)
+
+    def read(self) -> bytes:
+        """内容をバイト列で取得（inline でない場合は None）"""
+        if self._content is not None:
+            return self._content
+        if self._spool is None:
+            return None
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._content = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def current_rss() -> int:
+    """現在の常駐メモリ（バイト）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # /proc がない環境（macOS）ではプロセスの最大値（バイト単位）で代用
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRssMonitor:
+    """処理中の常駐メモリの最大値を一定間隔で計測する（値はプロセス全体のもの）
+
+        with PeakRssMonitor() as monitor:
+            ...
+        monitor.peak_bytes, monitor.increase_bytes
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.start_bytes = 0
+        self.peak_bytes = 0
+
+    @property
+    def increase_bytes(self) -> int:
+        return max(self.peak_bytes - self.start_bytes, 0)
+
+    def _sample(self):
+        self.peak_bytes = max(self.peak_bytes, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = current_rss()
+        self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
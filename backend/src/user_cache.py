@@ -0,0 +1,112 @@
+from typing import Callable, Optional
+import threading
+import time
+
+
+class UserMasterCache:
+    """ユーザーマスターのプロセス内キャッシュ
+
+    起動時に users コレクションを一度だけ読み込み、以降は Firestore の
+    on_snapshot リスナーから届く差分（追加・更新・論理削除・物理削除）を
+    反映する。変更のたびに version を進めるので、利用側は version を
+    比較するだけで派生データ（照合エンジン等）の再構築要否を判定できる。
+    """
+
+    def __init__(self, db, collection: str = "users"):
+        self._db = db
+        self._collection = collection
+        self._lock = threading.Lock()
+        self._users: dict[str, dict] = {}
+        self._version = 0
+        self._updated_at: Optional[float] = None
+        self._ready = threading.Event()
+        self._watch = None
+        self._subscribers: list[Callable[[str, Optional[dict]], None]] = []
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def is_listening(self) -> bool:
+        return self._watch is not None
+
+    def start(self, timeout: float = 30.0) -> "UserMasterCache":
+        """リスナーを登録し、初回スナップショットの到着を待つ"""
+        if self._watch is None:
+            self._watch = self._db.collection(self._collection).on_snapshot(self._on_snapshot)
+        if not self._ready.wait(timeout):
+            # リスナーの初回応答が遅い場合は直接読み込む
+            self.load()
+        return self
+
+    def stop(self):
+        """リスナーを解除"""
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def load(self):
+        """コレクション全体を読み込んでキャッシュを置き換え"""
+        users = {doc.id: doc.to_dict() for doc in self._db.collection(self._collection).stream()}
+        with self._lock:
+            self._users = users
+            self._version += 1
+            self._updated_at = time.time()
+        self._ready.set()
+
+    def apply_change(self, change_type: str, user_id: str, user_data: Optional[dict] = None):
+        """差分を1件反映（change_type は ADDED / MODIFIED / REMOVED）"""
+        with self._lock:
+            if change_type == "REMOVED":
+                if self._users.pop(user_id, None) is None:
+                    return
+                user_data = None
+            else:
+                if self._users.get(user_id) == user_data:
+                    return
+                self._users[user_id] = user_data
+            self._version += 1
+            self._updated_at = time.time()
+
+        for callback in list(self._subscribers):
+            callback(user_id, user_data)
+
+    def subscribe(self, callback: Callable[[str, Optional[dict]], None]):
+        """変更通知を受け取るコールバックを登録（物理削除時は user_data=None）"""
+        self._subscribers.append(callback)
+
+    def get(self, user_id: str, include_deleted: bool = True) -> Optional[dict]:
+        user_data = self._users.get(user_id)
+        if user_data is None or (not include_deleted and user_data.get("is_deleted")):
+            return None
+        return user_data
+
+    def active_users(self) -> list[tuple[str, dict]]:
+        """論理削除されていないユーザーの (user_id, ユーザーデータ) 一覧"""
+        with self._lock:
+            items = list(self._users.items())
+        return [(user_id, data) for user_id, data in items if not data.get("is_deleted", False)]
+
+    def staleness(self) -> Optional[float]:
+        """最後に差分を反映してからの経過秒数（未読み込みなら None）"""
+        if self._updated_at is None:
+            return None
+        return time.time() - self._updated_at
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "user_count": len(self._users),
+            "listening": self.is_listening,
+            "staleness_seconds": self.staleness()
+        }
+
+    def _on_snapshot(self, doc_snapshots, changes, read_time):
+        """on_snapshot コールバック（初回は全件が ADDED として届く）"""
+        for change in changes:
+            doc = change.document
+            self.apply_change(change.type.name, doc.id, doc.to_dict() if change.type.name != "REMOVED" else None)
+        with self._lock:
+            self._updated_at = time.time()
+        self._ready.set()
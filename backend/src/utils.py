@@ -1,85 +1,302 @@
-from google.cloud import vision, documentai, storage, firestore, bigquery
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from google.cloud import vision, documentai
 from datetime import datetime
+import json
 import os
+import uuid
+
+from . import clients
+from .matcher import NameMatcher, NameMatch
+from .user_cache import UserMasterCache
+from .bq_writer import BatchedRowWriter
+from .ocr_cache import OcrResultCache, DiskCacheBackend, FirestoreCacheBackend
+from .vision_batch import VisionBatcher, annotate_file_async
+from .page_ocr import PagedOcrResult, ocr_pages_with_fallback, merge_pages
+from .storage_io import StoredFile
+from .search_index import SearchIndex, keywords
+from .auth_cache import AuthCache
+from .allow_list import AllowList
+
+# OCR結果キャッシュのキーに含めるエンジンのバージョン（変更時は再OCRされる）
+VISION_OCR_VERSION = os.getenv("VISION_OCR_VERSION", "text_detection")
+DOCAI_PROCESSOR_VERSION = os.getenv("DOCAI_PROCESSOR_VERSION", "default")
+
+# Vision APIの呼び出し方式（single: 1画像1リクエスト / batch: まとめて送信）
+VISION_MODE = os.getenv("VISION_MODE", "single")
+# async_batch_annotate_files に渡せるファイル形式
+ASYNC_FILE_TYPES = ("application/pdf", "image/tiff", "image/gif")
+# ページ単位で処理するファイル形式（PAGE_LEVEL_FALLBACK=false で文書全体を Document AI に送る）
+PAGED_FILE_TYPES = ("application/pdf", "image/tiff")
+PAGE_LEVEL_FALLBACK = os.getenv("PAGE_LEVEL_FALLBACK", "true").lower() == "true"
+# これを超えるファイルはダウンロードせず、OCRエンジンに gs:// URI を渡す
+OCR_INLINE_MAX_BYTES = int(os.getenv("OCR_INLINE_MAX_BYTES", str(15 * 1024 * 1024)))
+# ページ単位処理で1リクエストに含めるページ数（同時に保持するページ数の上限）
+OCR_PAGES_PER_REQUEST = int(os.getenv("OCR_PAGES_PER_REQUEST", "5"))
+
+_user_cache = None
+_ocr_writer = None
+_ocr_cache = None
+_vision_batcher = None
+_name_matcher = None
+_name_matcher_version = None
+_search_index = None
+_auth_cache = None
+_allow_list = None
+
+def get_user_cache() -> UserMasterCache:
+    """プロセス共通のユーザーマスターキャッシュを取得（初回のみ読み込み）"""
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserMasterCache(clients.get_firestore_client()).start()
+    return _user_cache
+
+def get_auth_cache() -> AuthCache:
+    """認証結果のキャッシュを取得（ユーザー・許可リスト・認証設定の変更で破棄）"""
+    global _auth_cache
+    if _auth_cache is None:
+        _auth_cache = AuthCache(ttl=float(os.getenv("AUTH_CACHE_TTL", "300")))
+        get_user_cache().subscribe(lambda user_id, user_data: _auth_cache.invalidate_user(user_id))
+        get_allow_list().subscribe(_auth_cache.invalidate_all)
+    return _auth_cache
+
+def get_allow_list() -> AllowList:
+    """許可ドメイン・メールアドレスの判定エンジンを取得（初回のみ読み込み）
+
+    ALLOW_LIST_POLL_INTERVAL を指定した場合はリスナーの代わりにバージョンスタンプをポーリングする。
+    """
+    global _allow_list
+    if _allow_list is None:
+        poll_interval = float(os.getenv("ALLOW_LIST_POLL_INTERVAL", "0"))
+        _allow_list = AllowList(clients.get_firestore_client()).start(poll_interval=poll_interval or None)
+    return _allow_list
+
+def get_name_matcher() -> NameMatcher:
+    """ユーザーマスターから構築した照合エンジンを取得（キャッシュ更新時のみ再構築）"""
+    if _name_matcher is None or _name_matcher_version != get_user_cache().version:
+        return rebuild_name_matcher()
+    return _name_matcher
+
+def rebuild_name_matcher() -> NameMatcher:
+    """ユーザーマスターキャッシュから照合エンジンを差し替え"""
+    global _name_matcher, _name_matcher_version
+    cache = get_user_cache()
+    version = cache.version
+    matcher = _name_matcher or NameMatcher()
+    matcher.build(cache.active_users())
+    _name_matcher = matcher
+    _name_matcher_version = version
+    return matcher
+
+def find_firestore_matches(extracted_text: str) -> list[NameMatch]:
+    """テキストに出現する全ユーザーの照合結果を文字位置付きで返す"""
+    return get_name_matcher().find_all(extracted_text)
 
 def check_firestore_match(extracted_text: str) -> tuple[bool, dict, list]:
     """Firestoreの照合データとテキストを照合（読み取り専用）"""
-    db = firestore.Client()
-    matches = []
-    
-    # ユーザーマスターと照合
-    users = db.collection("users").where("is_deleted", "==", False).stream()
-    for user in users:
-        user_data = user.to_dict()
-        # 標準名での照合
-        if user_data["standardized_name"] in extracted_text:
-            return True, user.to_dict(), ["standardized_name"]
-        # 代替名での照合
-        for alt_name in user_data.get("alternate_names", []):
-            if alt_name in extracted_text:
-                matches.append(alt_name)
-        if matches:
-            return True, user.to_dict(), matches
-    
-    return False, None, []
+    return get_name_matcher().match(extracted_text)
+
+def get_ocr_cache() -> OcrResultCache:
+    """OCR結果キャッシュを取得（OCR_CACHE_BACKEND で disk / firestore の永続層を選択）"""
+    global _ocr_cache
+    if _ocr_cache is None:
+        backend_type = os.getenv("OCR_CACHE_BACKEND", "")
+        backend = None
+        if backend_type == "disk":
+            backend = DiskCacheBackend(os.getenv("OCR_CACHE_DIR", "/tmp/ocr_cache"))
+        elif backend_type == "firestore":
+            backend = FirestoreCacheBackend(clients.get_firestore_client())
+        _ocr_cache = OcrResultCache(
+            max_entries=int(os.getenv("OCR_CACHE_MAX_ENTRIES", "1000")),
+            backend=backend
+        )
+    return _ocr_cache
+
+def get_vision_batcher() -> VisionBatcher:
+    """画像OCRをまとめて送信するバッチャーを取得"""
+    global _vision_batcher
+    if _vision_batcher is None:
+        _vision_batcher = VisionBatcher(
+            clients.get_vision_client(),
+            max_wait=float(os.getenv("VISION_BATCH_MAX_WAIT", "0.05"))
+        )
+    return _vision_batcher
+
+def close_vision_batcher():
+    """バッチャーに残った画像を送信してから停止（未作成の場合は何もしない）"""
+    global _vision_batcher
+    if _vision_batcher is not None:
+        _vision_batcher.close()
+        _vision_batcher = None
+
+def get_vision_batcher_stats() -> dict:
+    return _vision_batcher.stats() if _vision_batcher else None
+
+def as_stored_file(file_content, content_type: str, gcs_uri: str = None) -> StoredFile:
+    """バイト列または StoredFile を StoredFile として扱う"""
+    if isinstance(file_content, StoredFile):
+        return file_content
+    return StoredFile.from_bytes(file_content, content_type, gcs_uri)
 
-def extract_text_from_image(image_content: bytes) -> tuple[str, bool, dict, list]:
-    """Vision APIを使用して画像からテキストを抽出し、照合を行う"""
-    client = vision.ImageAnnotatorClient()
-    image = vision.Image(content=image_content)
+def detect_text_with_vision(image_content: bytes, mode: str = None, gcs_uri: str = None) -> str:
+    """Vision APIで画像からテキストを抽出（image_content が None の場合は gcs_uri を参照させる）"""
+    if (mode or VISION_MODE) == "batch" and image_content is not None:
+        return get_vision_batcher().detect_text(image_content)
+
+    client = clients.get_vision_client()
+    if image_content is not None:
+        image = vision.Image(content=image_content)
+    else:
+        image = vision.Image(source=vision.ImageSource(image_uri=gcs_uri))
     response = client.text_detection(image=image)
     
     if response.error.message:
         raise Exception(f"Error: {response.error.message}")
     
-    extracted_text = response.text_annotations[0].description if response.text_annotations else ""
+    return response.text_annotations[0].description if response.text_annotations else ""
+
+def extract_text_from_image(image_content, mode: str = None) -> tuple[str, bool, dict, list]:
+    """Vision APIを使用して画像からテキストを抽出し、照合を行う（同一内容はキャッシュから取得）"""
+    source = as_stored_file(image_content, "image/*")
+    extracted_text = get_ocr_cache().get_or_compute_digest(
+        source.digest, "vision", VISION_OCR_VERSION,
+        lambda: detect_text_with_vision(source.read(), mode, source.gcs_uri)
+    )
     has_match, matched_user, matched_names = check_firestore_match(extracted_text) if extracted_text else (False, None, [])
     
     return extracted_text, has_match, matched_user, matched_names
 
-def extract_text_from_pdf(pdf_content: bytes) -> str:
-    """Document AIを使用してPDFからテキストを抽出"""
-    client = documentai.DocumentProcessorServiceClient()
+def extract_text_from_pdf(pdf_content) -> str:
+    """Document AIを使用してPDFからテキストを抽出（同一内容はキャッシュから取得）"""
+    source = as_stored_file(pdf_content, "application/pdf")
+    processor = f"{os.getenv('DOCAI_PROCESSOR_ID')}/{DOCAI_PROCESSOR_VERSION}"
+    return get_ocr_cache().get_or_compute_digest(
+        source.digest, "document_ai", processor,
+        lambda: process_with_document_ai(source.read(), source.gcs_uri, source.content_type)
+    )
+
+def get_docai_processor_name() -> str:
     project_id = os.getenv("PROJECT_ID")
     location = "us"  # Document AI APIが利用可能なロケーション
     processor_id = os.getenv("DOCAI_PROCESSOR_ID")
+    return f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+
+def process_with_document_ai(pdf_content: bytes, gcs_uri: str = None, mime_type: str = "application/pdf") -> str:
+    """Document AIでPDFを処理（pdf_content が None の場合は gcs_uri を参照させる）"""
+    client = clients.get_documentai_client()
+    name = get_docai_processor_name()
     
-    name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
-    
-    document = documentai.Document.from_bytes(pdf_content)
-    request = documentai.ProcessRequest(
-        name=name,
-        document=document
-    )
+    if pdf_content is not None:
+        request = documentai.ProcessRequest(
+            name=name,
+            raw_document=documentai.RawDocument(content=pdf_content, mime_type=mime_type)
+        )
+    else:
+        request = documentai.ProcessRequest(
+            name=name,
+            gcs_document=documentai.GcsDocument(gcs_uri=gcs_uri, mime_type=mime_type)
+        )
     
     result = client.process_document(request=request)
     return result.document.text
 
-def process_document_with_ocr(file_content: bytes, content_type: str) -> tuple[str, str, dict, list]:
-    """OCR処理のメインフロー"""
+def extract_text_from_file_async(file_content, gcs_uri: str, content_type: str) -> str:
+    """PDF/TIFFを Vision API の非同期ファイル処理でOCR（同一内容はキャッシュから取得）"""
+    source = as_stored_file(file_content, content_type, gcs_uri)
+
+    def annotate() -> str:
+        output_uri = f"gs://{os.getenv('TEMP_BUCKET')}/vision-output/{uuid.uuid4()}/"
+        pages = annotate_file_async(
+            clients.get_vision_client(), clients.get_storage_client(),
+            gcs_uri, content_type, output_uri
+        )
+        return "\n".join(text for _, text in pages)
+
+    return get_ocr_cache().get_or_compute_digest(source.digest, "vision_async", VISION_OCR_VERSION, annotate)
+
+def extract_pages_with_fallback(file_content, content_type: str) -> PagedOcrResult:
+    """ページ単位でVision APIを実行し、照合できなかったページのみDocument AIで再処理（同一内容はキャッシュから取得）"""
+    source = as_stored_file(file_content, content_type)
+
+    def ocr() -> str:
+        # Cloud Storage にあるファイルは URI を参照させ、ページごとのリクエストで内容全体を読み込み・送信しない
+        content = None if source.gcs_uri else source.read()
+        result = ocr_pages_with_fallback(
+            clients.get_vision_client(), clients.get_documentai_client(), get_docai_processor_name(),
+            content, content_type, has_match=lambda text: bool(find_firestore_matches(text)),
+            gcs_uri=source.gcs_uri, pages_per_request=OCR_PAGES_PER_REQUEST
+        )
+        # ページのない結果はキャッシュしない
+        if not result.pages:
+            raise Exception("Error: OCR returned no pages")
+        return json.dumps([[page.page_number, page.text, page.engine] for page in result.pages], ensure_ascii=False)
+
+    version = f"{VISION_OCR_VERSION}+{os.getenv('DOCAI_PROCESSOR_ID')}/{DOCAI_PROCESSOR_VERSION}"
+    pages = json.loads(get_ocr_cache().get_or_compute_digest(source.digest, "paged", version, ocr))
+    return merge_pages({page_number: (text, engine) for page_number, text, engine in pages})
+
+def process_document_with_ocr(file_content, content_type: str, mode: str = None,
+                              gcs_uri: str = None) -> tuple[str, str, dict, list]:
+    """OCR処理のメインフロー
+
+    file_content にはバイト列または open_from_storage() の StoredFile を渡す。
+    mode に "batch" を指定すると（既定は VISION_MODE）、画像は batch_annotate_images に
+    まとめて送信し、gcs_uri のあるPDF/TIFFは async_batch_annotate_files で処理する。
+    それ以外のPDF/TIFFはページ単位で処理し、照合できなかったページのみ Document AI に送る。
+    """
+    mode = mode or VISION_MODE
+    source = as_stored_file(file_content, content_type, gcs_uri)
+    gcs_uri = gcs_uri or source.gcs_uri
+
     # Step 1: Vision APIで処理
-    if content_type.startswith('image/'):
-        extracted_text, has_match, matched_user, matched_names = extract_text_from_image(file_content)
+    if mode == "batch" and gcs_uri and content_type in ASYNC_FILE_TYPES:
+        extracted_text = extract_text_from_file_async(source, gcs_uri, content_type)
+        has_match, matched_user, matched_names = check_firestore_match(extracted_text)
+        if has_match:
+            return extracted_text, "vision_api", matched_user, matched_names
+    elif content_type in PAGED_FILE_TYPES and PAGE_LEVEL_FALLBACK:
+        result = extract_pages_with_fallback(source, content_type)
+        has_match, matched_user, matched_names = check_firestore_match(result.text)
+        ocr_method = "document_ai" if "document_ai" in result.engines else "vision_api"
+        return result.text, ocr_method, matched_user, matched_names
+    elif content_type.startswith('image/'):
+        extracted_text, has_match, matched_user, matched_names = extract_text_from_image(source, mode)
         if has_match:
             return extracted_text, "vision_api", matched_user, matched_names
     
     # Step 2: Document AIで処理（Vision APIでマッチしなかった場合）
-    extracted_text = extract_text_from_pdf(file_content)
+    extracted_text = extract_text_from_pdf(source)
     has_match, matched_user, matched_names = check_firestore_match(extracted_text)
     
     return extracted_text, "document_ai", matched_user, matched_names
 
-def store_to_bigquery(file_path: str, content_type: str, extracted_text: str, ocr_method: str, 
-                     matched_user: dict = None, matched_names: list = None) -> str:
-    """BigQueryにOCRデータを保存"""
-    client = bigquery.Client()
-    table_id = f"{os.getenv('PROJECT_ID')}.ocr_data.file_metadata"
-    
+def get_search_index() -> SearchIndex:
+    """OCRテキストの全文検索インデックスを取得（SEARCH_INDEX_DIR 未設定の場合は None）"""
+    global _search_index
+    index_dir = os.getenv("SEARCH_INDEX_DIR")
+    if _search_index is None and index_dir:
+        _search_index = SearchIndex(
+            index_dir,
+            max_buffer_docs=int(os.getenv("SEARCH_INDEX_BUFFER_DOCS", "1000"))
+        )
+    return _search_index
+
+def get_ocr_writer() -> BatchedRowWriter:
+    """OCR結果用のバッファ付きBigQueryライターを取得"""
+    global _ocr_writer
+    if _ocr_writer is None:
+        _ocr_writer = BatchedRowWriter(
+            clients.get_bigquery_client(),
+            f"{os.getenv('PROJECT_ID')}.ocr_data.file_metadata",
+            max_rows=int(os.getenv("OCR_WRITER_MAX_ROWS", "500")),
+            max_age=float(os.getenv("OCR_WRITER_MAX_AGE", "1.0"))
+        )
+    return _ocr_writer
+
+def build_ocr_row(file_path: str, extracted_text: str, matched_user: dict = None,
+                  matched_names: list = None) -> dict:
+    """file_metadata に書き込むOCR結果の行を作成"""
     now = datetime.utcnow()
     
-    row = {
+    return {
         "file_id": os.path.basename(file_path),
         "file_url": file_path,
         "user_id": matched_user["user_id"] if matched_user else None,
@@ -95,26 +312,31 @@ def store_to_bigquery(file_path: str, content_type: str, extracted_text: str, oc
         "is_deleted": False,
         "deleted_at": None
     }
-    
-    errors = client.insert_rows_json(table_id, [row])
-    if errors:
-        raise Exception(f"BigQuery insertion error: {errors}")
+
+def store_to_bigquery(file_path: str, content_type: str, extracted_text: str, ocr_method: str, 
+                     matched_user: dict = None, matched_names: list = None) -> str:
+    """BigQueryにOCRデータを保存（バッファ経由でまとめて挿入）
+
+    同時に届いた行とまとめて挿入し、挿入が終わるまで待つ（挿入できなかった場合は例外）。
+    """
+    row = build_ocr_row(file_path, extracted_text, matched_user, matched_names)
+    get_ocr_writer().add(row).result()
+    search_index = get_search_index()
+    if search_index is not None:
+        # 再処理で同じ file_id の文書を置き換える（テキストがなくなった場合は古い本文を残さない）
+        if extracted_text:
+            search_index.add(row["file_id"], extracted_text)
+        else:
+            search_index.delete(row["file_id"])
     return file_path
 
 def extract_keywords(text: str) -> list:
-    """テキストからキーワードを抽出（簡易実装）"""
-    # TODO: より高度な自然言語処理を実装
-    words = text.split()
-    return list(set([w for w in words if len(w) > 1]))
+    """テキストからキーワード（出現頻度の高い文字 bigram）を抽出"""
+    return keywords(text)
 
 def update_drive_file(file_id: str, new_name: str = None, new_parent: str = None):
     """Drive APIを使用してファイルをリネームまたは移動"""
-    credentials = service_account.Credentials.from_service_account_file(
-        os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
-        scopes=['https://www.googleapis.com/auth/drive.file']
-    )
-    
-    service = build('drive', 'v3', credentials=credentials)
+    service = clients.get_drive_service()
     
     file_metadata = {}
     if new_name:
@@ -132,9 +354,10 @@ def update_drive_file(file_id: str, new_name: str = None, new_parent: str = None
     except Exception as e:
         raise Exception(f"Drive API error: {e}")
 
-def get_file_from_storage(bucket_name: str, file_path: str) -> bytes:
-    """Cloud Storageからファイルを取得"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_path)
-    return blob.download_as_bytes()
+def open_from_storage(bucket_name: str, file_path: str) -> StoredFile:
+    """Cloud Storageのファイルを分割読み込みで開く（OCR_INLINE_MAX_BYTES を超える場合は読み込まない）"""
+    storage_client = clients.get_storage_client()
+    blob = storage_client.bucket(bucket_name).get_blob(file_path)
+    if blob is None:
+        raise FileNotFoundError(f"gs://{bucket_name}/{file_path}")
+    return StoredFile.from_blob(blob, inline_limit=OCR_INLINE_MAX_BYTES)
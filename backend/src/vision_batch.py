@@ -0,0 +1,171 @@
+from concurrent.futures import Future
+from typing import Iterator, Optional
+import json
+import re
+import threading
+import time
+
+# batch_annotate_images の1リクエストあたりの画像数上限
+MAX_IMAGES_PER_REQUEST = 16
+
+
+class VisionBatchError(Exception):
+    """Vision API のバッチ処理で個別画像の処理に失敗"""
+    pass
+
+
+class VisionBatcher:
+    """Vision API の画像OCRをまとめて batch_annotate_images で送信する
+
+    並行して投入された画像を最大 max_wait 秒待ち合わせ、最大
+    MAX_IMAGES_PER_REQUEST 件ずつ1回のリクエストにまとめる。
+    submit() は Future を返し、バッチ内の該当画像の結果で完了する。
+    """
+
+    def __init__(self, client, max_batch_size: int = MAX_IMAGES_PER_REQUEST, max_wait: float = 0.05):
+        self._client = client
+        self._max_batch_size = min(max_batch_size, MAX_IMAGES_PER_REQUEST)
+        self._max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending: list[tuple[bytes, Future]] = []
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._batch_count = 0
+        self._image_count = 0
+        self._batch_seconds = 0.0
+        self._last_batch_seconds: Optional[float] = None
+        self._started_at = time.monotonic()
+
+    def submit(self, image_content: bytes) -> Future:
+        """画像を投入し、抽出テキストで完了する Future を返す"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("VisionBatcher is closed")
+            self._pending.append((image_content, future))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vision-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def detect_text(self, image_content: bytes, timeout: Optional[float] = None) -> str:
+        """画像からテキストを抽出（バッチ経由で同期的に待つ）"""
+        return self.submit(image_content).result(timeout)
+
+    def close(self):
+        """残りの画像を送信してから停止"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        while self._pending:
+            self._annotate(self._take_batch())
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "queue_depth": len(self._pending),
+            "batch_count": self._batch_count,
+            "image_count": self._image_count,
+            "avg_batch_size": self._image_count / self._batch_count if self._batch_count else None,
+            "last_batch_latency_ms": self._last_batch_seconds * 1000 if self._last_batch_seconds is not None else None,
+            "avg_batch_latency_ms": self._batch_seconds / self._batch_count * 1000 if self._batch_count else None,
+            "images_per_second": self._image_count / elapsed if elapsed else None
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._is_due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self._max_wait - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            self._annotate(batch)
+
+    def _is_due(self) -> bool:
+        return bool(self._pending) and (
+            len(self._pending) >= self._max_batch_size
+            or time.monotonic() - self._oldest >= self._max_wait
+        )
+
+    def _take_batch(self) -> list[tuple[bytes, Future]]:
+        batch = self._pending[:self._max_batch_size]
+        del self._pending[:self._max_batch_size]
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+
+    def _annotate(self, batch: list[tuple[bytes, Future]]):
+        start = time.monotonic()
+        requests = [
+            {"image": {"content": content}, "features": [{"type_": "TEXT_DETECTION"}]}
+            for content, _ in batch
+        ]
+        try:
+            response = self._client.batch_annotate_images(requests=requests)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            elapsed = time.monotonic() - start
+            self._batch_count += 1
+            self._image_count += len(batch)
+            self._batch_seconds += elapsed
+            self._last_batch_seconds = elapsed
+
+        for (_, future), image_response in zip(batch, response.responses):
+            if image_response.error.message:
+                future.set_exception(VisionBatchError(image_response.error.message))
+            else:
+                annotations = image_response.text_annotations
+                future.set_result(annotations[0].description if annotations else "")
+
+
+def annotate_file_async(client, storage_client, gcs_uri: str, mime_type: str, output_uri: str,
+                        pages_per_output: int = 20, timeout: float = 600,
+                        cleanup: bool = True) -> Iterator[tuple[int, str]]:
+    """PDF/TIFF を async_batch_annotate_files で処理し、ページごとのテキストを順に返す
+
+    結果は output_uri 配下に JSON で書き出されるので、出力ファイルを1つずつ
+    読み込んで (ページ番号, テキスト) を逐次 yield する。
+
+    Args:
+        client: Vision API クライアント
+        storage_client: Cloud Storage クライアント
+        gcs_uri: 入力ファイルの gs:// URI
+        mime_type: application/pdf または image/tiff
+        output_uri: 結果の出力先（gs://bucket/prefix/）
+        pages_per_output: 出力JSON1ファイルあたりのページ数
+        timeout: 処理完了までの待ち時間（秒）
+        cleanup: 読み込んだ出力JSONを削除する
+    """
+    operation = client.async_batch_annotate_files(requests=[{
+        "input_config": {"gcs_source": {"uri": gcs_uri}, "mime_type": mime_type},
+        "features": [{"type_": "DOCUMENT_TEXT_DETECTION"}],
+        "output_config": {"gcs_destination": {"uri": output_uri}, "batch_size": pages_per_output}
+    }])
+    operation.result(timeout=timeout)
+
+    bucket_name, prefix = re.match(r"gs://([^/]+)/(.*)", output_uri).groups()
+    blobs = list(storage_client.list_blobs(bucket_name, prefix=prefix))
+    # output-1-to-20.json, output-21-to-40.json ... を開始ページ順に処理
+    blobs.sort(key=lambda blob: int(m.group(1)) if (m := re.search(r"output-(\d+)-to-", blob.name)) else 0)
+
+    page_number = 0
+    for blob in blobs:
+        result = json.loads(blob.download_as_bytes())
+        for response in result.get("responses", []):
+            page_number = response.get("context", {}).get("pageNumber", page_number + 1)
+            yield page_number, response.get("fullTextAnnotation", {}).get("text", "")
+        if cleanup:
+            blob.delete()
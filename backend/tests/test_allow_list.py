@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+from src.allow_list import AllowList, VERSION_DOC_ID, domain_suffixes
+
+class FakeFirestore:
+    """collection().stream() / document().get() だけを持つフェイク"""
+    def __init__(self, collections):
+        self.collections = collections
+        self.stream_calls = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def stream(self):
+        self.db.stream_calls += 1
+        docs = self.db.collections.get(self.name, {})
+        return [SimpleNamespace(id=doc_id, to_dict=lambda data=data: data) for doc_id, data in docs.items()]
+
+    def document(self, doc_id):
+        data = self.db.collections.get(self.name, {}).get(doc_id)
+        return SimpleNamespace(get=lambda: SimpleNamespace(exists=data is not None, to_dict=lambda: data))
+
+def make_change(change_type, doc_id, data=None):
+    document = SimpleNamespace(id=doc_id, to_dict=lambda: data)
+    return SimpleNamespace(type=SimpleNamespace(name=change_type), document=document)
+
+def make_db(settings=None):
+    return FakeFirestore({
+        "allowed_domains": {
+            "d1": {"domain": "Example.com", "is_active": True},
+            "d2": {"domain": "old.example.org", "is_active": False},
+        },
+        "allowed_emails": {"e1": {"email": "Guest@partner.jp", "is_active": True}},
+        "auth_settings": {"config": settings or {"allow_listed_emails_only": False}},
+    })
+
+def test_domain_suffixes():
+    assert domain_suffixes("a.b.example.com") == ["a.b.example.com", "b.example.com", "example.com"]
+    assert domain_suffixes("localhost") == ["localhost"]
+
+def test_domains_and_subdomains():
+    allow_list = AllowList(make_db())
+    allow_list.load()
+
+    assert allow_list.is_domain_allowed("example.com")
+    assert allow_list.is_domain_allowed("mail.Example.COM")
+    assert not allow_list.is_domain_allowed("notexample.com")
+    assert not allow_list.is_domain_allowed("old.example.org")
+    assert not allow_list.is_domain_allowed("gmail.com")
+
+def test_emails_and_settings():
+    allow_list = AllowList(make_db())
+    allow_list.load()
+    assert allow_list.is_email_allowed("guest@partner.jp")
+    assert allow_list.is_email_allowed("taro@sub.example.com")
+    assert not allow_list.is_email_allowed("someone@partner.jp")
+
+    # 既定値（allow_listed_emails_only=True）では登録済みのメールアドレスのみ
+    allow_list = AllowList(make_db(settings={"allow_personal_gmail": True}))
+    allow_list.load()
+    assert allow_list.is_email_allowed("guest@partner.jp")
+    assert not allow_list.is_email_allowed("taro@example.com")
+    assert allow_list.is_domain_allowed("gmail.com")
+
+def test_snapshot_deltas_bump_version_and_notify():
+    allow_list = AllowList(db=None)
+    notified = []
+    allow_list.subscribe(lambda: notified.append(allow_list.version))
+    allow_list._on_snapshot("settings", [make_change("ADDED", "config", {"allow_listed_emails_only": False})])
+    allow_list._on_snapshot("domains", [make_change("ADDED", "d1", {"domain": "example.com"})])
+    assert allow_list.is_email_allowed("a@example.com")
+
+    allow_list._on_snapshot("domains", [make_change("REMOVED", "d1")])
+    assert not allow_list.is_email_allowed("a@example.com")
+    assert notified == [1, 2, 3]
+
+def test_poll_reloads_only_when_stamp_changes():
+    db = make_db()
+    allow_list = AllowList(db)
+    allow_list.load()
+    loads = db.stream_calls
+
+    assert allow_list.poll() is False
+    assert db.stream_calls == loads
+
+    db.collections["auth_settings"][VERSION_DOC_ID] = {"stamp": "v2"}
+    db.collections["allowed_domains"]["d3"] = {"domain": "new.co.jp", "is_active": True}
+    assert allow_list.poll() is True
+    assert allow_list.is_domain_allowed("new.co.jp")
+    assert allow_list.poll() is False
+
+def test_index_includes_inactive_entries():
+    allow_list = AllowList(make_db())
+    allow_list.load()
+    index = allow_list.index("domains")
+    assert index["example.com"][0] == "d1"
+    assert index["old.example.org"][1]["is_active"] is False
+    assert allow_list.stats()["domain_count"] == 1
@@ -0,0 +1,154 @@
+from datetime import datetime
+import time
+
+from src.audit_log import AuditLogPipeline
+
+class FakeFirestore:
+    """batch().set() / commit() を記録するフェイク"""
+    def __init__(self):
+        self.commits = []
+        self.fail_times = 0
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, doc_id):
+        return (self.name, doc_id)
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        if self.db.fail_times:
+            self.db.fail_times -= 1
+            raise RuntimeError("deadline exceeded")
+        self.db.commits.append(self.writes)
+
+class FakeBigQuery:
+    def __init__(self):
+        self.get_table_calls = 0
+        self.rows = []
+
+    def get_table(self, table_id):
+        self.get_table_calls += 1
+        return table_id
+
+    def insert_rows(self, table, rows, row_ids=None):
+        self.rows.extend(rows)
+        return []
+
+def make_log(i):
+    return {"log_id": f"log-{i}", "user_id": "u1", "action": "login", "details": "",
+            "ip_address": "127.0.0.1", "user_agent": "", "timestamp": datetime(2024, 1, 1, 0, 0, i % 60)}
+
+def test_batches_writes_and_fetches_table_once():
+    db, bq = FakeFirestore(), FakeBigQuery()
+    pipeline = AuditLogPipeline(db, bq, "p.auth_management.auth_audit_logs", batch_size=3, flush_interval=60)
+    for i in range(7):
+        pipeline.enqueue(make_log(i))
+    pipeline.close()
+
+    assert [len(commit) for commit in db.commits] == [3, 3, 1]
+    assert [row["log_id"] for row in bq.rows] == [f"log-{i}" for i in range(7)]
+    assert bq.get_table_calls == 1
+    assert pipeline.stats()["written"] == 7
+    assert pipeline.stats()["queue_depth"] == 0
+
+def test_flushed_after_interval():
+    db, bq = FakeFirestore(), FakeBigQuery()
+    pipeline = AuditLogPipeline(db, bq, "t", flush_interval=0.05)
+    pipeline.enqueue(make_log(0))
+    deadline = time.monotonic() + 2
+    while not bq.rows and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert len(bq.rows) == 1
+    pipeline.close()
+
+def test_overflow_spills_to_disk_and_replays(tmp_path):
+    """キューが満杯のログはファイルに退避し、後で読み戻して書き込む"""
+    db, bq = FakeFirestore(), FakeBigQuery()
+    pipeline = AuditLogPipeline(db, bq, "t", max_queue=2, flush_interval=60, spill_dir=str(tmp_path))
+    for i in range(5):
+        pipeline.enqueue(make_log(i))
+
+    assert pipeline.stats()["spilled"] == 3
+    assert pipeline.stats()["spill_files"] == 1
+    pipeline.close()
+
+    assert sorted(row["log_id"] for row in bq.rows) == [f"log-{i}" for i in range(5)]
+    assert all(isinstance(row["timestamp"], datetime) for row in bq.rows)
+    assert pipeline.stats()["spill_files"] == 0
+
+def test_overflow_without_spill_dir_is_dropped():
+    db, bq = FakeFirestore(), FakeBigQuery()
+    pipeline = AuditLogPipeline(db, bq, "t", max_queue=1, flush_interval=60)
+    pipeline.enqueue(make_log(0))
+    pipeline.enqueue(make_log(1))
+    pipeline.close()
+
+    assert len(bq.rows) == 1
+    assert pipeline.stats()["dropped"] == 1
+
+def test_failed_batch_is_spilled_and_retried(tmp_path):
+    db, bq = FakeFirestore(), FakeBigQuery()
+    db.fail_times = 1
+    pipeline = AuditLogPipeline(db, bq, "t", flush_interval=60, spill_dir=str(tmp_path))
+    pipeline.enqueue(make_log(0))
+    pipeline.flush()
+
+    assert bq.rows == []
+    assert pipeline.stats()["failed_batches"] == 1
+    assert pipeline.stats()["spill_files"] == 1
+
+    pipeline.close()
+    assert [row["log_id"] for row in bq.rows] == ["log-0"]
+
+def test_close_accounts_for_unwritten_logs_and_drops_late_enqueues():
+    """停止時に書き込めなかったログは破棄した件数に数え、停止後の enqueue() は例外にしない"""
+    db, bq = FakeFirestore(), FakeBigQuery()
+    db.fail_times = 100
+    pipeline = AuditLogPipeline(db, bq, "t", batch_size=2, flush_interval=60)
+    for i in range(5):
+        pipeline.enqueue(make_log(i))
+    pipeline.close()
+
+    assert pipeline.stats()["queue_depth"] == 0
+    assert pipeline.stats()["dropped"] == 5
+
+    pipeline.enqueue(make_log(5))
+    assert pipeline.stats()["dropped"] == 6
+
+def test_spilled_logs_are_not_reloaded_until_retry_delay(tmp_path):
+    """書き込みに失敗している間は退避ファイルの読み戻しを倍々に間隔を空けて行う"""
+    db, bq = FakeFirestore(), FakeBigQuery()
+    db.fail_times = 2
+    pipeline = AuditLogPipeline(db, bq, "t", flush_interval=30, spill_dir=str(tmp_path), max_retry_delay=60)
+    pipeline.enqueue(make_log(0))
+    pipeline.flush()
+    assert pipeline.stats()["retry_delay_seconds"] == 30
+
+    # 再試行の時刻までは読み戻さない（退避ファイルを書き直さない）
+    with pipeline._cond:
+        pipeline._reload_spilled()
+    assert pipeline.stats()["queue_depth"] == 0
+    assert pipeline.stats()["spill_files"] == 1
+
+    pipeline.flush()
+    assert pipeline.stats()["retry_delay_seconds"] == 60
+    pipeline.flush()
+    assert pipeline.stats()["retry_delay_seconds"] == 0.0
+    assert [row["log_id"] for row in bq.rows] == ["log-0"]
+    pipeline.close()
@@ -0,0 +1,41 @@
+import time
+
+from src.auth_cache import AuthCache
+
+def test_hit_and_scope():
+    cache = AuthCache()
+    cache.set("token-a", "user", {"user_id": "u1"}, exp=time.time() + 3600, user_id="u1")
+
+    assert cache.get("token-a", "user") == {"user_id": "u1"}
+    assert cache.get("token-a", "allowed_email") is None
+    assert cache.get("token-b", "user") is None
+    assert cache.stats()["hits"] == 1
+
+def test_ttl_bounded_by_token_exp():
+    """トークンの exp を過ぎた結果は返さない"""
+    cache = AuthCache(ttl=3600)
+    cache.set("token", "user", {"user_id": "u1"}, exp=time.time() + 0.05)
+    assert cache.get("token", "user") is not None
+    time.sleep(0.1)
+    assert cache.get("token", "user") is None
+
+    cache.set("expired", "user", {"user_id": "u1"}, exp=time.time() - 1)
+    assert cache.stats()["entries"] == 0
+
+def test_invalidate_user():
+    cache = AuthCache()
+    cache.set("t1", "user", {"user_id": "u1"}, user_id="u1")
+    cache.set("t2", "user", {"user_id": "u2"}, user_id="u2")
+    cache.invalidate_user("u1")
+
+    assert cache.get("t1", "user") is None
+    assert cache.get("t2", "user") is not None
+
+def test_invalidate_all():
+    """許可リストや認証設定の変更時は全件破棄"""
+    cache = AuthCache()
+    cache.set("t1", "allowed_email", {"uid": "u1"})
+    cache.invalidate_all()
+
+    assert cache.get("t1", "allowed_email") is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from src.bq_writer import BatchedRowWriter
+
+class FakeBigQueryClient:
+    """insert_rows_json の呼び出しを記録するフェイク"""
+    def __init__(self, reject=()):
+        self.calls = []
+        self.rows = []
+        self.reject = set(reject)
+
+    def insert_rows_json(self, table_id, rows, row_ids=None):
+        self.calls.append([row["file_id"] for row in rows])
+        errors = []
+        for i, row in enumerate(rows):
+            if row["file_id"] in self.reject and len(rows) > 1:
+                errors.append({"index": i, "errors": [{"reason": "backendError"}]})
+            else:
+                self.rows.append(row)
+        return errors
+
+def test_flush_by_row_count():
+    """行数の上限でまとめて送信"""
+    client = FakeBigQueryClient()
+    writer = BatchedRowWriter(client, "p.d.t", max_rows=3, max_age=60)
+    for i in range(7):
+        writer.add({"file_id": f"f{i}"})
+    writer.close()
+
+    assert [len(call) for call in client.calls] == [3, 3, 1]
+    assert writer.stats()["flushed_rows"] == 7
+    assert writer.stats()["queue_depth"] == 0
+
+def test_flush_by_age():
+    """最古行の経過時間で送信"""
+    client = FakeBigQueryClient()
+    writer = BatchedRowWriter(client, "p.d.t", max_rows=100, max_age=0.05)
+    writer.add({"file_id": "f0"})
+    deadline = time.monotonic() + 2
+    while not client.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.close()
+
+    assert client.calls == [["f0"]]
+    assert writer.stats()["last_flush_latency_ms"] is not None
+
+def test_partial_failures_are_retried_row_by_row():
+    """部分失敗した行のみ1行ずつ再送"""
+    client = FakeBigQueryClient(reject={"f1"})
+    writer = BatchedRowWriter(client, "p.d.t", max_rows=10, max_age=60)
+    for i in range(3):
+        writer.add({"file_id": f"f{i}"})
+    writer.close()
+
+    assert client.calls == [["f0", "f1", "f2"], ["f1"]]
+    assert sorted(row["file_id"] for row in client.rows) == ["f0", "f1", "f2"]
+    assert writer.failed_rows() == []
+
+def test_flush_by_byte_size():
+    """バイト数の上限でバッチを分割"""
+    client = FakeBigQueryClient()
+    writer = BatchedRowWriter(client, "p.d.t", max_rows=100, max_bytes=200, max_age=60)
+    for i in range(4):
+        writer.add({"file_id": f"f{i}", "ocr_text": "x" * 80})
+    writer.close()
+
+    assert all(len(call) <= 2 for call in client.calls)
+    assert sum(len(call) for call in client.calls) == 4
+
+def test_futures_report_inserted_and_failed_rows():
+    """add() の Future は挿入できた行で完了し、再送しても挿入できなかった行は例外になる"""
+    class RejectingClient(FakeBigQueryClient):
+        def insert_rows_json(self, table_id, rows, row_ids=None):
+            errors = super().insert_rows_json(table_id, rows, row_ids)
+            if len(rows) == 1 and rows[0]["file_id"] in self.reject:
+                self.rows.pop()
+                errors.append({"index": 0, "errors": [{"reason": "invalid"}]})
+            return errors
+
+    writer = BatchedRowWriter(RejectingClient(reject={"f1"}), "p.d.t", max_rows=10, max_age=60)
+    futures = [writer.add({"file_id": f"f{i}"}, row_id=f"r{i}") for i in range(3)]
+    writer.close()
+
+    assert futures[0].result(timeout=1) == "r0"
+    assert futures[2].result(timeout=1) == "r2"
+    with pytest.raises(RuntimeError, match="f1"):
+        futures[1].result(timeout=1)
+    assert writer.stats()["failed_rows"] == 1
+    assert writer.stats()["flushed_rows"] == 2
+    assert "f1" in writer.stats()["last_error"]
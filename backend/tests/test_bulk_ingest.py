@@ -0,0 +1,49 @@
+import os
+
+from src.bulk_ingest import BulkOcrIngestor, LocalLoader, build_merge_query
+
+def make_row(file_id, processed_at="2024-01-01T00:00:00"):
+    return {"file_id": file_id, "ocr_text": f"text of {file_id}", "processed_at": processed_at,
+            "keywords": [], "is_deleted": False, "unknown_column": "dropped"}
+
+def test_commit_loads_once_and_merges_once(tmp_path):
+    """ロードジョブ1回とMERGE1回で取り込む"""
+    loader = LocalLoader()
+    ingestor = BulkOcrIngestor(loader, "p.d.file_metadata", "p.d.staging", stage_dir=str(tmp_path))
+    for i in range(1000):
+        ingestor.add(make_row(f"f{i}"))
+
+    assert ingestor.commit() == 1000
+    assert loader.load_jobs == ["p.d.staging"]
+    assert len(loader.queries) == 1
+    assert "MERGE `p.d.file_metadata`" in loader.queries[0]
+    assert os.listdir(tmp_path) == []
+
+def test_rows_are_projected_to_schema(tmp_path):
+    """スキーマ外の列は出力しない"""
+    loader = LocalLoader()
+    ingestor = BulkOcrIngestor(loader, "p.d.t", "p.d.s", stage_dir=str(tmp_path))
+    ingestor.add(make_row("f0"))
+    ingestor.commit(drop_staging=False)
+
+    row = loader.tables["p.d.s"][0]
+    assert row["file_id"] == "f0"
+    assert "unknown_column" not in row
+
+def test_segments_rotate_by_size(tmp_path):
+    """サイズ上限でステージングファイルを分割し、2回目以降は追記でロード"""
+    loader = LocalLoader()
+    ingestor = BulkOcrIngestor(loader, "p.d.t", "p.d.s", stage_dir=str(tmp_path), max_load_bytes=1)
+    for i in range(3):
+        ingestor.add(make_row(f"f{i}"))
+    ingestor.commit(drop_staging=False)
+
+    assert len(loader.load_jobs) == 3
+    assert [row["file_id"] for row in loader.tables["p.d.s"]] == ["f0", "f1", "f2"]
+
+def test_merge_query_keeps_latest_row_per_key():
+    """同一キーは最新の行のみ反映し、created_at は更新しない"""
+    query = build_merge_query("p.d.t", "p.d.s", ["file_id", "ocr_text", "created_at"])
+    assert "PARTITION BY file_id ORDER BY processed_at DESC" in query
+    assert "UPDATE SET ocr_text = S.ocr_text\n" in query
+    assert "INSERT (file_id, ocr_text, created_at)" in query
@@ -0,0 +1,218 @@
+import json
+
+import pytest
+
+from src.drive_change_feed import (
+    DispatchError, DriveChangeFeed, FileChangeDispatcher, collapse_changes, poll_response
+)
+from src.idempotency import IdempotentProcessor, MemoryIdempotencyStore
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+class FakeDrive:
+    """changes().getStartPageToken() / changes().list() を持つ Drive API のフェイク
+
+    追加した変更をページトークン（変更の位置）ごとに page_size 件ずつ返す。
+    """
+    def __init__(self):
+        self.log = []
+        self.list_calls = []
+
+    def change(self, file_id, removed=False, **file):
+        self.log.append({"changeType": "file", "fileId": file_id, "removed": removed,
+                         "file": None if removed else {"id": file_id, **file}})
+
+    def changes(self):
+        return self
+
+    def getStartPageToken(self, **params):
+        return FakeRequest({"startPageToken": str(len(self.log))})
+
+    def list(self, pageToken, pageSize, fields=None, **params):
+        self.list_calls.append((pageToken, pageSize))
+        start = int(pageToken)
+        page = self.log[start:start + pageSize]
+        response = {"changes": page}
+        if start + pageSize < len(self.log):
+            response["nextPageToken"] = str(start + pageSize)
+        else:
+            response["newStartPageToken"] = str(len(self.log))
+        return FakeRequest(response)
+
+class MemoryTokenStore:
+    def __init__(self, page_token=None):
+        self.page_token = page_token
+
+    def get(self):
+        return self.page_token
+
+    def set(self, page_token):
+        self.page_token = page_token
+
+def test_collapse_keeps_latest_change_per_file():
+    collapsed = collapse_changes([
+        {"changeType": "file", "fileId": "a", "file": {"name": "v1"}},
+        {"changeType": "drive", "driveId": "d1"},
+        {"changeType": "file", "fileId": "b", "file": {"name": "b"}},
+        {"changeType": "file", "fileId": "a", "removed": True},
+    ])
+    assert list(collapsed) == ["b", "a"]
+    assert collapsed["a"].is_deleted
+    assert not collapsed["b"].is_deleted
+
+def test_first_poll_only_saves_start_token():
+    drive, store = FakeDrive(), MemoryTokenStore()
+    drive.change("old", name="old.pdf")
+    batches = []
+    result = DriveChangeFeed(drive, store, batches.append).poll()
+
+    assert result["status"] == "initialized"
+    assert store.page_token == "1"
+    assert batches == []
+
+def test_pages_are_collapsed_and_dispatched_once():
+    drive, store = FakeDrive(), MemoryTokenStore("0")
+    for i in range(5):
+        drive.change("a", name="a.pdf", modifiedTime=f"2024-01-01T00:00:0{i}Z")
+    drive.change("b", name="b.pdf", trashed=True)
+    drive.change("c", removed=True)
+    batches = []
+    result = DriveChangeFeed(drive, store, batches.append, page_size=3).poll()
+
+    assert len(drive.list_calls) == 3
+    assert result == {"status": "success", "pages": 3, "changes": 7, "dispatched": 3, "page_token": "7"}
+    assert len(batches) == 1
+    changes = {change.file_id: change for change in batches[0]}
+    assert changes["a"].file["modifiedTime"] == "2024-01-01T00:00:04Z"
+    assert changes["b"].is_deleted and changes["c"].is_deleted
+    assert store.page_token == "7"
+
+    # 新しい変更がなければ dispatch しない
+    assert DriveChangeFeed(drive, store, batches.append).poll()["dispatched"] == 0
+    assert len(batches) == 1
+
+def test_max_pages_checkpoints_and_continues():
+    drive, store = FakeDrive(), MemoryTokenStore("0")
+    for i in range(5):
+        drive.change(f"f{i}", name=f"{i}.pdf")
+    batches = []
+    feed = DriveChangeFeed(drive, store, batches.append, page_size=2)
+
+    assert feed.poll(max_pages=1)["status"] == "more"
+    assert store.page_token == "2"
+    assert feed.poll(max_pages=10)["status"] == "success"
+    assert [[change.file_id for change in batch] for batch in batches] == [["f0", "f1"], ["f2", "f3", "f4"]]
+
+def test_failed_dispatch_does_not_advance_token():
+    drive, store = FakeDrive(), MemoryTokenStore("0")
+    drive.change("a", name="a.pdf")
+
+    def dispatch(changes):
+        raise RuntimeError("BigQuery unavailable")
+
+    with pytest.raises(RuntimeError):
+        DriveChangeFeed(drive, store, dispatch).poll()
+    assert store.page_token == "0"
+
+class FakePipeline:
+    """FileChangeDispatcher に渡す OCR・ステージング・削除のフェイク"""
+    def __init__(self):
+        self.ocr_calls = []
+        self.staged = []
+        self.deleted = []
+        self.stage_error = None
+        self.ocr_errors = set()
+
+    def run_ocr(self, file_id, file):
+        self.ocr_calls.append(file_id)
+        if file_id in self.ocr_errors:
+            raise RuntimeError(f"OCR failed: {file_id}")
+        return {"ocr_text": f"text of {file_id}"}
+
+    def stage_rows(self, rows):
+        if self.stage_error:
+            raise self.stage_error
+        self.staged.extend(rows)
+
+    def mark_deleted(self, file_ids):
+        self.deleted.extend(file_ids)
+
+    def dispatcher(self, processor):
+        return FileChangeDispatcher(
+            processor, self.run_ocr, self.stage_rows, self.mark_deleted,
+            build_row=lambda file_id, file, ocr_data: {"file_id": file_id, **(ocr_data or {})},
+            is_supported=lambda file: file.get("mimeType") == "application/pdf"
+        )
+
+def test_failed_staging_keeps_token_and_changes_are_read_again():
+    drive, store = FakeDrive(), MemoryTokenStore("0")
+    drive.change("a", mimeType="application/pdf", modifiedTime="2024-01-01T00:00:00Z")
+    drive.change("b", removed=True)
+    pipeline = FakePipeline()
+    pipeline.stage_error = RuntimeError("BigQuery unavailable")
+    feed = DriveChangeFeed(drive, store, pipeline.dispatcher(IdempotentProcessor(MemoryIdempotencyStore())))
+
+    with pytest.raises(RuntimeError):
+        feed.poll()
+    assert store.page_token == "0"
+
+    pipeline.stage_error = None
+    assert feed.poll()["dispatched"] == 2
+    assert store.page_token == "2"
+    assert pipeline.deleted == ["b", "b"]
+    assert pipeline.staged == [{"file_id": "a", "ocr_text": "text of a"}]
+    # OCR は完了したステップとして記録済みのため再実行しない
+    assert pipeline.ocr_calls == ["a"]
+
+def test_ocr_failure_fails_dispatch_after_staging_the_rest():
+    drive, store = FakeDrive(), MemoryTokenStore("0")
+    drive.change("a", mimeType="application/pdf")
+    drive.change("b", mimeType="application/pdf")
+    pipeline = FakePipeline()
+    pipeline.ocr_errors = {"b"}
+    processor = IdempotentProcessor(MemoryIdempotencyStore())
+    feed = DriveChangeFeed(drive, store, pipeline.dispatcher(processor))
+
+    with pytest.raises(DispatchError) as error:
+        feed.poll()
+    assert error.value.failed == ["b"]
+    assert store.page_token == "0"
+    assert processor.stats()["processed"] == 1
+
+    # 読み直した変更のうち処理済みの版は OCR を省き、失敗した版だけ OCR し直す
+    pipeline.ocr_errors = set()
+    feed.poll()
+    assert store.page_token == "2"
+    assert pipeline.ocr_calls.count("a") == 1
+    assert pipeline.ocr_calls.count("b") == 2
+
+def test_poll_response_reports_failure_and_released_lease_is_reclaimed():
+    drive, token_store = FakeDrive(), MemoryTokenStore("0")
+    drive.change("a", mimeType="application/pdf", modifiedTime="2024-01-01T00:00:00Z")
+    idempotency = MemoryIdempotencyStore()
+    pipeline = FakePipeline()
+    pipeline.stage_error = RuntimeError("BigQuery unavailable")
+    # poll_drive_changes と同じ組み立て（ポーリングごとにディスパッチャーを作る）
+    feed = DriveChangeFeed(
+        drive, token_store, lambda changes: pipeline.dispatcher(IdempotentProcessor(idempotency))(changes)
+    )
+
+    body, status = poll_response(feed, max_pages=10)
+    assert status == 500
+    assert "BigQuery unavailable" in body
+    assert token_store.page_token == "0"
+    record = idempotency.get("a:2024-01-01T00:00:00Z:")
+    assert record["status"] == "failed" and record["lease_expires_at"] == 0
+
+    # Cloud Scheduler の再試行で解放した処理権を取り直し、OCR の結果から再開する
+    pipeline.stage_error = None
+    body, status = poll_response(feed, max_pages=10)
+    assert status == 200
+    assert json.loads(body)["page_token"] == "1"
+    assert idempotency.get("a:2024-01-01T00:00:00Z:")["status"] == "done"
+    assert pipeline.ocr_calls == ["a"]
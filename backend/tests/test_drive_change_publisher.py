@@ -0,0 +1,108 @@
+from concurrent.futures import Future
+import json
+import os
+import socket
+import uuid
+
+import pytest
+
+from src.drive_change_publisher import DriveChangePublisher, NotificationCoalescer
+
+class FakePublisherClient:
+    """publish() で Future を返し、complete() で結果を確定させるフェイク"""
+    def __init__(self):
+        self.published = []
+        self.futures = []
+        self.resumed = []
+
+    def topic_path(self, project_id, topic):
+        return f"projects/{project_id}/topics/{topic}"
+
+    def publish(self, topic_path, data, ordering_key=""):
+        self.published.append((topic_path, json.loads(data), ordering_key))
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def resume_publish(self, topic_path, ordering_key):
+        self.resumed.append(ordering_key)
+
+def make_message(file_id, change_type="file.update"):
+    return {"file_id": file_id, "drive_id": "d1", "change_type": change_type, "timestamp": None}
+
+def test_duplicates_share_the_pending_publish():
+    client = FakePublisherClient()
+    publisher = DriveChangePublisher("p", "drive-changes", client_factory=lambda: client)
+    first = publisher.publish(make_message("a"))
+    assert publisher.publish(make_message("a")) is first
+    assert publisher.publish(make_message("a", "file.delete")) is not first
+
+    # 発行が完了した後の通知は新たに発行する（購読側が読んだ後の変更を失わない）
+    first.set_result("message-id")
+    assert publisher.publish(make_message("a")) is not first
+    assert len(client.published) == 3
+    assert publisher.stats()["coalesced"] == 1
+
+def test_client_is_created_once_and_messages_are_ordered_by_file():
+    clients = []
+
+    def factory():
+        clients.append(FakePublisherClient())
+        return clients[-1]
+
+    publisher = DriveChangePublisher("p", "drive-changes", client_factory=factory)
+    publisher.publish(make_message("a"))
+    publisher.publish(make_message("b"))
+    publisher.publish(make_message("a"))
+
+    assert len(clients) == 1
+    assert [(data["file_id"], key) for _, data, key in clients[0].published] == [("a", "a"), ("b", "b")]
+    assert clients[0].published[0][0] == "projects/p/topics/drive-changes"
+    for future in clients[0].futures:
+        future.set_result("message-id")
+    assert publisher.stats() == {"published": 2, "coalesced": 1, "failed": 0, "pending": 0}
+
+def test_failed_publish_fails_coalesced_callers_and_resumes_ordering_key():
+    client = FakePublisherClient()
+    publisher = DriveChangePublisher("p", "drive-changes", client_factory=lambda: client)
+    future = publisher.publish(make_message("a"))
+    duplicate = publisher.publish(make_message("a"))
+    future.set_exception(RuntimeError("unavailable"))
+
+    # まとめた通知の呼び出し元にも失敗が返る（Drive が再送する）
+    assert isinstance(duplicate.exception(), RuntimeError)
+    assert client.resumed == ["a"]
+    assert publisher.publish(make_message("a")) is not future
+    assert publisher.stats()["failed"] == 1
+
+def _emulator_available() -> bool:
+    host, _, port = os.getenv("PUBSUB_EMULATOR_HOST", "").partition(":")
+    try:
+        socket.create_connection((host, int(port)), timeout=0.5).close()
+        return True
+    except (OSError, ValueError):
+        return False
+
+def test_publish_to_emulator():
+    """conftest.py で設定した Pub/Sub エミュレータに順序指定キー付きで発行できる"""
+    pubsub_v1 = pytest.importorskip("google.cloud.pubsub_v1")
+    if not _emulator_available():
+        pytest.skip("Pub/Sub emulator is not running")
+
+    project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
+    topic = f"drive-changes-{uuid.uuid4().hex[:8]}"
+    admin = pubsub_v1.PublisherClient()
+    topic_path = admin.create_topic(name=admin.topic_path(project_id, topic)).name
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(project_id, topic)
+    subscriber.create_subscription(name=subscription_path, topic=topic_path, enable_message_ordering=True)
+
+    publisher = DriveChangePublisher(project_id, topic)
+    futures = [publisher.publish(make_message("a", change_type)) for change_type in ("file.update", "file.delete")]
+    for future in futures:
+        future.result(timeout=10)
+
+    response = subscriber.pull(subscription=subscription_path, max_messages=10, timeout=10)
+    received = [json.loads(m.message.data)["change_type"] for m in response.received_messages]
+    assert received == ["file.update", "file.delete"]
+    assert all(m.message.ordering_key == "a" for m in response.received_messages)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from src.drive_changes import DriveChangeBuffer, build_drive_change_merge
+
+class FakeMerge:
+    """MERGE に渡された変更を記録するフェイク（fail_times 回まで失敗する）"""
+    def __init__(self, fail_times=0):
+        self.batches = []
+        self.fail_times = fail_times
+
+    def __call__(self, changes):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("DML limit exceeded")
+        self.batches.append({change.file_id: change.change_type for change in changes})
+        return len(changes)
+
+def test_last_write_wins_in_one_merge():
+    """同じ file_id の通知は最後のものだけを1回の MERGE で反映"""
+    merge = FakeMerge()
+    buffer = DriveChangeBuffer(merge, interval=60)
+    buffer.add("a", "update")
+    buffer.add("b", "update")
+    buffer.add("a", "delete")
+    buffer.close()
+
+    assert merge.batches == [{"a": "delete", "b": "update"}]
+    assert buffer.stats()["deduplicated"] == 1
+    assert buffer.stats()["pending"] == 0
+
+def test_applied_after_interval():
+    merge = FakeMerge()
+    buffer = DriveChangeBuffer(merge, interval=0.05)
+    buffer.add("a", "update")
+    deadline = time.monotonic() + 2
+    while not merge.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert merge.batches == [{"a": "update"}]
+    buffer.close()
+
+def test_failed_merge_is_retried_with_newer_changes():
+    """失敗した変更は再試行し、その間に届いた新しい通知を優先"""
+    merge = FakeMerge(fail_times=1)
+    buffer = DriveChangeBuffer(merge, interval=60)
+    buffer.add("a", "update")
+    buffer.add("b", "update")
+    buffer.flush()
+    buffer.add("a", "delete")
+    buffer.flush()
+
+    assert merge.batches == [{"a": "delete", "b": "update"}]
+    assert buffer.stats()["failure_count"] == 1
+
+def test_merge_query_uses_key_equality():
+    query = build_drive_change_merge("p.d.file_metadata")
+    assert "ON T.file_id = S.file_id" in query
+    assert "LIKE" not in query
+
+def test_future_completes_when_change_is_merged():
+    """通知の Future は同じ MERGE に含まれた時点で完了する（上書きされた通知も含む）"""
+    merge = FakeMerge()
+    buffer = DriveChangeBuffer(merge, interval=60)
+    first = buffer.add("a", "update")
+    second = buffer.add("a", "delete")
+    assert not first.done()
+    buffer.flush()
+
+    assert first.result(timeout=1) == 1 and second.result(timeout=1) == 1
+    buffer.close()
+
+def test_failed_merge_fails_futures_and_close_reports_unmerged():
+    """反映に失敗した通知は Future を失敗させ、close() でも反映できなければ一覧を返す"""
+    merge = FakeMerge(fail_times=2)
+    buffer = DriveChangeBuffer(merge, interval=60)
+    future = buffer.add("a", "update")
+    buffer.flush()
+
+    with pytest.raises(RuntimeError, match="DML limit exceeded"):
+        future.result(timeout=1)
+    unmerged = buffer.close()
+    assert [change.file_id for change in unmerged] == ["a"]
+    assert buffer.stats()["unmerged_at_close"] == 1
+    assert buffer.stats()["pending"] == 0
@@ -0,0 +1,94 @@
+import base64
+import io
+import os
+
+import pytest
+
+from src.services.drive_upload import (
+    Base64UrlReader, detect_mime_type, sniff_mime_type, stream_digest, upload_resumable
+)
+
+def encode(content: bytes, padding: bool = False) -> str:
+    encoded = base64.urlsafe_b64encode(content).decode()
+    return encoded if padding else encoded.rstrip("=")
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 1000, 4099])
+@pytest.mark.parametrize("padding", [True, False])
+def test_reader_matches_full_decode(size, padding):
+    content = os.urandom(size)
+    reader = Base64UrlReader(encode(content, padding))
+    assert reader.seek(0, io.SEEK_END) == size
+    reader.seek(0)
+
+    chunks = []
+    while True:
+        chunk = reader.read(7)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b"".join(chunks) == content
+
+def test_reader_seek_resumes_from_offset():
+    """再開アップロードと同じく、任意の位置に戻って読み直せる"""
+    content = os.urandom(1024)
+    reader = Base64UrlReader(encode(content))
+    reader.read(500)
+    for offset in (0, 1, 256, 257, 1023):
+        reader.seek(offset)
+        assert reader.read(100) == content[offset:offset + 100]
+        assert reader.tell() == min(offset + 100, 1024)
+
+def test_stream_digest_hashes_incrementally_and_keeps_position():
+    content = os.urandom(10_000)
+    reader = Base64UrlReader(base64.urlsafe_b64encode(content).decode().rstrip("="))
+    reader.seek(7)
+    assert stream_digest(reader, chunk_size=999) == stream_digest(io.BytesIO(content))
+    assert reader.tell() == 7
+
+def test_detect_mime_type_prefers_magic_bytes():
+    assert detect_mime_type(b"%PDF-1.4\n", "fax.bin", "application/octet-stream") == "application/pdf"
+    assert detect_mime_type(b"II*\x00\x08\x00", "fax", None) == "image/tiff"
+    assert detect_mime_type(b"\xff\xd8\xff\xe0", "scan.pdf", "application/pdf") == "image/jpeg"
+    assert detect_mime_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ", "", None) == "image/webp"
+    assert detect_mime_type(b"hello", "note.txt", "application/octet-stream") == "text/plain"
+    assert detect_mime_type(b"hello", "data", "application/x-custom") == "application/x-custom"
+    assert detect_mime_type(b"hello", "data", None) == "application/octet-stream"
+
+def test_sniff_keeps_stream_position():
+    reader = Base64UrlReader(encode(b"%PDF-1.7 content"))
+    assert sniff_mime_type(reader, "x") == "application/pdf"
+    assert reader.tell() == 0
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+class FakeResumableRequest:
+    """next_chunk ごとに1チャンク進む（failures に含まれる回では失敗する）"""
+    def __init__(self, chunks, failures):
+        self.chunks = chunks
+        self.failures = failures
+        self.offset = 0
+        self.calls = 0
+
+    def next_chunk(self, num_retries=0):
+        self.calls += 1
+        if self.calls in self.failures:
+            raise self.failures[self.calls]
+        self.offset += 1
+        if self.offset == self.chunks:
+            return None, {"id": "file-1"}
+        return self.offset, None
+
+def test_upload_resumes_after_transient_errors():
+    request = FakeResumableRequest(chunks=3, failures={2: HttpError(503), 3: ConnectionError("reset")})
+    assert upload_resumable(request, retry_delay=0) == {"id": "file-1"}
+    assert request.offset == 3
+    assert request.calls == 5
+
+def test_upload_gives_up_on_permanent_errors():
+    request = FakeResumableRequest(chunks=3, failures={1: HttpError(403)})
+    with pytest.raises(HttpError):
+        upload_resumable(request, retry_delay=0)
+    assert request.calls == 1
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+import time
+
+import pytest
+
+from src.file_search import (
+    CountCache, InvalidPageToken, query_fingerprint, encode_page_token, decode_page_token, build_search_query,
+    highlight_spans, default_date_from
+)
+
+PARAMS = [("user_id", "STRING", "u1"), ("query_text", "STRING", "山田")]
+
+def test_page_token_round_trip():
+    """トークンから最後の行の (created_at, file_id) を復元"""
+    fingerprint = query_fingerprint("is_deleted = FALSE", PARAMS)
+    created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    token = encode_page_token(fingerprint, created_at, "file-42")
+
+    assert decode_page_token(token, fingerprint) == (created_at, "file-42")
+
+def test_page_token_rejects_other_query_and_garbage():
+    """別の検索条件のトークンや壊れたトークンは受け付けない"""
+    fingerprint = query_fingerprint("is_deleted = FALSE", PARAMS)
+    other = query_fingerprint("is_deleted = FALSE", [("user_id", "STRING", "u2")])
+    token = encode_page_token(fingerprint, datetime(2024, 5, 1, tzinfo=timezone.utc), "f")
+
+    with pytest.raises(InvalidPageToken):
+        decode_page_token(token, other)
+    with pytest.raises(InvalidPageToken):
+        decode_page_token("not-a-token", fingerprint)
+
+def test_fingerprint_ignores_parameter_order():
+    assert query_fingerprint("1=1", PARAMS) == query_fingerprint("1=1", list(reversed(PARAMS)))
+
+def test_search_query_uses_keyset_and_projection():
+    """カーソル指定時は OFFSET を使わず、ocr_text は指定した場合のみ取得"""
+    query = build_search_query("p.d.file_metadata", "is_deleted = FALSE", after_cursor=True)
+    assert "OFFSET" not in query
+    assert "ocr_text" not in query
+    assert "file_id < @cursor_file_id" in query
+    assert "ORDER BY created_at DESC, file_id DESC" in query
+
+    assert "ocr_text" in build_search_query("p.d.file_metadata", "1=1", include_ocr_text=True)
+
+def test_count_cache_expires():
+    """総件数は TTL を過ぎると再集計させる"""
+    cache = CountCache(ttl=0.05)
+    cache.set("q", 120)
+    assert cache.get("q") == 120
+    time.sleep(0.1)
+    assert cache.get("q") is None
+    assert cache.stats()["hits"] == 1
+
+def test_highlight_spans_map_back_to_snippet():
+    """正規化して照合し、スニペット上の位置で返す"""
+    snippet = "申請者：ヤマダ　タロウ様、担当 やまだたろう"
+    spans = highlight_spans(snippet, "やまだ たろう")
+
+    assert [snippet[start:end] for start, end in spans] == ["ヤマダ　タロウ", "やまだたろう"]
+    assert highlight_spans("", "山田") == []
+
+def test_search_query_snippet_replaces_full_text():
+    query = build_search_query("p.d.file_metadata", "CONTAINS_SUBSTR(ocr_text, @query_text)", snippet=True)
+    assert "AS snippet" in query
+    assert "SELECT ocr_text" not in query and ", ocr_text," not in query
+
+def test_ranked_search_query_orders_by_index_rank():
+    """全文検索インデックスの順位で並べ、カーソルは順位で指定"""
+    query = build_search_query("p.d.file_metadata", "file_id IN UNNEST(@index_file_ids)", ranked=True, after_cursor=True)
+    assert "WITH OFFSET AS hit_rank" in query
+    assert "hit_rank > @cursor_rank" in query
+    assert "ORDER BY hit_rank" in query
+
+def test_default_date_from_is_stable_within_a_day():
+    """期間未指定時の下限は日付の境界に丸め、同じ日の検索条件を変えない"""
+    morning = datetime(2024, 5, 10, 1, 0, tzinfo=timezone.utc)
+    evening = datetime(2024, 5, 10, 23, 0, tzinfo=timezone.utc)
+
+    assert default_date_from(30, morning) == default_date_from(30, evening)
+    assert default_date_from(30, morning) == datetime(2024, 4, 10, tzinfo=timezone.utc)
+    assert default_date_from(0, evening) == evening - timedelta(hours=23)
+
+def test_cursor_predicate_prunes_partitions():
+    """カーソル条件に created_at の単独の上限を含める"""
+    query = build_search_query("p.d.file_metadata", "created_at >= @date_from", after_cursor=True)
+    assert "created_at <= @cursor_created_at AND" in query
@@ -0,0 +1,228 @@
+import base64
+
+from src.services.drive_upload import open_attachment
+from src.services.gmail_ingestion import GmailIngestor, iter_attachments
+
+def encode(content: bytes) -> str:
+    return base64.urlsafe_b64encode(content).decode().rstrip("=")
+
+class FakeRequest:
+    """execute() のたびに結果を求める（再試行で同じリクエストを再実行できる）"""
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        result = self.result() if callable(self.result) else self.result
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.gmail.batch_sizes.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+class FakeGmail:
+    """users().history() / messages() / attachments() と new_batch_http_request() のフェイク"""
+    def __init__(self, history_pages, message_data, attachment_data):
+        self.history_pages = history_pages
+        self.message_data = message_data
+        self.attachment_data = attachment_data
+        self.history_calls = []
+        self.batch_sizes = []
+        self.attachment_failures = {}
+
+    def users(self):
+        return self
+
+    def history(self):
+        return FakeHistory(self)
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes, maxResults, pageToken=None):
+        self.gmail.history_calls.append((startHistoryId, pageToken))
+        return FakeRequest(self.gmail.history_pages[pageToken])
+
+class FakeMessages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def get(self, userId, id, fields=None):
+        return FakeRequest(self.gmail.message_data[id])
+
+    def attachments(self):
+        return FakeAttachments(self.gmail)
+
+class FakeAttachments:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def get(self, userId, messageId, id):
+        def result():
+            if self.gmail.attachment_failures.get(id, 0):
+                self.gmail.attachment_failures[id] -= 1
+                return RuntimeError("rateLimitExceeded")
+            return {"data": self.gmail.attachment_data[id]}
+        return FakeRequest(result)
+
+class MemoryStore:
+    def __init__(self, history_id=None):
+        self.history_id = history_id
+        self.messages = set()
+        self.attachments = {}
+        self.failures = {}
+        self.dead_letters = set()
+
+    def get_history_id(self):
+        return self.history_id
+
+    def set_history_id(self, history_id):
+        self.history_id = history_id
+
+    def unseen_messages(self, message_ids):
+        return [message_id for message_id in message_ids if message_id not in self.messages]
+
+    def mark_messages(self, message_ids):
+        self.messages.update(message_ids)
+
+    def record_failures(self, message_ids):
+        for message_id in message_ids:
+            self.failures[message_id] = self.failures.get(message_id, 0) + 1
+        return {message_id: self.failures[message_id] for message_id in message_ids}
+
+    def dead_letter(self, message_ids):
+        self.dead_letters.update(message_ids)
+        self.messages.update(message_ids)
+
+    def find_attachments(self, digests):
+        return {digest: self.attachments[digest]["drive_file_id"] for digest in digests if digest in self.attachments}
+
+    def record_attachments(self, saved):
+        self.attachments.update(saved)
+
+def make_message(message_id, *attachment_ids):
+    return {"id": message_id, "payload": {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "text/plain", "filename": "", "body": {"data": encode(b"body")}},
+        *[{"mimeType": "application/pdf", "filename": f"{attachment_id}.pdf", "body": {"attachmentId": attachment_id}}
+          for attachment_id in attachment_ids]
+    ]}}
+
+def make_gmail():
+    history_pages = {
+        None: {"history": [{"messagesAdded": [{"message": {"id": "m1"}}, {"message": {"id": "m2"}}]}],
+               "nextPageToken": "p2", "historyId": "150"},
+        "p2": {"history": [{"messagesAdded": [{"message": {"id": "m2"}}, {"message": {"id": "m3"}}]}],
+               "historyId": "200"},
+    }
+    messages = {"m1": make_message("m1", "a1"), "m2": make_message("m2", "a2"), "m3": make_message("m3", "a3", "a4")}
+    attachments = {"a1": encode(b"%PDF fax 1"), "a2": encode(b"%PDF fax 2"), "a3": encode(b"%PDF fax 1"),
+                   "a4": encode(b"%PDF fax 4")}
+    return FakeGmail(history_pages, messages, attachments)
+
+class FakeDrive:
+    def __init__(self):
+        self.saved = []
+
+    def save(self, attachments, folder_id):
+        results = []
+        for data, filename, mime_type in attachments:
+            # 本番と同じく base64url の文字列を逐次デコードして読む
+            assert isinstance(data, str)
+            self.saved.append((open_attachment(data).read(), filename, folder_id, mime_type))
+            results.append(f"drive-{len(self.saved)}")
+        return results
+
+def test_iter_attachments_walks_nested_parts():
+    message = {"id": "m1", "payload": {"parts": [
+        {"filename": "", "parts": [{"filename": "scan.pdf", "mimeType": "application/pdf", "body": {"attachmentId": "a1"}}]},
+        {"filename": "inline.txt", "mimeType": "text/plain", "body": {"data": encode(b"x")}},
+    ]}}
+    attachments = list(iter_attachments(message))
+    assert [(a.filename, a.attachment_id, a.data is not None) for a in attachments] == [
+        ("inline.txt", None, True), ("scan.pdf", "a1", False)
+    ]
+
+def test_pages_through_history_and_dedups_by_content():
+    gmail, drive, store = make_gmail(), FakeDrive(), MemoryStore(history_id="100")
+    ingestor = GmailIngestor(gmail, store, drive.save, folder_id="folder", batch_size=2)
+    result = ingestor.process_notification("210")
+
+    assert gmail.history_calls == [("100", None), ("100", "p2")]
+    assert result["messages"] == 3
+    assert result["attachments_saved"] == 3
+    assert result["attachments_skipped"] == 1
+    assert sorted(content for content, _, _, _ in drive.saved) == [b"%PDF fax 1", b"%PDF fax 2", b"%PDF fax 4"]
+    assert all(folder == "folder" and mime == "application/pdf" for _, _, folder, mime in drive.saved)
+    assert max(gmail.batch_sizes) == 2
+    assert store.history_id == "200"
+
+def test_seen_messages_are_skipped_on_redelivery():
+    gmail, drive, store = make_gmail(), FakeDrive(), MemoryStore(history_id="100")
+    ingestor = GmailIngestor(gmail, store, drive.save, folder_id="folder")
+    ingestor.process_notification("210")
+    store.history_id = "100"
+    result = ingestor.process_notification("210")
+
+    assert result["messages"] == 0
+    assert len(drive.saved) == 3
+
+def test_failed_attachment_keeps_checkpoint_and_is_retried():
+    gmail, drive, store = make_gmail(), FakeDrive(), MemoryStore(history_id="100")
+    gmail.attachment_failures["a4"] = 10
+    ingestor = GmailIngestor(gmail, store, drive.save, folder_id="folder", max_retries=1, retry_delay=0)
+    result = ingestor.process_notification("210")
+
+    assert result["status"] == "partial"
+    assert store.history_id == "100"
+    assert "m3" not in store.messages
+
+    gmail.attachment_failures["a4"] = 1
+    result = ingestor.process_notification("210")
+    assert result["status"] == "success"
+    assert result["messages"] == 1
+    assert store.history_id == "200"
+    assert len(drive.saved) == 3
+
+def test_message_failing_repeatedly_is_dead_lettered_and_checkpoint_advances():
+    gmail, drive, store = make_gmail(), FakeDrive(), MemoryStore(history_id="100")
+    gmail.attachment_failures["a4"] = 100
+    ingestor = GmailIngestor(gmail, store, drive.save, folder_id="folder", max_retries=0, retry_delay=0,
+                             max_message_attempts=2)
+
+    assert ingestor.process_notification("210")["status"] == "partial"
+    assert store.history_id == "100"
+
+    result = ingestor.process_notification("210")
+    assert result["status"] == "success"
+    assert result["dead_lettered"] == 1
+    assert store.dead_letters == {"m3"}
+    assert store.history_id == "200"
+
+def test_first_notification_only_sets_checkpoint():
+    gmail, drive, store = make_gmail(), FakeDrive(), MemoryStore()
+    result = GmailIngestor(gmail, store, drive.save, folder_id="folder").process_notification("210")
+
+    assert result["status"] == "initialized"
+    assert store.history_id == "210"
+    assert gmail.history_calls == []
@@ -0,0 +1,97 @@
+import pytest
+
+from src.idempotency import (
+    IdempotentProcessor, MemoryIdempotencyStore, MAX_STEP_BYTES, processing_key
+)
+
+def test_processing_key_changes_with_version():
+    v1 = {"modifiedTime": "2024-01-01T00:00:00Z", "md5Checksum": "aaa"}
+    v2 = {"modifiedTime": "2024-01-01T00:00:05Z", "md5Checksum": "bbb"}
+    assert processing_key("f1", v1) == processing_key("f1", dict(v1))
+    assert processing_key("f1", v1) != processing_key("f1", v2)
+    assert processing_key("f1", v1) != processing_key("f2", v1)
+
+def test_processed_version_is_skipped():
+    processor = IdempotentProcessor(MemoryIdempotencyStore())
+    calls = []
+    for _ in range(3):
+        processor.run("f1:v1", lambda context: calls.append(context.step("ocr", lambda: "text")))
+
+    assert calls == ["text"]
+    assert processor.stats()["processed"] == 1
+    assert processor.stats()["skipped_done"] == 2
+
+def test_in_flight_version_is_skipped_until_lease_expires():
+    store = MemoryIdempotencyStore()
+    first = IdempotentProcessor(store, lease_seconds=60).claim("f1:v1")
+    assert first is not None
+    second = IdempotentProcessor(store, lease_seconds=60)
+    assert second.claim("f1:v1") is None
+    assert second.stats()["skipped_in_flight"] == 1
+
+    # 中断した処理（リース切れ）は引き継ぐ
+    store.get("f1:v1")["lease_expires_at"] = 0
+    assert second.claim("f1:v1") is not None
+    assert store.get("f1:v1")["attempts"] == 2
+
+def test_failed_run_resumes_from_completed_steps():
+    store = MemoryIdempotencyStore()
+    processor = IdempotentProcessor(store)
+    ocr_calls = []
+
+    def ocr():
+        ocr_calls.append(1)
+        return {"ocr_text": "山田", "matched_user_ids": ["u1"]}
+
+    def failing(context):
+        context.step("ocr", ocr)
+        context.step("stage", lambda: (_ for _ in ()).throw(RuntimeError("BigQuery unavailable")))
+
+    with pytest.raises(RuntimeError):
+        processor.run("f1:v1", failing)
+    assert store.get("f1:v1")["status"] == "failed"
+
+    staged = []
+    assert processor.run("f1:v1", lambda context: staged.append(context.step("ocr", ocr))) == "processed"
+    assert len(ocr_calls) == 1
+    assert staged == [{"ocr_text": "山田", "matched_user_ids": ["u1"]}]
+    assert processor.stats() == {
+        "processed": 1, "skipped_done": 0, "skipped_in_flight": 0, "resumed_steps": 1, "failed": 1,
+        "lost_leases": 0
+    }
+
+def test_large_step_results_are_recomputed_on_resume():
+    store = MemoryIdempotencyStore()
+    processor = IdempotentProcessor(store)
+    calls = []
+
+    def ocr():
+        calls.append(1)
+        return "x" * (MAX_STEP_BYTES + 1)
+
+    context = processor.claim("f1:v1")
+    context.step("ocr", ocr)
+    context.fail(RuntimeError("interrupted"))
+    processor.claim("f1:v1").step("ocr", ocr)
+    assert len(calls) == 2
+
+def test_stale_owner_cannot_write_after_reclaim():
+    store = MemoryIdempotencyStore()
+    stale = IdempotentProcessor(store, lease_seconds=60)
+    stale_context = stale.claim("f1:v1")
+
+    # リース切れで別のインスタンスが引き継ぐ
+    store.get("f1:v1")["lease_expires_at"] = 0
+    current = IdempotentProcessor(store, lease_seconds=60)
+    current_context = current.claim("f1:v1")
+
+    stale_context.step("ocr", lambda: "stale")
+    assert not stale_context.finish()
+    stale_context.fail(RuntimeError("late failure"))
+    assert store.get("f1:v1")["status"] == "in_progress"
+    assert store.get("f1:v1")["steps"] == {}
+    assert stale.stats()["lost_leases"] == 3
+    assert stale.stats()["processed"] == 0
+
+    assert current_context.finish()
+    assert store.get("f1:v1")["status"] == "done"
@@ -0,0 +1,66 @@
+import pytest
+
+from src.matcher import NameMatcher
+
+USERS = [
+    ("u1", {"standardized_name": "山田 太郎", "alternate_names": ["ヤマダ タロウ"]}),
+    ("u2", {"standardized_name": "田中 花子", "alternate_names": ["たなか はなこ", "花子"]}),
+    ("u3", {"standardized_name": "太郎", "alternate_names": []}),
+]
+
+def test_find_all_returns_offsets():
+    """全ての出現を文字位置付きで返す"""
+    matcher = NameMatcher(USERS)
+    text = "申請者：山田 太郎\n担当：田中 花子"
+    matches = matcher.find_all(text)
+
+    found = {(m.user_id, m.name) for m in matches}
+    assert found == {("u1", "山田 太郎"), ("u3", "太郎"), ("u2", "田中 花子"), ("u2", "花子")}
+    for m in matches:
+        assert text[m.start:m.end] == m.name
+
+def test_match_is_compatible_with_check_firestore_match():
+    """check_firestore_match と同じ戻り値形式（ユーザーの dict には user_id を含める）"""
+    matcher = NameMatcher(USERS)
+
+    assert matcher.match("山田 太郎様") == (True, {**USERS[0][1], "user_id": "u1"}, ["standardized_name"])
+    assert matcher.match("たなか はなこ") == (True, {**USERS[1][1], "user_id": "u2"}, ["たなか はなこ"])
+    assert matcher.match("該当なし") == (False, None, [])
+
+def test_matched_user_fills_ocr_row():
+    """照合結果をそのまま file_metadata の行にできる（user_id を KeyError にしない）"""
+    pytest.importorskip("google.cloud.vision")
+    pytest.importorskip("google.cloud.documentai")
+    from src.utils import build_ocr_row
+
+    has_match, matched_user, matched_names = NameMatcher(USERS).match("申請者：田中 花子")
+    row = build_ocr_row("uploads/doc.pdf", "申請者：田中 花子", matched_user, matched_names)
+
+    assert has_match
+    assert row["user_id"] == "u2"
+    assert row["matched_name"] == "田中 花子"
+    assert row["matched_alternate_names"] == ["standardized_name"]
+
+def test_rebuild_in_place():
+    """build() の再実行で照合対象を差し替え"""
+    matcher = NameMatcher(USERS)
+    matcher.build([("u9", {"standardized_name": "佐藤 一郎"})])
+
+    assert matcher.find_all("山田 太郎") == []
+    assert [m.user_id for m in matcher.find_all("佐藤 一郎")] == ["u9"]
+
+def test_match_across_line_breaks_and_widths():
+    """改行・全角半角・カタカナ表記の揺れを吸収し、元テキスト上の位置を返す"""
+    matcher = NameMatcher(USERS)
+    text = "申請者：山田\n太郎\n担当：ﾀﾅｶ ﾊﾅｺ"
+    matches = matcher.find_all(text)
+
+    assert [(m.user_id, text[m.start:m.end]) for m in matches if m.field == "standardized_name"] == [
+        ("u1", "山田\n太郎"), ("u3", "太郎")
+    ]
+    assert ("u2", "ﾀﾅｶ ﾊﾅｺ") in [(m.user_id, text[m.start:m.end]) for m in matches]
+
+def test_raw_matching_without_normalization():
+    """normalized=False では従来どおり完全一致で照合"""
+    matcher = NameMatcher(USERS, normalized=False)
+    assert matcher.find_all("山田\n太郎")[0].name == "太郎"
@@ -0,0 +1,16 @@
+from src.normalize import normalize, normalize_with_offsets
+
+def test_normalize_folds_width_kana_and_whitespace():
+    """NFKC・カタカナのひらがな化・空白改行の除去"""
+    assert normalize("ヤマダ　タロウ") == "やまだたろう"
+    assert normalize("ｶﾞｸｾｲ") == "がくせい"
+    assert normalize("山田\n 太郎") == "山田太郎"
+    assert normalize("ＴＡＲＯ Yamada") == "taroyamada"
+
+def test_offsets_map_back_to_original():
+    """正規化後の範囲を元テキストの範囲に戻せる"""
+    text = "氏名: ﾔﾏﾀﾞ\n太郎"
+    source = normalize_with_offsets(text)
+    start = source.text.index("やまだ太郎")
+    orig_start, orig_end = source.span(start, start + len("やまだ太郎"))
+    assert text[orig_start:orig_end] == "ﾔﾏﾀﾞ\n太郎"
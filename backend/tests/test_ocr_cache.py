@@ -0,0 +1,38 @@
+from src.ocr_cache import OcrResultCache, DiskCacheBackend, cache_key
+
+def test_hit_skips_ocr():
+    """同じ内容・同じエンジンならOCRを呼ばない"""
+    cache = OcrResultCache()
+    calls = []
+
+    def ocr():
+        calls.append(1)
+        return "山田 太郎"
+
+    assert cache.get_or_compute(b"scan", "vision", "v1", ocr) == "山田 太郎"
+    assert cache.get_or_compute(b"scan", "vision", "v1", ocr) == "山田 太郎"
+    assert cache.get_or_compute(b"scan", "vision", "v2", ocr) == "山田 太郎"
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_lru_eviction():
+    """上限を超えると最も古く使われたものから破棄"""
+    cache = OcrResultCache(max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats()["evictions"] == 1
+
+def test_disk_backend_survives_restart(tmp_path):
+    """永続層の結果は新しいキャッシュインスタンスでも利用できる"""
+    key = cache_key(b"scan", "document_ai", "proc/default")
+    OcrResultCache(backend=DiskCacheBackend(str(tmp_path))).set(key, "申請書")
+
+    cache = OcrResultCache(backend=DiskCacheBackend(str(tmp_path)))
+    assert cache.get(key) == "申請書"
+    assert cache.stats()["backend_hits"] == 1
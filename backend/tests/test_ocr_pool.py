@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.ocr_pool import OcrExecutor, QueueFullError
+
+def test_stage_concurrency_is_bounded():
+    """ステージごとの同時実行数を超えない"""
+    executor = OcrExecutor(max_workers=8, stage_limits={"ocr": 2})
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def slow_ocr():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    async def main():
+        await asyncio.gather(*(executor.run("ocr", slow_ocr) for _ in range(6)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert executor.stats()["stages"]["ocr"]["completed"] == 6
+    executor.shutdown()
+
+def test_reserve_rejects_when_full():
+    """受付上限を超えると QueueFullError（Retry-After 付き）"""
+    executor = OcrExecutor(max_pending=2)
+    executor.reserve(2)
+    with pytest.raises(QueueFullError) as e:
+        executor.reserve()
+    assert e.value.retry_after >= 1
+    assert executor.stats()["rejected"] == 1
+
+    executor.release(2)
+    executor.reserve(2)
+    executor.shutdown()
+
+def test_slot_releases_on_error():
+    """処理が失敗しても受付枠を解放する"""
+    executor = OcrExecutor(max_pending=1)
+
+    def failing():
+        raise ValueError("OCR failed")
+
+    async def main():
+        async with executor.slot():
+            await executor.run("ocr", failing)
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert executor.pending == 0
+    assert executor.stats()["stages"]["ocr"]["failed"] == 1
+    executor.shutdown()
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.page_ocr import ocr_pages_with_fallback, merge_pages
+
+PAGES = {1: "申請者 山田 太郎", 2: "かすれて読めない", 3: "担当 田中 花子", 4: "", 5: "備考", 6: "署名 山田 太郎", 7: "不鮮明"}
+
+class FakeVisionClient:
+    """ページ番号に対応するテキストを返すフェイク"""
+    def __init__(self, file_error=""):
+        self.requested_pages = []
+        self.inputs = []
+        self.file_error = file_error
+
+    def batch_annotate_files(self, requests):
+        pages = requests[0]["pages"]
+        self.requested_pages.append(pages)
+        self.inputs.append(requests[0]["input_config"])
+        responses = [
+            SimpleNamespace(
+                error=SimpleNamespace(message=""),
+                context=SimpleNamespace(page_number=page),
+                full_text_annotation=SimpleNamespace(text=PAGES[page])
+            )
+            for page in pages if page in PAGES
+        ]
+        if self.file_error:
+            return SimpleNamespace(responses=[SimpleNamespace(
+                error=SimpleNamespace(message=self.file_error), total_pages=0, responses=[]
+            )])
+        return SimpleNamespace(responses=[SimpleNamespace(
+            error=SimpleNamespace(message=""), total_pages=len(PAGES), responses=responses
+        )])
+
+class FakeDocumentAiClient:
+    """指定ページのみを処理し、ページごとのテキスト範囲を返すフェイク"""
+    def __init__(self):
+        self.requested_pages = []
+        self.requests = []
+
+    def process_document(self, request):
+        pages = request["process_options"]["individual_page_selector"]["pages"]
+        self.requested_pages.append(pages)
+        self.requests.append(request)
+        text = ""
+        doc_pages = []
+        for page in pages:
+            page_text = f"docai page {page}"
+            segment = SimpleNamespace(start_index=len(text), end_index=len(text) + len(page_text))
+            doc_pages.append(SimpleNamespace(
+                page_number=page,
+                layout=SimpleNamespace(text_anchor=SimpleNamespace(text_segments=[segment]))
+            ))
+            text += page_text
+        return SimpleNamespace(document=SimpleNamespace(text=text, pages=doc_pages))
+
+def test_only_unmatched_pages_go_to_document_ai():
+    """照合できなかったページのみ Document AI で再処理"""
+    vision = FakeVisionClient()
+    docai = FakeDocumentAiClient()
+    result = ocr_pages_with_fallback(
+        vision, docai, "projects/p/locations/us/processors/x", b"%PDF", "application/pdf",
+        has_match=lambda text: "山田" in text or "田中" in text
+    )
+
+    assert vision.requested_pages == [[1, 2, 3, 4, 5], [6, 7]]
+    assert docai.requested_pages == [[2, 4, 5, 7]]
+    assert [page.engine for page in result.pages] == [
+        "vision_api", "document_ai", "vision_api", "document_ai", "document_ai", "vision_api", "document_ai"
+    ]
+
+def test_merged_text_keeps_page_offsets():
+    """結合後テキスト上の各ページの範囲を保持"""
+    result = merge_pages({2: ("二頁", "document_ai"), 1: ("一頁目", "vision_api")})
+
+    assert result.text == "一頁目\f二頁"
+    for page in result.pages:
+        assert result.text[page.start:page.end] == page.text
+    assert result.page_at(result.text.index("二")).page_number == 2
+
+def test_file_level_error_raises_instead_of_returning_no_pages():
+    """ファイル全体の失敗は空の結果にしない（キャッシュされないよう例外にする）"""
+    with pytest.raises(Exception, match="Invalid PDF"):
+        ocr_pages_with_fallback(
+            FakeVisionClient(file_error="Invalid PDF"), FakeDocumentAiClient(),
+            "projects/p/locations/us/processors/x", b"%PDF", "application/pdf", has_match=lambda text: True
+        )
+
+def test_gcs_uri_is_referenced_instead_of_resending_content():
+    """Cloud Storage 上のファイルはページ範囲ごとのリクエストで内容を送らず URI を参照させる"""
+    vision = FakeVisionClient()
+    docai = FakeDocumentAiClient()
+    ocr_pages_with_fallback(
+        vision, docai, "projects/p/locations/us/processors/x", b"%PDF", "application/pdf",
+        has_match=lambda text: "山田" in text, gcs_uri="gs://bucket/doc.pdf"
+    )
+
+    assert vision.inputs == [{"gcs_source": {"uri": "gs://bucket/doc.pdf"}, "mime_type": "application/pdf"}] * 2
+    assert all("raw_document" not in request for request in docai.requests)
+    assert docai.requests[0]["gcs_document"]["gcs_uri"] == "gs://bucket/doc.pdf"
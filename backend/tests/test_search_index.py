@@ -0,0 +1,86 @@
+from src.search_index import SearchIndex, Segment, tokenize, keywords
+
+DOCS = {
+    "a": "申請者 山田太郎 様 請求書",
+    "b": "担当：ヤマダ　花子　見積書",
+    "c": "山田太郎 山田太郎 山田太郎 領収書",
+    "d": "田中 一郎 請求書",
+}
+
+def build(tmp_path, **kwargs) -> SearchIndex:
+    index = SearchIndex(str(tmp_path), **kwargs)
+    for file_id, text in DOCS.items():
+        index.add(file_id, text)
+    return index
+
+def test_tokenize_bigrams_normalized_japanese():
+    """正規化後の文字 bigram に分割（空白除去・カタカナはひらがなに統一）"""
+    assert tokenize("ヤマダ 太郎") == ["やま", "まだ", "だ太", "太郎"]
+    assert tokenize("山") == ["山"]
+    assert "山田" in keywords("山田太郎 山田花子")
+
+def test_phrase_search_and_ranking(tmp_path):
+    """検索語を連続して含む文書のみを、出現回数の多い順に返す"""
+    index = build(tmp_path)
+    hits = index.search("山田太郎")
+
+    assert [hit.file_id for hit in hits] == ["c", "a"]
+    assert [hit.file_id for hit in index.search("やまだ")] == ["b"]
+    assert {hit.file_id for hit in index.search("請求書 田中")} == {"d"}
+    assert index.search("太田") == []
+
+def test_buffer_segment_is_updated_incrementally(tmp_path):
+    """未書き出し分のセグメントは作り直さず、追加・置き換え・削除を差分で反映する"""
+    index = build(tmp_path)
+    index.search("山田")
+    buffer_segment = index._all_segments()[-1]
+
+    index.add("e", "山田 次郎")
+    index.add("a", "見積書")
+    index.delete("c")
+    assert index._all_segments()[-1] is buffer_segment
+    assert {hit.file_id for hit in index.search("山田")} == {"e"}
+    assert {hit.file_id for hit in index.search("見積書")} == {"a", "b"}
+    assert buffer_segment.postings("領収") == []
+
+    # 書き出したセグメントも差分で作ったものと同じ結果になる
+    index.flush()
+    assert {hit.file_id for hit in index.search("山田")} == {"e"}
+    assert {hit.file_id for hit in SearchIndex(str(tmp_path)).search("見積書")} == {"a", "b"}
+
+def test_keywords_are_most_frequent_alphanumeric_bigrams():
+    """file_metadata.keywords の形式：正規化した文字 bigram を出現回数順に最大 limit 件（記号を含むものは除く）"""
+    assert keywords("山田太郎 山田花子") == ["山田", "田太", "太郎", "郎山", "田花", "花子"]
+    assert keywords("ヤマダ・やまだ", limit=2) == ["やま", "まだ"]
+    assert keywords("") == []
+    assert len(keywords("".join(chr(0x4E00 + i) for i in range(100)))) == 50
+
+def test_single_character_query(tmp_path):
+    index = build(tmp_path)
+    assert {hit.file_id for hit in index.search("書")} == {"a", "b", "c", "d"}
+
+def test_segments_persist_and_merge(tmp_path):
+    """書き出したセグメントを再読み込みでき、削除・更新はマージ後も反映される"""
+    index = build(tmp_path, max_buffer_docs=2)
+    index.add("a", "更新後の本文")
+    index.delete("d")
+    index.flush()
+
+    reopened = SearchIndex(str(tmp_path))
+    assert reopened.stats()["segments"] == 3
+    assert [hit.file_id for hit in reopened.search("山田太郎")] == ["c"]
+    assert reopened.search("田中") == []
+
+    reopened.merge()
+    assert reopened.stats()["segments"] == 1
+    assert reopened.stats()["documents"] == 3
+    assert [hit.file_id for hit in SearchIndex(str(tmp_path)).search("更新後")] == ["a"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["manifest.json", "segment-000004.idx"]
+
+def test_segment_round_trip(tmp_path):
+    segment = Segment.build("s.idx", DOCS)
+    segment.write(str(tmp_path / "s.idx"))
+    loaded = Segment.read(str(tmp_path / "s.idx"))
+
+    assert loaded.docs == segment.docs
+    assert loaded.postings("山田") == segment.postings("山田")
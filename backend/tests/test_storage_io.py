@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+import hashlib
+
+from src.storage_io import StoredFile, PeakRssMonitor
+
+class FakeBlob:
+    """範囲指定の読み込み要求を記録するフェイク"""
+    def __init__(self, data, md5_hash="bWQ1", crc32c="Y3Jj"):
+        self.bucket = SimpleNamespace(name="bucket")
+        self.name = "scans/doc.pdf"
+        self.content_type = "application/pdf"
+        self.size = len(data)
+        self.md5_hash = md5_hash
+        self.crc32c = crc32c
+        self.data = data
+        self.ranges = []
+
+    def download_as_bytes(self, start=None, end=None):
+        self.ranges.append((start, end))
+        return self.data[start:end + 1]
+
+def test_small_file_is_read_in_chunks():
+    """上限以下のファイルは分割して読み込み、SHA-256 を計算"""
+    data = bytes(range(256)) * 40
+    blob = FakeBlob(data)
+    with StoredFile.from_blob(blob, inline_limit=1024 * 1024, chunk_size=4096, spool_memory=1024) as stored:
+        assert stored.inline
+        assert stored.read() == data
+        assert stored.digest == hashlib.sha256(data).hexdigest()
+        assert stored.gcs_uri == "gs://bucket/scans/doc.pdf"
+    assert blob.ranges == [(0, 4095), (4096, 8191), (8192, 10239)]
+
+def test_large_file_is_not_downloaded():
+    """上限を超えるファイルは読み込まず、チェックサムから digest を作る"""
+    blob = FakeBlob(b"x" * 5000)
+    stored = StoredFile.from_blob(blob, inline_limit=1000)
+
+    assert not stored.inline
+    assert stored.read() is None
+    assert stored.digest == "md5-bWQ1"
+    assert blob.ranges == []
+
+def test_from_bytes_matches_blob_digest():
+    """バイト列から作った場合も同じ内容なら同じ digest になる"""
+    data = b"%PDF-1.7 sample"
+    assert StoredFile.from_bytes(data, "application/pdf").digest == \
+        StoredFile.from_blob(FakeBlob(data), inline_limit=1024).digest
+
+def test_peak_rss_monitor():
+    """処理中の常駐メモリの最大値を計測"""
+    with PeakRssMonitor(interval=0.01) as monitor:
+        buffer = bytearray(32 * 1024 * 1024)
+        buffer[::4096] = b"x" * len(buffer[::4096])
+    del buffer
+
+    assert monitor.peak_bytes >= monitor.start_bytes > 0
+    assert monitor.increase_bytes >= 16 * 1024 * 1024
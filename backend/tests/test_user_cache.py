@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from src.user_cache import UserMasterCache
+
+def make_change(change_type, user_id, user_data=None):
+    document = SimpleNamespace(id=user_id, to_dict=lambda: user_data)
+    return SimpleNamespace(type=SimpleNamespace(name=change_type), document=document)
+
+def test_snapshot_deltas_are_applied():
+    """追加・更新・論理削除・物理削除を差分として反映"""
+    cache = UserMasterCache(db=None)
+    cache._on_snapshot(None, [
+        make_change("ADDED", "u1", {"standardized_name": "山田 太郎", "is_deleted": False}),
+        make_change("ADDED", "u2", {"standardized_name": "田中 花子", "is_deleted": False}),
+    ], None)
+    assert [user_id for user_id, _ in cache.active_users()] == ["u1", "u2"]
+    version = cache.version
+
+    cache._on_snapshot(None, [
+        make_change("MODIFIED", "u1", {"standardized_name": "山田 太郎", "is_deleted": True}),
+        make_change("REMOVED", "u2"),
+    ], None)
+    assert cache.active_users() == []
+    assert cache.get("u1")["is_deleted"] is True
+    assert cache.get("u1", include_deleted=False) is None
+    assert cache.get("u2") is None
+    assert cache.version == version + 2
+
+def test_unchanged_data_does_not_bump_version():
+    """内容が同じ差分では version を進めない"""
+    cache = UserMasterCache(db=None)
+    cache.apply_change("ADDED", "u1", {"standardized_name": "山田 太郎"})
+    version = cache.version
+    cache.apply_change("MODIFIED", "u1", {"standardized_name": "山田 太郎"})
+    cache.apply_change("REMOVED", "u9")
+    assert cache.version == version
+
+def test_subscribers_and_stats():
+    """変更通知と統計情報"""
+    cache = UserMasterCache(db=None)
+    received = []
+    cache.subscribe(lambda user_id, user_data: received.append((user_id, user_data)))
+    assert cache.staleness() is None
+
+    cache.apply_change("ADDED", "u1", {"standardized_name": "山田 太郎"})
+    cache.apply_change("REMOVED", "u1")
+
+    assert received == [("u1", {"standardized_name": "山田 太郎"}), ("u1", None)]
+    stats = cache.stats()
+    assert stats["user_count"] == 0
+    assert stats["listening"] is False
+    assert stats["staleness_seconds"] >= 0
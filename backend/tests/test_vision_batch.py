@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import json
+
+import pytest
+
+from src.vision_batch import VisionBatcher, VisionBatchError, annotate_file_async
+
+class FakeVisionClient:
+    """画像の内容をそのままOCR結果として返すフェイク"""
+    def __init__(self):
+        self.batch_sizes = []
+        self.file_requests = []
+
+    def batch_annotate_images(self, requests):
+        self.batch_sizes.append(len(requests))
+        responses = []
+        for request in requests:
+            content = request["image"]["content"].decode("utf-8")
+            error = SimpleNamespace(message="bad image" if content == "broken" else "")
+            annotations = [SimpleNamespace(description=content)] if content else []
+            responses.append(SimpleNamespace(error=error, text_annotations=annotations))
+        return SimpleNamespace(responses=responses)
+
+    def async_batch_annotate_files(self, requests):
+        self.file_requests.extend(requests)
+        return SimpleNamespace(result=lambda timeout=None: None)
+
+class FakeBlob:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.deleted = False
+
+    def download_as_bytes(self):
+        return self.data
+
+    def delete(self):
+        self.deleted = True
+
+class FakeStorageClient:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def list_blobs(self, bucket_name, prefix=""):
+        return [blob for blob in self.blobs if blob.name.startswith(prefix)]
+
+def test_concurrent_images_are_batched():
+    """並行して投入された画像を1回のリクエストにまとめる"""
+    client = FakeVisionClient()
+    batcher = VisionBatcher(client, max_wait=0.2)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        texts = list(pool.map(lambda i: batcher.detect_text(f"page {i}".encode()), range(20)))
+    batcher.close()
+
+    assert texts == [f"page {i}" for i in range(20)]
+    assert max(client.batch_sizes) <= 16
+    assert len(client.batch_sizes) < 20
+    assert batcher.stats()["image_count"] == 20
+
+def test_per_image_errors():
+    """個別画像のエラーはその画像の Future にのみ伝える"""
+    client = FakeVisionClient()
+    batcher = VisionBatcher(client, max_wait=0.05)
+    ok = batcher.submit(b"ok")
+    broken = batcher.submit(b"broken")
+
+    assert ok.result(timeout=2) == "ok"
+    with pytest.raises(VisionBatchError):
+        broken.result(timeout=2)
+    batcher.close()
+
+def test_annotate_file_async_streams_pages_in_order():
+    """出力JSONを開始ページ順に読み込み、ページごとのテキストを返す"""
+    def output(start, texts):
+        return json.dumps({"responses": [
+            {"fullTextAnnotation": {"text": text}, "context": {"pageNumber": start + i}}
+            for i, text in enumerate(texts)
+        ]}).encode()
+
+    blobs = [
+        FakeBlob("out/output-3-to-4.json", output(3, ["三", "四"])),
+        FakeBlob("out/output-1-to-2.json", output(1, ["一", "二"])),
+    ]
+    client = FakeVisionClient()
+    pages = list(annotate_file_async(
+        client, FakeStorageClient(blobs), "gs://in/scan.pdf", "application/pdf", "gs://bucket/out/",
+        pages_per_output=2
+    ))
+
+    assert pages == [(1, "一"), (2, "二"), (3, "三"), (4, "四")]
+    assert client.file_requests[0]["output_config"]["batch_size"] == 2
+    assert all(blob.deleted for blob in blobs)